@@ -0,0 +1,12 @@
+"""Offline benchmarking for the CrowdStrike MISP import.
+
+SyntheticIntel stands in for the FalconPy Intel service class and generates reports, indicators
+and adversaries at a configurable scale, StubMISPServer stands in for the MISP REST API. Run
+`python3 -m benchmark --help` for the end-to-end benchmark command, and
+`python3 -m benchmark.builders --help` for the event builder microbenchmarks.
+"""
+from .synthetic import SyntheticIntel
+from .misp_stub import StubMISPServer
+from .timing import StageRecorder
+
+__all__ = ["SyntheticIntel", "StubMISPServer", "StageRecorder"]
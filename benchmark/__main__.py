@@ -0,0 +1,84 @@
+"""Offline end-to-end benchmark command.
+
+Example:
+    python3 -m benchmark --reports 1000 --indicators 50000 --actors 200 --output results.json
+"""
+import argparse
+import json
+import logging
+from .runner import PATHS, format_results, run_benchmark
+
+
+def parse_command_line():
+    """Parse the running command line provided by the user."""
+    parser = argparse.ArgumentParser(description="Benchmark the MISP import against a synthetic CrowdStrike Intel API"
+                                                 " and a stub MISP server."
+                                     )
+    parser.add_argument("--paths", default=",".join(PATHS),
+                        help=f"Comma delimited list of import paths to run, defaults to {','.join(PATHS)}."
+                        )
+    parser.add_argument("--reports", type=int, default=500, help="Number of synthetic reports.")
+    parser.add_argument("--indicators", type=int, default=20000, help="Number of synthetic indicators.")
+    parser.add_argument("--actors", "--adversaries", dest="actors", type=int, default=100,
+                        help="Number of synthetic adversaries."
+                        )
+    parser.add_argument("--indicators_per_report", type=int, default=20, help="Related indicators per report.")
+    parser.add_argument("--page_size", type=int, default=5000, help="Intel API page size (api_request_max).")
+    parser.add_argument("--threads", type=int, default=16, help="MISP worker threads (max_threads).")
+    parser.add_argument("--grouping", default=None, help="Indicator grouping (indicator_grouping).")
+    parser.add_argument("--intel_latency", type=float, default=0.0, help="Milliseconds added to each Intel API request.")
+    parser.add_argument("--misp_latency", type=float, default=0.0, help="Milliseconds added to each MISP request.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic content.")
+    parser.add_argument("--trace_memory", action="store_true",
+                        help="Also report peak traced Python allocations (tracemalloc), throughput is considerably lower."
+                        )
+    parser.add_argument("--memory_profile", action="store_true",
+                        help="Also report memory use, allocation sites and record counts at each stage boundary."
+                        )
+    parser.add_argument("--config", dest="config_file", help="Configuration file supplying the tagging settings.")
+    parser.add_argument("--output", help="Save the results as JSON to this file.")
+    parser.add_argument("--debug", action="store_true", help="Show the import log.")
+
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmark and report the results."""
+    args = parse_command_line()
+    paths = [p.strip() for p in args.paths.split(",") if p.strip()]
+    unknown = [p for p in paths if p not in PATHS]
+    if unknown:
+        raise SystemExit(f"Unknown import path(s): {', '.join(unknown)}")
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)-8s %(name)s/%(threadName)-10s %(message)s"))
+    log = logging.getLogger("benchmark")
+    log.addHandler(handler)
+    log.propagate = False
+    log.setLevel(logging.DEBUG if args.debug else logging.WARNING)
+    # Duplicate event responses are expected and reported by PyMISP as errors
+    logging.getLogger("pymisp").setLevel(logging.DEBUG if args.debug else logging.CRITICAL)
+
+    results = run_benchmark(paths,
+                            reports=args.reports,
+                            indicators=args.indicators,
+                            actors=args.actors,
+                            indicators_per_report=args.indicators_per_report,
+                            page_size=args.page_size,
+                            threads=args.threads,
+                            grouping=args.grouping,
+                            intel_latency=args.intel_latency / 1000,
+                            misp_latency=args.misp_latency / 1000,
+                            seed=args.seed,
+                            trace_memory=args.trace_memory,
+                            memory_profile=args.memory_profile,
+                            config_file=args.config_file,
+                            logger=log
+                            )
+    print(format_results(results))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
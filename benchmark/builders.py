@@ -0,0 +1,296 @@
+"""Microbenchmarks for the MISP event builders.
+
+Times each event builder in isolation, away from Intel API paging and MISP requests, on
+synthetic fixture records:
+
+    gen_indicator       helper.gen_indicator for single indicators
+    gen_indicators      helper.gen_indicators for pages of indicators (each page counts as one event)
+    indicator_event     IndicatorsImporter.__create_indicator_event for single indicators
+    report              ReportsImporter.create_event_from_report with typical related indicators
+    report_worst_case   ReportsImporter.create_event_from_report with thousands of related indicators
+    actor               ActorsImporter.create_event_from_actor with full kill chain detail
+
+Each builder is timed (wall clock and CPU) over several rounds, then run once more with
+tracemalloc enabled to measure the memory allocated per event. Results can be saved as JSON
+and compared against a previous run.
+
+Example:
+    python3 -m benchmark.builders --output builders.json --baseline previous.json
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from cs_misp_import import CrowdstrikeToMISPImporter, IntelAPIClient, VERSION
+from cs_misp_import.helper import gen_indicator, gen_indicators
+from .misp_stub import StubMISPServer
+from .runner import ROOT, benchmark_import_settings, load_settings
+from .synthetic import SyntheticIntel
+
+# Indicators in each page converted by the gen_indicators builder
+PAGE_SIZE = 100
+BUILDERS = ["gen_indicator", "gen_indicators", "indicator_event", "report", "report_worst_case", "actor"]
+
+
+def _stats(samples: list) -> dict:
+    """Return the mean, p50, p95 and maximum of a list of seconds, in milliseconds."""
+    found = sorted(samples)
+    count = len(found)
+
+    return {
+        "mean_ms": round(sum(found) / count * 1000, 4),
+        "p50_ms": round(found[int(count * 0.5)] * 1000, 4),
+        "p95_ms": round(found[min(count - 1, int(count * 0.95))] * 1000, 4),
+        "max_ms": round(found[-1] * 1000, 4)
+    }
+
+
+def measure(build, fixtures: list, rounds: int = 3) -> dict:
+    """Time a builder over every fixture and measure the memory it allocates per event.
+
+    :param build: callable creating one event (or indicator object) from a fixture tuple
+    :param fixtures: list of argument tuples passed to the builder
+    :param rounds: number of timed passes over the fixtures
+    """
+    wall = []
+    cpu = []
+    for _ in range(max(1, rounds)):
+        gc.collect()
+        for args in fixtures:
+            cpu_started = time.thread_time()
+            started = time.perf_counter()
+            build(*args)
+            wall.append(time.perf_counter() - started)
+            cpu.append(time.thread_time() - cpu_started)
+
+    # Allocations are measured in a separate pass, tracing slows the builders considerably
+    allocated = []
+    retained = []
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for args in fixtures:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            built = build(*args)
+            current, peak = tracemalloc.get_traced_memory()
+            allocated.append(peak - before)
+            retained.append(current - before)
+            del built
+    finally:
+        tracemalloc.stop()
+
+    returned = {"events": len(fixtures), "rounds": max(1, rounds)}
+    returned.update(_stats(wall))
+    returned["cpu_ms"] = round(sum(cpu) / len(cpu) * 1000, 4)
+    returned["events_per_sec"] = round(len(wall) / max(sum(wall), 0.000001), 2)
+    returned["peak_alloc_kb"] = round(sum(allocated) / len(allocated) / 1024, 2)
+    returned["max_peak_alloc_kb"] = round(max(allocated) / 1024, 2)
+    returned["retained_kb"] = round(sum(retained) / len(retained) / 1024, 2)
+
+    return returned
+
+
+def run_builders(builders: list = None,
+                 records: int = 200,
+                 reports: int = 50,
+                 indicators_per_report: int = 20,
+                 worst_case_reports: int = 3,
+                 worst_case_indicators: int = 5000,
+                 actors: int = 50,
+                 rounds: int = 3,
+                 seed: int = 0,
+                 config_file: str = None,
+                 logger: logging.Logger = None
+                 ) -> dict:
+    """Run the selected builder microbenchmarks and return the results.
+
+    :param builders: builders to run, defaults to all
+    :param records: number of indicators used for the gen_indicator and indicator_event builders
+    :param reports: number of typical reports
+    :param indicators_per_report: related indicators for each typical report
+    :param worst_case_reports: number of worst case reports
+    :param worst_case_indicators: related indicators for each worst case report
+    :param actors: number of adversaries, each with full kill chain detail
+    :param rounds: number of timed passes over the fixtures
+    :param seed: seed for the synthetic fixtures
+    :param config_file: configuration file supplying the tagging settings, defaults to misp_import.ini
+    :param logger: logging object
+    """
+    log = logger or logging.getLogger("benchmark")
+    builders = builders or BUILDERS
+    settings, galaxy_maps = load_settings(config_file or os.path.join(ROOT, "misp_import.ini"))
+    intel = SyntheticIntel(reports, records, actors, indicators_per_report, seed)
+    worst = SyntheticIntel(worst_case_reports, 0, actors, worst_case_indicators, seed)
+    results = {
+        "version": VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started": int(time.time()),
+        "parameters": {
+            "records": records, "reports": reports, "indicators_per_report": indicators_per_report,
+            "worst_case_reports": worst_case_reports, "worst_case_indicators": worst_case_indicators,
+            "actors": actors, "rounds": rounds, "seed": seed
+        },
+        "builders": {}
+    }
+    # The importers only contact MISP when they are constructed, to look up the CrowdStrike organisation
+    with StubMISPServer() as server, tempfile.TemporaryDirectory(prefix="misp-import-builders-") as workdir:
+        import_settings = benchmark_import_settings(server, settings, galaxy_maps, workdir, 1, None)
+        intel_api_client = IntelAPIClient(None, None, None, SyntheticIntel.MAX_LIMIT, logger=log, service=intel)
+        importer = CrowdstrikeToMISPImporter(intel_api_client, import_settings,
+                                             {"reports": True, "indicators": True,
+                                              "delete_outdated_indicators": False, "actors": True
+                                              },
+                                             settings, logger=log
+                                             )
+        try:
+            reports_importer = importer.reports_importer
+            reports_importer.known_actors = intel_api_client.get_actor_name_list()
+            # Adversary detail is cached before timing so report events never wait on the API
+            intel_api_client.actor_cache.prefetch(list(range(1, intel.actor_count + 1)))
+            indicators = [intel.indicator(pos) for pos in range(intel.indicator_count)]
+            actor_page = [intel.actor(pos) for pos in range(intel.actor_count)]
+            indicator_tags = settings["CrowdStrike"]["indicators_tags"].split(",")
+            fixtures = {
+                "gen_indicator": (lambda ind: gen_indicator(ind, indicator_tags),
+                                  [(ind,) for ind in indicators]
+                                  ),
+                "gen_indicators": (gen_indicators,
+                                   [(indicators[pos:pos+PAGE_SIZE],) for pos in range(0, len(indicators), PAGE_SIZE)]
+                                   ),
+                "indicator_event": (importer.indicators_importer._IndicatorsImporter__create_indicator_event,  # pylint: disable=W0212
+                                    [(ind,) for ind in indicators]
+                                    ),
+                "report": (reports_importer.create_event_from_report,
+                           [(rpt, rpt, intel.related_indicators(pos))
+                            for pos, rpt in ((p, intel.report(p)) for p in range(intel.report_count))
+                            ]
+                           ),
+                "report_worst_case": (reports_importer.create_event_from_report,
+                                      [(rpt, rpt, worst.related_indicators(pos))
+                                       for pos, rpt in ((p, worst.report(p)) for p in range(worst.report_count))
+                                       ]
+                                      ),
+                "actor": (importer.actors_importer.create_event_from_actor,
+                          [(act, actor_page) for act in actor_page]
+                          )
+            }
+            for name in builders:
+                build, arguments = fixtures[name]
+                if not arguments:
+                    continue
+                log.info("Benchmarking the %s builder (%i fixtures).", name, len(arguments))
+                results["builders"][name] = measure(build, arguments, rounds)
+        finally:
+            importer.scheduler.shutdown()
+            importer.import_index.close()
+
+    return results
+
+
+def compare(results: dict, baseline: dict) -> dict:
+    """Return the relative change (current / baseline) of the CPU and allocation cost of each builder."""
+    returned = {}
+    for name, measured in results["builders"].items():
+        previous = baseline.get("builders", {}).get(name)
+        if not previous:
+            continue
+        returned[name] = {
+            key: round(measured[key] / previous[key], 3) if previous.get(key) else None
+            for key in ("mean_ms", "cpu_ms", "peak_alloc_kb", "retained_kb")
+        }
+
+    return returned
+
+
+def format_results(results: dict, changes: dict = None) -> str:
+    """Return the builder results (and any comparison with a baseline) as a human readable report."""
+    changes = changes or {}
+    lines = [f"CrowdStrike MISP import v{results['version']} event builder benchmark (Python {results['python']})",
+             "",
+             f"  {'builder':<18} {'events':>7} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'cpu ms':>9} "
+             f"{'events/s':>10} {'alloc KB':>10} {'kept KB':>9}"
+             ]
+    for name, measured in results["builders"].items():
+        line = (f"  {name:<18} {measured['events']:>7} {measured['mean_ms']:>9.3f} {measured['p50_ms']:>9.3f} "
+                f"{measured['p95_ms']:>9.3f} {measured['cpu_ms']:>9.3f} {measured['events_per_sec']:>10.1f} "
+                f"{measured['peak_alloc_kb']:>10.1f} {measured['retained_kb']:>9.1f}"
+                )
+        if name in changes:
+            delta = changes[name]
+            line += "  (cpu x{}, alloc x{} vs baseline)".format(delta["cpu_ms"], delta["peak_alloc_kb"])
+        lines.append(line)
+
+    return "\n".join(lines)
+
+
+def parse_command_line():
+    """Parse the running command line provided by the user."""
+    parser = argparse.ArgumentParser(description="Benchmark the MISP event builders on synthetic fixture records.")
+    parser.add_argument("--builders", default=",".join(BUILDERS),
+                        help=f"Comma delimited list of builders to run, defaults to {','.join(BUILDERS)}."
+                        )
+    parser.add_argument("--records", type=int, default=200, help="Indicators used for the indicator builders.")
+    parser.add_argument("--reports", type=int, default=50, help="Number of typical reports.")
+    parser.add_argument("--indicators_per_report", type=int, default=20, help="Related indicators per typical report.")
+    parser.add_argument("--worst_case_reports", type=int, default=3, help="Number of worst case reports.")
+    parser.add_argument("--worst_case_indicators", type=int, default=5000,
+                        help="Related indicators per worst case report."
+                        )
+    parser.add_argument("--actors", "--adversaries", dest="actors", type=int, default=50,
+                        help="Number of adversaries (with full kill chain detail)."
+                        )
+    parser.add_argument("--rounds", type=int, default=3, help="Timed passes over the fixtures.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic fixtures.")
+    parser.add_argument("--config", dest="config_file", help="Configuration file supplying the tagging settings.")
+    parser.add_argument("--output", help="Save the results as JSON to this file.")
+    parser.add_argument("--baseline", help="Compare against results previously saved with --output.")
+    parser.add_argument("--debug", action="store_true", help="Show the import log.")
+
+    return parser.parse_args()
+
+
+def main():
+    """Run the builder microbenchmarks and report the results."""
+    args = parse_command_line()
+    builders = [b.strip() for b in args.builders.split(",") if b.strip()]
+    unknown = [b for b in builders if b not in BUILDERS]
+    if unknown:
+        raise SystemExit(f"Unknown builder(s): {', '.join(unknown)}")
+    log = logging.getLogger("benchmark")
+    log.addHandler(logging.StreamHandler())
+    log.propagate = False
+    log.setLevel(logging.DEBUG if args.debug else logging.WARNING)
+    logging.getLogger("pymisp").setLevel(logging.DEBUG if args.debug else logging.CRITICAL)
+
+    results = run_builders(builders,
+                           records=args.records,
+                           reports=args.reports,
+                           indicators_per_report=args.indicators_per_report,
+                           worst_case_reports=args.worst_case_reports,
+                           worst_case_indicators=args.worst_case_indicators,
+                           actors=args.actors,
+                           rounds=args.rounds,
+                           seed=args.seed,
+                           config_file=args.config_file,
+                           logger=log
+                           )
+    changes = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as baseline:
+            changes = compare(results, json.load(baseline))
+        results["baseline"] = {"file": args.baseline, "changes": changes}
+    print(format_results(results, changes))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
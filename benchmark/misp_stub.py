@@ -0,0 +1,340 @@
+"""Stub MISP REST server used by the offline benchmark.
+
+Implements the subset of the MISP REST API used by PyMISP and the importers (events, attributes,
+objects, event reports, tags, the event index and the event blocklist) against an in-memory store.
+As with MISP's default enableEventBlocklisting setting, deleted event UUIDs are blocklisted. The server runs in
+a child process so its request handling does not compete with the importer for the interpreter,
+and does not appear in the importer's memory measurements.
+"""
+import json
+import multiprocessing
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from pymisp import __version__ as PYMISP_VERSION
+
+# Version reported to PyMISP when it connects
+MISP_VERSION = "2.5.0"
+
+
+class MISPStore:
+    """In-memory MISP event store."""
+
+    def __init__(self):
+        """Construct an empty store."""
+        self.events = {}
+        self.uuids = {}
+        self.blocklist = {}
+        self.next_id = 1
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def _new_id(self) -> str:
+        returned = str(self.next_id)
+        self.next_id += 1
+        return returned
+
+    def _number(self, event: dict):
+        """Assign IDs to the attributes, objects and event reports within a submitted event."""
+        for attribute in event.get("Attribute", []):
+            attribute.setdefault("id", self._new_id())
+            attribute["event_id"] = event["id"]
+        for misp_object in event.get("Object", []):
+            misp_object.setdefault("id", self._new_id())
+            misp_object["event_id"] = event["id"]
+            for attribute in misp_object.get("Attribute", []):
+                attribute.setdefault("id", self._new_id())
+                attribute["event_id"] = event["id"]
+                attribute["object_id"] = misp_object["id"]
+        for event_report in event.get("EventReport", []):
+            event_report.setdefault("id", self._new_id())
+            event_report["event_id"] = event["id"]
+
+    def find(self, key: str) -> dict:
+        """Return the event with the specified ID or UUID."""
+        return self.events.get(self.uuids.get(key, key))
+
+    def add_event(self, event: dict):
+        """Store a new event, returning (status code, response)."""
+        if event.get("uuid") in self.blocklist.values():
+            return 403, {"name": "Event blocked by event blocklist.", "message": "Event blocked by event blocklist.",
+                         "url": "/events/add"
+                         }
+        if event.get("uuid") in self.uuids:
+            return 403, {"name": "Could not add Event", "message": "Could not add Event", "url": "/events/add",
+                         "errors": {"Event": {"uuid": ["An event with this uuid already exists."]}}
+                         }
+        event["id"] = self._new_id()
+        event["timestamp"] = str(int(time.time()))
+        self._number(event)
+        self.events[event["id"]] = event
+        if event.get("uuid"):
+            self.uuids[event["uuid"]] = event["id"]
+
+        return 200, {"Event": event}
+
+    def edit_event(self, key: str, event: dict):
+        """Replace an existing event, returning (status code, response)."""
+        existing = self.find(key)
+        if existing is None:
+            return 404, {"name": "Invalid event", "message": "Invalid event", "url": f"/events/edit/{key}"}
+        if event.get("metadata") or not any(k in event for k in ("Attribute", "Object", "EventReport")):
+            existing.update({k: v for k, v in event.items() if not isinstance(v, (list, dict))})
+        else:
+            event["id"] = existing["id"]
+            event.setdefault("uuid", existing.get("uuid"))
+            self._number(event)
+            self.events[existing["id"]] = existing = event
+        existing["timestamp"] = str(int(time.time()))
+
+        return 200, {"Event": existing}
+
+    def add_child(self, key: str, kind: str, content):
+        """Append attributes, an object or an event report to an event, returning (status code, response)."""
+        existing = self.find(key)
+        if existing is None:
+            return 404, {"name": "Invalid event", "message": "Invalid event", "url": f"/{kind}/add/{key}"}
+        items = [item.get(kind, item) for item in (content if isinstance(content, list) else [content])]
+        present = {child.get("uuid") for child in existing.get(kind, [])}
+        added, errors = [], {}
+        for pos, item in enumerate(items):
+            # As with MISP, attributes and objects are rejected when their UUID is already in use
+            if item.get("uuid") and item["uuid"] in present:
+                errors[str(pos)] = {"uuid": ["The UUID provided is not unique"]}
+                continue
+            present.add(item.get("uuid"))
+            item.setdefault("id", self._new_id())
+            item["event_id"] = existing["id"]
+            existing.setdefault(kind, []).append(item)
+            added.append(item)
+        if not added:
+            return 403, {"name": f"Could not add {kind}", "message": f"Could not add {kind}", "url": f"/{kind}/add/{key}",
+                         "errors": errors if isinstance(content, list) else errors["0"]
+                         }
+        if isinstance(content, list):
+            return 200, {kind: added, **({"errors": errors} if errors else {})}
+
+        return 200, {kind: added[0]}
+
+    def edit_child(self, key: str, kind: str, content: dict):
+        """Update the fields and tags of an attribute or object, returning (status code, response)."""
+        content = content.get(kind, content)
+        for event in self.events.values():
+            for child in event.get(kind, []):
+                if key in (str(child.get("id")), child.get("uuid")):
+                    child.update({k: v for k, v in content.items() if k not in ("id", "uuid", "event_id")})
+                    return 200, {kind: child}
+
+        return 404, {"name": f"Invalid {kind}", "message": f"Invalid {kind}", "url": f"/{kind}/edit/{key}"}
+
+    def index(self, query: dict) -> list:
+        """Return minimal event listings matching the search_index tag, event ID, timestamp and paging filters."""
+        tags = query.get("tags") or query.get("tag") or []
+        tags = set(tags if isinstance(tags, list) else [tags])
+        stamps = query.get("timestamp")
+        event_ids = query.get("eventid")
+        if event_ids is not None:
+            event_ids = {str(key) for key in (event_ids if isinstance(event_ids, list) else [event_ids])}
+        matches = []
+        for event in self.events.values():
+            if event_ids is not None and str(event["id"]) not in event_ids:
+                continue
+            if tags and not tags.intersection(tag.get("name") for tag in event.get("Tag", [])):
+                continue
+            if isinstance(stamps, list) and len(stamps) == 2:
+                # PyMISP sends an open bound as None
+                stamp = int(event.get("timestamp", 0))
+                if stamps[0] is not None and stamp < int(stamps[0]):
+                    continue
+                if stamps[1] is not None and stamp > int(stamps[1]):
+                    continue
+            matches.append(event)
+        if query.get("sort") == "timestamp":
+            matches.sort(key=lambda evt: int(evt.get("timestamp", 0)), reverse=bool(query.get("desc")))
+        limit = int(query.get("limit") or 0)
+        if limit:
+            page = max(int(query.get("page") or 1), 1)
+            matches = matches[(page - 1) * limit:page * limit]
+
+        return [{"id": evt["id"], "uuid": evt.get("uuid"), "info": evt.get("info"), "timestamp": evt.get("timestamp"),
+                 "EventTag": [{"Tag": tag} for tag in evt.get("Tag", [])]
+                 } for evt in matches]
+
+    def delete(self, keys: list) -> int:
+        """Remove events, returning the number removed."""
+        removed = 0
+        for key in keys:
+            event = self.find(str(key))
+            if event is not None:
+                self.events.pop(event["id"], None)
+                self.uuids.pop(event.get("uuid"), None)
+                if event.get("uuid"):
+                    self.blocklist[self._new_id()] = event["uuid"]
+                removed += 1
+
+        return removed
+
+
+class StubMISPHandler(BaseHTTPRequestHandler):
+    """Route MISP REST API requests to the server's MISPStore."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        """Silence the per-request access log."""
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Handle a GET request."""
+        self._dispatch("GET")
+
+    def do_POST(self):  # pylint: disable=C0103
+        """Handle a POST request."""
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = {}
+        path = self.path.split("?", 1)[0].strip("/")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        store: MISPStore = self.server.store
+        with store.lock:
+            endpoint = re.sub(r"/(\d+|[0-9a-f]{8}-[0-9a-f-]{27})(?=/|$)", "/{id}", path)
+            store.requests[f"{method} {endpoint}"] = store.requests.get(f"{method} {endpoint}", 0) + 1
+            status, response = self._route(store, method, path, data)
+            # Serialised while locked, the response may reference a stored event
+            payload = json.dumps(response).encode("utf-8")
+        self._send(status, payload)
+
+    @staticmethod
+    def _route(store: MISPStore, method: str, path: str, data):  # pylint: disable=R0911,R0912
+        parts = path.split("/")
+        if path == "servers/getPyMISPVersion.json":
+            return 200, {"version": PYMISP_VERSION}
+        if path == "servers/getVersion":
+            return 200, {"version": MISP_VERSION, "perm_sync": True, "perm_sighting": True}
+        if path == "users/view/me":
+            return 200, {"User": {"id": "1", "email": "benchmark@example.com", "org_id": "1", "role_id": "1"},
+                         "Role": {"id": "1", "name": "admin", "perm_site_admin": True},
+                         "UserSetting": {}
+                         }
+        if parts[0] == "organisations" and len(parts) == 3:
+            return 200, {"Organisation": {"id": "1", "name": "CrowdStrike", "uuid": parts[2], "local": True}}
+        if path == "_benchmark/stats":
+            return 200, {"requests": dict(store.requests), "events": len(store.events)}
+        if parts[0] == "events":
+            if parts[1] == "add":
+                return store.add_event(data.get("Event", data))
+            if parts[1] == "edit":
+                return store.edit_event(parts[2], data.get("Event", data))
+            if parts[1] == "view":
+                event = store.find(parts[2])
+                if event is None:
+                    return 404, {"name": "Invalid event", "message": "Invalid event", "url": f"/{path}"}
+                return 200, {"Event": event}
+            if parts[1] == "index":
+                return 200, store.index(data)
+            if parts[1] == "delete":
+                ids = [parts[2]] if len(parts) > 2 else data.get("id", [])
+                removed = store.delete(ids if isinstance(ids, list) else [ids])
+                if not removed:
+                    return 404, {"name": "Invalid event", "message": "Invalid event", "url": f"/{path}"}
+                return 200, {"saved": True, "success": True, "name": f"{removed} events deleted", "message": "Deleted"}
+        if parts[0] == "eventBlocklists":
+            if parts[1] == "index":
+                return 200, [{"EventBlocklist": {"id": key, "event_uuid": uuid, "comment": "Deleted"}}
+                             for key, uuid in store.blocklist.items()
+                             ]
+            if parts[1] == "delete" and store.blocklist.pop(parts[2], None):
+                return 200, {"saved": True, "success": True, "name": "Blocklist entry removed", "message": "Removed"}
+            return 404, {"name": "Invalid blocklist entry", "message": "Invalid blocklist entry", "url": f"/{path}"}
+        if parts[0] == "attributes" and parts[1] == "add":
+            return store.add_child(parts[2], "Attribute", data)
+        if parts[0] == "objects" and parts[1] == "add":
+            return store.add_child(parts[2], "Object", data)
+        if parts[0] == "eventReports" and parts[1] == "add":
+            return store.add_child(parts[2], "EventReport", data)
+        if parts[0] in ("attributes", "objects") and parts[1] == "edit":
+            return store.edit_child(parts[2], {"attributes": "Attribute", "objects": "Object"}[parts[0]], data)
+        if parts[0] in ("attributes", "objects", "eventReports") and parts[1] in ("edit", "delete"):
+            # Other edits are acknowledged without changing the stored event
+            kind = {"attributes": "Attribute", "objects": "Object", "eventReports": "EventReport"}[parts[0]]
+            return 200, {kind: data.get(kind, data)} if parts[1] == "edit" else {"message": "Deleted"}
+        if parts[0] == "tags" and parts[1] in ("attachTagToObject", "removeTagFromObject"):
+            return 200, {"name": "Tag updated", "message": "Tag updated", "url": f"/{path}", "saved": True, "success": True}
+        if parts[0] == "tags" and (len(parts) == 1 or parts[1] == "index"):
+            return 200, {"Tag": []}
+
+        return 404, {"name": "Not found", "message": f"No stub for {method} /{path}", "url": f"/{path}"}
+
+    def _send(self, status: int, payload: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def _serve(ready, latency: float):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubMISPHandler)
+    server.daemon_threads = True
+    server.store = MISPStore()
+    server.latency = latency
+    ready.send(server.server_address[1])
+    ready.close()
+    server.serve_forever()
+
+
+class StubMISPServer:
+    """Stub MISP REST server running in a child process.
+
+    Use as a context manager, the server is stopped on exit. Point the MISP client at `url`.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        """Construct an instance of the StubMISPServer class.
+
+        :param latency: seconds added to every request to simulate the network round trip and server processing
+        """
+        self.latency = float(latency)
+        self.process = None
+        self.port = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the running server."""
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        """Start the server and wait until it is accepting connections."""
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=_serve, args=(sender, self.latency), name="stub-misp", daemon=True)
+        self.process.start()
+        self.port = receiver.recv()
+        receiver.close()
+
+        return self
+
+    def stats(self) -> dict:
+        """Return the number of requests handled per endpoint and the number of stored events."""
+        return requests.get(f"{self.url}/_benchmark/stats", timeout=30).json()
+
+    def stop(self):
+        """Stop the server."""
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
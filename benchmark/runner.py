@@ -0,0 +1,248 @@
+"""End-to-end import benchmark against the synthetic Intel API and stub MISP server.
+
+Each selected import path (reports, indicators and adversaries) is run separately through
+CrowdstrikeToMISPImporter, exactly as misp_import.py runs it, and measured for throughput,
+per-stage call latency and peak memory.
+"""
+import logging
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from configparser import ConfigParser, ExtendedInterpolation
+from cs_misp_import import CrowdstrikeToMISPImporter, IntelAPIClient, MemoryProfiler, VERSION, install_memory_profiler
+from .misp_stub import StubMISPServer
+from .synthetic import SyntheticIntel
+from .timing import MemoryMonitor, StageRecorder
+
+# Repository root, used to locate the default configuration and galaxy mapping files
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Organisation UUID used for the synthetic CrowdStrike organisation
+BENCHMARK_ORG_UUID = "a8d9a4c0-8f6c-4d5e-9b1a-2c3d4e5f6a7b"
+PATHS = ["reports", "indicators", "actors"]
+# Methods timed on each object, as (attribute, stage name)
+INTEL_STAGES = [("query_report_entities", "intel.query_report_entities"),
+                ("query_indicator_entities", "intel.query_indicator_entities"),
+                ("query_actor_entities", "intel.query_actor_entities"),
+                ("get_actor_entities", "intel.get_actor_entities")
+                ]
+MISP_STAGES = [("add_event", "misp.add_event"),
+               ("update_event", "misp.update_event"),
+               ("upsert_event", "misp.upsert_event"),
+               ("update_event_delta", "misp.update_event_delta"),
+               ("add_attribute", "misp.add_attribute"),
+               ("add_object", "misp.add_object")
+               ]
+BUILD_STAGES = {
+    "reports": ("reports_importer", [("create_event_from_report", "build.report"),
+                                     ("batch_related_indicators", "intel.related_indicators")
+                                     ]),
+    "indicators": ("indicators_importer", [("convert_indicators", "build.indicator_page")]),
+    "actors": ("actors_importer", [("create_event_from_actor", "build.actor")])
+}
+
+
+def load_settings(config_file: str):
+    """Read the configuration and galaxy mapping files, returning (settings, galaxy_maps)."""
+    settings = ConfigParser(interpolation=ExtendedInterpolation())
+    if not settings.read(config_file):
+        raise SystemExit(f"Unable to read configuration file {config_file}.")
+    galaxy_maps = ConfigParser(interpolation=ExtendedInterpolation())
+    galaxy_file = settings["MISP"].get("galaxy_map_file", "galaxy.ini")
+    galaxy_maps.read(os.path.join(os.path.dirname(os.path.abspath(config_file)), galaxy_file))
+    if not galaxy_maps.has_section("Galaxy"):
+        galaxy_maps.add_section("Galaxy")
+
+    return settings, galaxy_maps
+
+
+def benchmark_import_settings(server: StubMISPServer, settings: ConfigParser, galaxy_maps: ConfigParser, workdir: str,
+                              threads: int, grouping: str
+                              ) -> dict:
+    """Return the import settings for an importer writing its tracking files to the working directory."""
+    return {
+        "misp_url": server.url,
+        "misp_auth_key": "benchmark",
+        "crowdstrike_org_uuid": BENCHMARK_ORG_UUID,
+        "reports_timestamp_filename": os.path.join(workdir, "lastReportsUpdate.dat"),
+        "indicators_timestamp_filename": os.path.join(workdir, "lastIndicatorsUpdate.dat"),
+        "actors_timestamp_filename": os.path.join(workdir, "lastActorsUpdate.dat"),
+        "import_index_filename": None,
+        "purge_checkpoint_filename": None,
+        "unknown_mapping": settings["CrowdStrike"].get("unknown_mapping", None) or "Unidentified",
+        "indicator_grouping": grouping,
+        "max_threads": threads,
+        "miss_track_file": os.path.join(workdir, "no_galaxy_mapping.log"),
+        "misp_enable_ssl": False,
+        "galaxy_map": galaxy_maps["Galaxy"],
+        "force": False,
+        "no_banners": True
+    }
+
+
+def run_benchmark(paths: list = None,
+                  reports: int = 500,
+                  indicators: int = 20000,
+                  actors: int = 100,
+                  indicators_per_report: int = 20,
+                  page_size: int = 5000,
+                  threads: int = 16,
+                  grouping: str = None,
+                  intel_latency: float = 0.0,
+                  misp_latency: float = 0.0,
+                  seed: int = 0,
+                  trace_memory: bool = False,
+                  memory_profile: bool = False,
+                  config_file: str = None,
+                  logger: logging.Logger = None
+                  ) -> dict:
+    """Run the selected import paths and return the benchmark results.
+
+    :param paths: import paths to run (reports, indicators and / or actors), defaults to all
+    :param reports: number of synthetic reports
+    :param indicators: number of synthetic indicators in the indicator feed
+    :param actors: number of synthetic adversaries
+    :param indicators_per_report: number of related indicators for each report
+    :param page_size: Intel API page size (api_request_max)
+    :param threads: MISP worker threads (max_threads)
+    :param grouping: indicator grouping dimension (indicator_grouping), defaults to one event per indicator
+    :param intel_latency: seconds added to each Intel API request
+    :param misp_latency: seconds added to each MISP request
+    :param seed: seed for the synthetic content
+    :param trace_memory: also trace Python allocations to report their peak (slows the run considerably)
+    :param memory_profile: also profile memory at the stage boundaries of each import path (slows the run considerably)
+    :param config_file: configuration file supplying the tagging settings, defaults to misp_import.ini
+    :param logger: logging object
+    """
+    log = logger or logging.getLogger("benchmark")
+    settings, galaxy_maps = load_settings(config_file or os.path.join(ROOT, "misp_import.ini"))
+    intel = SyntheticIntel(reports, indicators, actors, indicators_per_report, seed, intel_latency)
+    records = {"reports": intel.report_count, "indicators": intel.indicator_count, "actors": intel.actor_count}
+    recorder = StageRecorder()
+    for method, stage in INTEL_STAGES:
+        recorder.wrap(intel, method, stage)
+    results = {
+        "version": VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started": int(time.time()),
+        "parameters": {
+            "reports": reports, "indicators": indicators, "actors": actors,
+            "indicators_per_report": indicators_per_report, "page_size": page_size, "threads": threads,
+            "grouping": grouping, "intel_latency": intel_latency, "misp_latency": misp_latency, "seed": seed,
+            "trace_memory": trace_memory, "memory_profile": memory_profile
+        },
+        "paths": {}
+    }
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with StubMISPServer(misp_latency) as server, tempfile.TemporaryDirectory(prefix="misp-import-bench-") as workdir:
+            for path in paths or PATHS:
+                log.info("Benchmarking the %s import (%i records).", path, records[path])
+                results["paths"][path] = run_path(path, intel, server, recorder, settings, galaxy_maps,
+                                                  os.path.join(workdir, path), page_size, threads, grouping, log,
+                                                  memory_profile
+                                                  )
+                results["paths"][path]["records"] = records[path]
+                results["paths"][path]["records_per_sec"] = round(
+                    records[path] / max(results["paths"][path]["elapsed_s"], 0.000001), 2
+                    )
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return results
+
+
+def run_path(path: str, intel: SyntheticIntel, server: StubMISPServer, recorder: StageRecorder,
+             settings: ConfigParser, galaxy_maps: ConfigParser, workdir: str, page_size: int, threads: int,
+             grouping: str, log: logging.Logger, memory_profile: bool = False
+             ) -> dict:
+    """Run a single import path against an empty working directory and return its measurements."""
+    os.makedirs(workdir, exist_ok=True)
+    import_settings = benchmark_import_settings(server, settings, galaxy_maps, workdir, threads, grouping)
+    provided_arguments = {
+        "reports": path == "reports",
+        "indicators": path == "indicators",
+        "delete_outdated_indicators": False,
+        "actors": path == "actors"
+    }
+    intel_api_client = IntelAPIClient(None, None, None, page_size, logger=log, service=intel)
+    importer = CrowdstrikeToMISPImporter(intel_api_client, import_settings, provided_arguments, settings, logger=log)
+    for method, stage in MISP_STAGES:
+        recorder.wrap(importer.misp_client, method, stage)
+    attribute, stages = BUILD_STAGES[path]
+    for method, stage in stages:
+        recorder.wrap(getattr(importer, attribute), method, stage)
+
+    recorder.reset()
+    requests_before = server.stats()
+    intel_requests = intel.requests
+    traced_before = 0
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+    profiler = None
+    if memory_profile:
+        profiler = MemoryProfiler().start()
+        install_memory_profiler(profiler)
+    try:
+        with MemoryMonitor() as memory:
+            started = time.perf_counter()
+            importer.import_from_crowdstrike(reports_days_before=1, indicators_minutes_before=1440, actors_days_before=1)
+            elapsed = time.perf_counter() - started
+    finally:
+        install_memory_profiler(None)
+    measured = {
+        "elapsed_s": round(elapsed, 4),
+        "start_rss_mb": round(memory.start_rss / 1048576, 2),
+        "peak_rss_mb": round(memory.peak_rss / 1048576, 2)
+    }
+    if tracemalloc.is_tracing():
+        measured["peak_traced_mb"] = round((tracemalloc.get_traced_memory()[1] - traced_before) / 1048576, 2)
+    requests_after = server.stats()
+    measured["events_created"] = requests_after["events"] - requests_before["events"]
+    measured["intel_requests"] = intel.requests - intel_requests
+    measured["misp_requests"] = {
+        endpoint: count - requests_before["requests"].get(endpoint, 0)
+        for endpoint, count in sorted(requests_after["requests"].items())
+        if count - requests_before["requests"].get(endpoint, 0)
+    }
+    measured["stages"] = recorder.summary()
+    if profiler:
+        measured["memory_profile"] = profiler.summary()
+        profiler.stop()
+    importer.scheduler.shutdown()
+    importer.import_index.close()
+
+    return measured
+
+
+def format_results(results: dict) -> str:
+    """Return the benchmark results as a human readable report."""
+    lines = [f"CrowdStrike MISP import v{results['version']} benchmark (Python {results['python']})"]
+    for path, measured in results["paths"].items():
+        memory = f", peak RSS {measured['peak_rss_mb']:.1f} MB (from {measured['start_rss_mb']:.1f} MB)"
+        if "peak_traced_mb" in measured:
+            memory += f", peak traced allocations {measured['peak_traced_mb']:.1f} MB"
+        lines.append("")
+        lines.append(f"{path}: {measured['records']} records in {measured['elapsed_s']:.2f}s "
+                     f"({measured['records_per_sec']:.1f} records/sec), {measured['events_created']} events created, "
+                     f"{measured['intel_requests']} Intel requests{memory}"
+                     )
+        lines.append(f"  {'stage':<32} {'calls':>8} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+        for stage, stats in measured["stages"].items():
+            lines.append(f"  {stage:<32} {stats['calls']:>8} {stats['total_s']:>9.3f} {stats['mean_ms']:>9.2f} "
+                         f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['max_ms']:>9.2f}"
+                         )
+        for stream, profiled in measured.get("memory_profile", {}).get("streams", {}).items():
+            lines.append(f"  {stream + ' memory':<32} {'samples':>8} {'traced MB':>10} {'RSS MB':>9}  max objects")
+            for stage, boundary in profiled["stages"].items():
+                objects = ", ".join(f"{kind} {count}" for kind, count in boundary["max_objects"].items())
+                lines.append(f"    {stage:<30} {boundary['samples']:>8} {boundary['max_traced_mb']:>10.1f} "
+                             f"{boundary['max_rss_mb']:>9.1f}  {objects}"
+                             )
+
+    return "\n".join(lines)
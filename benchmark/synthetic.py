@@ -0,0 +1,392 @@
+"""Synthetic stand-in for the CrowdStrike Falcon Intel API.
+
+SyntheticIntel implements the FalconPy Intel methods used by the importers and returns
+FalconPy style responses. Records are generated on request from their position and a seed,
+so the same scale and seed always produce the same data and nothing is held in memory
+between requests. Paging follows the real API: reports and adversaries use offsets, indicators
+use inclusive `_marker` filters.
+"""
+import random
+import re
+import string
+import threading
+import time
+from cs_misp_import.adversary import Adversary
+from cs_misp_import.helper import INDICATOR_TYPES
+
+# Report types used for synthetic report IDs (quarterly reports are identified by a Q in the ID)
+REPORT_TYPES = ["CSA", "CSIR", "CSIT", "CSDR", "CSWR", "CSMR", "CSGT", "CSTA"]
+# Mapped (see galaxy.ini) and unmapped malware families
+MALWARE_FAMILIES = ["njRAT", "Qakbot", "Tinba", "Nymaim", "Pony", "DarkComet", "GandCrab", "Geodo",
+                    "SyntheticLoader", "SyntheticStealer"
+                    ]
+ADJECTIVES = ["FANCY", "COZY", "VENOMOUS", "WIZARD", "SCATTERED", "GOBLIN", "VELVET", "MUMMY", "PIONEER",
+              "STARDUST", "LABYRINTH", "INDRIK", "OUTLAW", "PROPHET", "CHARMING", "EMBER"
+              ]
+COUNTRIES = ["United States", "United Kingdom", "Germany", "Japan", "Brazil", "India", "Australia", "Canada"]
+INDUSTRIES = ["Financial Services", "Government", "Healthcare", "Technology", "Energy", "Retail", "Telecommunications"]
+CONFIDENCE = ["high", "medium", "low", "unverified"]
+WORDS = ["alpha", "bravo", "cobalt", "delta", "ember", "falcon", "granite", "harbor", "indigo", "juniper",
+         "kestrel", "lumen", "meridian", "nimbus", "onyx", "pylon", "quartz", "raven", "sierra", "tundra"
+         ]
+# Seconds of history the synthetic records are spread across, ending at the time the stand-in is created
+HISTORY = 3000
+
+LOREM = ("The adversary continues to target organisations with spear-phishing campaigns that deliver "
+         "loaders, credential stealers and remote access tools. Infrastructure is rotated frequently "
+         "and reused across campaigns. ")
+
+
+def _hex(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice("0123456789abcdef") for _ in range(length))
+
+
+def _domain(rng: random.Random) -> str:
+    return f"{rng.choice(WORDS)}{rng.randint(1, 99999)}.{rng.choice(['com', 'net', 'org', 'info', 'io'])}"
+
+
+def _indicator_value(rng: random.Random, indicator_type: str) -> str:
+    generators = {
+        "hash_md5": lambda: _hex(rng, 32),
+        "hash_sha256": lambda: _hex(rng, 64),
+        "hash_sha1": lambda: _hex(rng, 40),
+        "hash_imphash": lambda: _hex(rng, 32),
+        "file_name": lambda: f"{rng.choice(WORDS)}{rng.randint(1, 9999)}.exe",
+        "file_path": lambda: f"C:\\Users\\Public\\{rng.choice(WORDS)}\\{rng.choice(WORDS)}.dll",
+        "url": lambda: f"http://{_domain(rng)}/{rng.choice(WORDS)}/{_hex(rng, 8)}.php",
+        "mutex_name": lambda: f"Global\\{_hex(rng, 16)}",
+        "bitcoin_address": lambda: "1" + "".join(rng.choice(string.ascii_letters + string.digits) for _ in range(33)),
+        "coin_address": lambda: "0x" + _hex(rng, 40),
+        "email_address": lambda: f"{rng.choice(WORDS)}{rng.randint(1, 999)}@{_domain(rng)}",
+        "email_subject": lambda: f"Invoice {rng.randint(1000, 99999)} overdue",
+        "registry": lambda: f"HKEY_CURRENT_USER\\Software\\{rng.choice(WORDS).title()}\\{_hex(rng, 6)}",
+        "device_name": lambda: f"DESKTOP-{_hex(rng, 7).upper()}",
+        "domain": lambda: _domain(rng),
+        "campaign_id": lambda: f"CAMPAIGN-{rng.randint(1, 9999)}",
+        "ip_address": lambda: ".".join(str(rng.randint(1, 254)) for _ in range(4)),
+        "service_name": lambda: f"{rng.choice(WORDS)}svc",
+        "user_agent": lambda: f"Mozilla/5.0 (Windows NT 10.0; {rng.choice(WORDS)})",
+        "port": lambda: str(rng.randint(1, 65535)),
+        "password": lambda: _hex(rng, 12),
+        "username": lambda: f"{rng.choice(WORDS)}{rng.randint(1, 999)}",
+        "x509_serial": lambda: _hex(rng, 16),
+        "x509_subject": lambda: f"CN={_domain(rng)}",
+    }
+
+    return generators[indicator_type]()
+
+
+def actor_name(position: int) -> str:
+    """Return the (unique) adversary name for a position, such as FANCY BEAR."""
+    branches = [adv.name for adv in Adversary]
+    adjective = ADJECTIVES[position % len(ADJECTIVES)]
+    suffix = position // (len(ADJECTIVES) * len(branches))
+    if suffix:
+        adjective = f"{adjective}{suffix}"
+
+    return f"{adjective} {branches[(position // len(ADJECTIVES)) % len(branches)]}"
+
+
+def make_indicator(rng: random.Random, indicator_id: str, last_updated: int, marker: str,
+                   report_ids: list = None, actor_names: list = None
+                   ) -> dict:
+    """Return a synthetic indicator record."""
+    indicator_type = rng.choice(INDICATOR_TYPES)
+    actors = [name.replace(" ", "") for name in actor_names or []]
+    families = rng.sample(MALWARE_FAMILIES, rng.randint(0, 2))
+    confidence = rng.choice(CONFIDENCE)
+    labels = [{"name": f"MaliciousConfidence/{confidence.title()}", "created_on": last_updated},
+              {"name": "ThreatType/Criminal", "created_on": last_updated},
+              {"name": "KillChain/C2", "created_on": last_updated}
+              ]
+    labels.extend({"name": f"Actor/{actor}", "created_on": last_updated} for actor in actors)
+    labels.extend({"name": f"Malware/{family}", "created_on": last_updated} for family in families)
+
+    return {
+        "id": indicator_id,
+        "indicator": _indicator_value(rng, indicator_type),
+        "type": indicator_type,
+        "deleted": False,
+        "published_date": last_updated - rng.randint(0, 86400),
+        "last_updated": last_updated,
+        "reports": list(report_ids or []),
+        "actors": actors,
+        "malware_families": families,
+        "kill_chains": ["C2"],
+        "ip_address_types": [],
+        "domain_types": [],
+        "malicious_confidence": confidence,
+        "_marker": marker,
+        "labels": labels,
+        "relations": [],
+        "targets": rng.sample(INDUSTRIES, rng.randint(0, 2)),
+        "threat_types": ["Criminal"],
+        "vulnerabilities": []
+    }
+
+
+def make_actor(rng: random.Random, actor_id: int, name: str, last_modified: int, kill_chain: bool = True) -> dict:
+    """Return a synthetic adversary record including the extended (__full__) detail fields."""
+    slug = name.lower().replace(" ", "-")
+    first = last_modified - rng.randint(86400 * 30, 86400 * 3000)
+    actor = {
+        "id": actor_id,
+        "name": name,
+        "slug": slug,
+        "url": f"https://falcon.crowdstrike.com/intelligence/actors/{slug}/",
+        "short_description": f"{name.title()} is a synthetic adversary. {LOREM}",
+        "description": LOREM * rng.randint(5, 20),
+        "actor_type": rng.choice(["adversary", "targeted", "criminal"]),
+        "first_activity_date": first,
+        "last_activity_date": last_modified - rng.randint(0, 86400 * 30),
+        "last_modified_date": last_modified,
+        "created_date": first,
+        "known_as": ", ".join(f"{rng.choice(WORDS).title()}{rng.randint(1, 99)}" for _ in range(rng.randint(1, 6))),
+        "origins": [{"id": 1, "slug": "ru", "value": Adversary[name.split(" ")[1]].value}],
+        "motivations": [{"id": 1, "slug": "criminal", "value": "Criminal"},
+                        {"id": 2, "slug": "state-sponsored", "value": "State-Sponsored"}
+                        ],
+        "capability": {"id": 1, "slug": "above-average", "value": rng.choice(["Above Average", "Average", "Below Average"])},
+        "target_countries": [{"id": n, "slug": c.lower(), "value": c} for n, c in enumerate(rng.sample(COUNTRIES, 3))],
+        "target_industries": [{"id": n, "slug": i.lower(), "value": i} for n, i in enumerate(rng.sample(INDUSTRIES, 3))],
+    }
+    if kill_chain:
+        actor["kill_chain"] = {
+            "reconnaissance": f"{LOREM}\r\nOpen source research of targets.",
+            "weaponization": f"{LOREM}\r\nMacro enabled documents.",
+            "delivery": f"{LOREM}\r\nSpear-phishing\r\nWatering hole",
+            "exploitation": "CVE-2017-11882, CVE-2018-0802\r\nCVE-2021-40444, User execution",
+            "installation": f"{LOREM}\r\nScheduled tasks and services.",
+            "command_and_control": f"{LOREM}\r\nHTTPS with domain fronting.",
+            "actions_and_objectives": f"{LOREM}\r\nCredential theft and data exfiltration.",
+        }
+
+    return actor
+
+
+def make_report(rng: random.Random, position: int, last_modified: int, actors: list) -> dict:
+    """Return a synthetic report record with the fields requested by the reports importer."""
+    report_id = f"{REPORT_TYPES[position % len(REPORT_TYPES)]}-{position + 1:06d}"
+    slug = report_id.lower()
+
+    return {
+        "id": position + 1,
+        "name": f"{report_id} {rng.choice(WORDS).title()} {rng.choice(WORDS).title()} Activity Update",
+        "slug": slug,
+        "url": f"https://falcon.crowdstrike.com/intelligence/reports/{slug}/",
+        "short_description": f"{LOREM}{LOREM}",
+        "description": LOREM * rng.randint(10, 60),
+        "attachments": [{"url": f"https://falcon.crowdstrike.com/intelligence/reports/{slug}.pdf"}],
+        "created_date": last_modified - rng.randint(0, 86400),
+        "last_modified_date": last_modified,
+        "actors": [{"id": act["id"], "name": act["name"], "slug": act["slug"]} for act in actors],
+        "target_countries": [{"id": n, "slug": c.lower(), "value": c} for n, c in enumerate(rng.sample(COUNTRIES, 2))],
+        "target_industries": [{"id": n, "slug": i.lower(), "value": i} for n, i in enumerate(rng.sample(INDUSTRIES, 2))],
+    }
+
+
+class SyntheticIntel:
+    """In-process stand-in for the FalconPy Intel service class.
+
+    Pass an instance to IntelAPIClient as the `service` argument. Every method returns a
+    FalconPy style response dictionary (status_code, headers and body).
+    """
+
+    # Matches the page size limit of the US-1 region
+    MAX_LIMIT = 5000
+
+    def __init__(self,
+                 reports: int = 1000,
+                 indicators: int = 10000,
+                 actors: int = 100,
+                 indicators_per_report: int = 10,
+                 seed: int = 0,
+                 latency: float = 0.0
+                 ):
+        """Construct an instance of the SyntheticIntel class.
+
+        :param reports: number of reports available
+        :param indicators: number of indicators available from the indicator feed
+        :param actors: number of adversaries available
+        :param indicators_per_report: number of related indicators returned for each report
+        :param seed: seed for the generated content
+        :param latency: seconds added to every request to simulate the network round trip
+        """
+        self.report_count = max(0, int(reports))
+        self.indicator_count = max(0, int(indicators))
+        self.actor_count = max(0, int(actors))
+        self.indicators_per_report = max(0, int(indicators_per_report))
+        self.seed = seed
+        self.latency = float(latency)
+        self.now = int(time.time())
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    # Generated records, each position always produces the same record
+
+    def _stamp(self, position: int, count: int) -> int:
+        return self.now - HISTORY + (position * HISTORY) // max(count, 1)
+
+    def _rng(self, *parts) -> random.Random:
+        return random.Random(":".join(str(part) for part in (self.seed, *parts)))
+
+    def actor(self, position: int) -> dict:
+        """Return the adversary at a position."""
+        return make_actor(self._rng("actor", position), position + 1, actor_name(position),
+                          self._stamp(position, self.actor_count)
+                          )
+
+    def report(self, position: int) -> dict:
+        """Return the report at a position."""
+        rng = self._rng("report", position)
+        actors = [self.actor(rng.randrange(self.actor_count)) for _ in range(rng.randint(0, 2))] if self.actor_count else []
+
+        return make_report(rng, position, self._stamp(position, self.report_count), actors)
+
+    def indicator(self, position: int) -> dict:
+        """Return the indicator at a position within the indicator feed."""
+        rng = self._rng("indicator", position)
+        actors = [actor_name(rng.randrange(self.actor_count))] if self.actor_count and rng.random() < 0.3 else []
+
+        return make_indicator(rng, f"synthetic-indicator-{position}", self._stamp(position, self.indicator_count),
+                              self._marker(position), actors
+                              )
+
+    def related_indicators(self, report_position: int) -> list:
+        """Return the indicators related to the report at a position."""
+        report = self.report(report_position)
+        report_id = report["name"].split(" ")[0]
+        names = [act["name"] for act in report["actors"]]
+        returned = []
+        for pos in range(self.indicators_per_report):
+            rng = self._rng("related", report_position, pos)
+            returned.append(make_indicator(rng, f"synthetic-related-{report_position}-{pos}",
+                                           report["last_modified_date"],
+                                           f"{report['last_modified_date']}{report_position:07d}{pos:06d}",
+                                           [report_id], names
+                                           ))
+
+        return returned
+
+    def _marker(self, position: int) -> str:
+        return f"{self._stamp(position, self.indicator_count)}{position:09d}"
+
+    # FalconPy Intel methods
+
+    def query_report_entities(self, offset: int = 0, limit: int = 10, filter: str = None, **_):  # pylint: disable=W0622
+        """Return reports modified after the `last_modified_date:>` filter, paged by offset."""
+        first = self._first_after(self._filter_value(filter, "last_modified_date:>"), self.report_count)
+        positions = range(first, self.report_count)
+
+        return self._paged(positions, self.report, offset, limit)
+
+    def get_report_entities(self, ids: list = None, **_):
+        """Return the reports with the specified IDs."""
+        wanted = {int(i) for i in ids or [] if str(i).isdigit()}
+
+        return self._respond([self.report(i - 1) for i in sorted(wanted) if 0 < i <= self.report_count])
+
+    def query_actor_entities(self, offset: int = 0, limit: int = 10, **_):
+        """Return every adversary, paged by offset."""
+        return self._paged(range(self.actor_count), self.actor, offset, limit)
+
+    def get_actor_entities(self, ids: list = None, **_):
+        """Return the adversaries with the specified IDs."""
+        wanted = {int(i) for i in ids or [] if str(i).isdigit()}
+
+        return self._respond([self.actor(i - 1) for i in sorted(wanted) if 0 < i <= self.actor_count])
+
+    def query_indicator_entities(self, limit: int = 10, filter: str = "", **_):  # pylint: disable=W0622
+        """Return indicators from the `_marker:>=` position, restricted to the `reports:` filter when provided."""
+        limit = min(int(limit or 10), self.MAX_LIMIT)
+        marker = self._filter_value(filter, "_marker:>=") or ""
+        related = re.search(r"reports:\[([^\]]*)\]", filter or "")
+        if related:
+            positions = sorted({self._report_position(rid) for rid in re.findall(r"'([^']+)'", related.group(1))} - {None})
+            found = [ind for pos in positions for ind in self.related_indicators(pos) if ind["_marker"] >= marker]
+            found.sort(key=lambda ind: ind["_marker"])
+            return self._respond(found[:limit], total=len(found), limit=limit)
+
+        first = self._first_marker(marker)
+        indicators = [self.indicator(pos) for pos in range(first, min(first + limit, self.indicator_count))]
+
+        return self._respond(indicators, total=self.indicator_count - first, limit=limit)
+
+    # Paging helpers
+
+    def _report_position(self, report_id: str) -> int:
+        try:
+            position = int(report_id.split("-")[1]) - 1
+        except (IndexError, ValueError):
+            return None
+
+        return position if 0 <= position < self.report_count else None
+
+    @staticmethod
+    def _filter_value(filter_str: str, prefix: str) -> str:
+        if not filter_str or prefix not in filter_str:
+            return None
+        value = filter_str.split(prefix, 1)[1].split("+", 1)[0]
+
+        return value.strip("'\"")
+
+    def _first_after(self, value, count: int) -> int:
+        """Return the first position stamped after the provided timestamp."""
+        try:
+            stamp = int(value)
+        except (TypeError, ValueError):
+            return 0
+        low, high = 0, count
+        while low < high:
+            mid = (low + high) // 2
+            if self._stamp(mid, count) > stamp:
+                high = mid
+            else:
+                low = mid + 1
+
+        return low
+
+    def _first_marker(self, marker: str) -> int:
+        """Return the first feed position with a marker at or after the provided marker."""
+        low, high = 0, self.indicator_count
+        while low < high:
+            mid = (low + high) // 2
+            if self._marker(mid) >= marker:
+                high = mid
+            else:
+                low = mid + 1
+
+        return low
+
+    def _paged(self, positions: range, build, offset: int, limit: int) -> dict:
+        offset = int(offset or 0)
+        limit = min(int(limit or 10), self.MAX_LIMIT)
+        page = positions[offset:offset + limit]
+
+        return self._respond([build(pos) for pos in page], total=len(positions), limit=limit, offset=offset)
+
+    def _respond(self, resources: list, total: int = None, limit: int = None, offset: int = 0) -> dict:
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        return {
+            "status_code": 200,
+            # A generous tenant limit keeps the client rate limit governor out of the measurements
+            "headers": {"X-RateLimit-Limit": "600000", "X-RateLimit-Remaining": "599999"},
+            "body": {
+                "meta": {
+                    "query_time": 0.001,
+                    "pagination": {
+                        "offset": offset,
+                        "limit": limit if limit is not None else len(resources),
+                        "total": total if total is not None else len(resources)
+                    },
+                    "powered_by": "synthetic-intel",
+                    "trace_id": "00000000-0000-0000-0000-000000000000"
+                },
+                "resources": resources,
+                "errors": []
+            }
+        }
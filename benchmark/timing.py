@@ -0,0 +1,113 @@
+"""Per-stage latency and memory recording for the offline benchmark."""
+import functools
+import os
+import platform
+import threading
+import time
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+class StageRecorder:
+    """Thread safe collection of call latencies grouped by stage name."""
+
+    def __init__(self):
+        """Construct an empty recorder."""
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        """Record a single call latency for the stage."""
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, target, method: str, stage: str):
+        """Replace a method on an object with a wrapper that records the latency of each call.
+
+        :param target: object (usually an instance) owning the method
+        :param method: name of the method to wrap
+        :param stage: stage name the latencies are recorded under
+        """
+        original = getattr(target, method)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+
+        setattr(target, method, timed)
+
+    def reset(self):
+        """Discard every recorded latency."""
+        with self.lock:
+            self.samples = {}
+
+    def summary(self) -> dict:
+        """Return the call count, total, mean, p50, p95 and maximum latency (in milliseconds) for each stage."""
+        returned = {}
+        with self.lock:
+            samples = {stage: sorted(found) for stage, found in self.samples.items()}
+        for stage, found in sorted(samples.items()):
+            count = len(found)
+            returned[stage] = {
+                "calls": count,
+                "total_s": round(sum(found), 4),
+                "mean_ms": round(sum(found) / count * 1000, 3),
+                "p50_ms": round(found[int(count * 0.5)] * 1000, 3),
+                "p95_ms": round(found[min(count - 1, int(count * 0.95))] * 1000, 3),
+                "max_ms": round(found[-1] * 1000, 3)
+            }
+
+        return returned
+
+
+class MemoryMonitor:
+    """Sample the resident set size of the process in the background, recording the peak.
+
+    Reads /proc/self/statm where available (Linux), otherwise falls back to the lifetime
+    maximum reported by getrusage.
+    """
+
+    # Seconds between samples
+    INTERVAL = 0.05
+
+    def __init__(self):
+        """Construct an instance of the MemoryMonitor class."""
+        self.start_rss = self.current()
+        self.peak_rss = self.start_rss
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, name="memory-monitor", daemon=True)
+
+    @staticmethod
+    def current() -> int:
+        """Return the current resident set size in bytes, or the lifetime maximum if unavailable."""
+        try:
+            with open("/proc/self/statm", "r", encoding="utf-8") as statm:
+                return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError, AttributeError):
+            pass
+        if resource is None:
+            return 0
+        # Linux reports kilobytes, macOS reports bytes
+        scale = 1 if platform.system() == "Darwin" else 1024
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    def _sample(self):
+        while not self.stopped.wait(self.INTERVAL):
+            self.peak_rss = max(self.peak_rss, self.current())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak_rss = max(self.peak_rss, self.current())
+        return False
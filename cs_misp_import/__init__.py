@@ -4,6 +4,14 @@ from .importer import CrowdstrikeToMISPImporter
 from .intel_client import IntelAPIClient
 from .reports import ReportsImporter
 from .threaded_misp import MISP
+from .import_index import ImportIndex
+from .cleanup import EventCleaner
+from .checkpoint import CheckpointJournal
+from .auth_cache import AuthCache
+from .profiling import StageProfiler, install_profiler
+from .memory_profiling import MemoryProfiler, install_memory_profiler
+from .metrics import MetricsExporter
+from .tracing import SpanFileExporter, Tracer, install_tracer
 from .helper import (
     ADVERSARIES_BANNER,
     REPORTS_BANNER,
@@ -25,5 +33,9 @@ __all__ = [
     "ADVERSARIES_BANNER", "REPORTS_BANNER", "INDICATORS_BANNER",
     "MISP_BANNER", "Adversary", "ReportType","IMPORT_BANNER",
     "DELETE_BANNER", "FINISHED_BANNER", "VERSION", "display_banner",
-    "CONFIG_BANNER"
+    "CONFIG_BANNER", "ImportIndex", "EventCleaner",
+    "CheckpointJournal", "AuthCache", "StageProfiler",
+    "install_profiler", "MetricsExporter", "Tracer",
+    "SpanFileExporter", "install_tracer", "MemoryProfiler",
+    "install_memory_profiler"
     ]
@@ -21,7 +21,6 @@
 """
 import datetime
 import logging
-import os
 import time
 import concurrent.futures
 try:
@@ -32,7 +31,13 @@ except ImportError as no_pymisp:
         ) from no_pymisp
 
 from .adversary import Adversary
-from .helper import ADVERSARIES_BANNER, confirm_boolean_param, display_banner
+from .checkpoint import CheckpointJournal
+from .scheduler import push_executor
+from .profiling import profiled
+from .tracing import record_result, span, traced
+from .memory_profiling import memory_snapshot
+from .metrics import EVENTS_BUILT, EVENTS_PUSHED, RECORDS_FETCHED, RECORDS_SKIPPED
+from .helper import ADVERSARIES_BANNER, confirm_boolean_param, display_banner, stamp_uuids, content_hash
 
 class ActorsImporter:
     """Tool used to import actors from the Crowdstrike Intel API and push them as events in MISP through the MISP API.
@@ -41,61 +46,70 @@ class ActorsImporter:
     :param intel_api_client: client for the Crowdstrike Intel API
     """
 
-    def __init__(self, misp_client, intel_api_client, crowdstrike_org_uuid, actors_timestamp_filename, settings, import_settings, logger = None):
+    def __init__(self, misp_client, intel_api_client, crowdstrike_org_uuid, actors_timestamp_filename, settings, import_settings, logger = None, scheduler = None):
         """Construct an instance of the ActorsImporter class."""
         self.misp: ExpandedPyMISP = misp_client
         self.intel_api_client = intel_api_client
         self.actors_timestamp_filename = actors_timestamp_filename
+        self.checkpoint = CheckpointJournal(actors_timestamp_filename, logger, "actors")
         self.crowdstrike_org = self.misp.get_organisation(crowdstrike_org_uuid, True)
         self.settings = settings
         self.unknown = import_settings.get("unknown_mapping", "UNIDENTIFIED")
         self.import_settings = import_settings
         self.log: logging.Logger = logger
+        # Shared MISP worker pool when streams are imported concurrently
+        self.scheduler = scheduler
 
 
     def batch_import_actors(self, act, act_det, already):
+        """Push an adversary into MISP.
+
+        Returns True when the adversary was imported or updated, None when it was already
+        present and unchanged, and False when it could not be written to MISP.
+        """
         actor_name = act.get('name')
         act_detail = Adversary[actor_name.split(" ")[1].upper()].value
         info_str = f"ADV-{act.get('id')} {actor_name} ({act_detail})"
-        returned = False
+        returned = None
         if actor_name is not None:
-            if already.get(info_str) is None:
-                event: MISPEvent = self.create_event_from_actor(act, act_det)
-                self.log.debug("Created adversary event for %s", act.get('name'))
-                if event:
-                    try:
-                        #for tag in self.settings["CrowdStrike"]["actors_tags"].split(","):
-                        #    event.add_tag(tag)
-                        # Create an actor specific tag
-                        actor_tag = actor_name.split(" ")[1]
-                        event.add_tag(f"CrowdStrike:adversary:branch: {actor_tag}")
-                        #event.add_tag(f"CrowdStrike:actor: {actor_tag}")
-                        if actor_name is not None:
-                            already[actor_name] = True
-                        event = self.misp.add_event(event, True)
-                    except Exception as err:
-                        self.log.warning("Could not add or tag event %s.\n%s", event.info, str(err))
-
-                    if act.get('last_modified_date'):
-                        ts_check = 0
-                        if os.path.exists(self.actors_timestamp_filename):
-                            with open(self.actors_timestamp_filename, 'r', encoding="utf-8") as ts_file:
-                                ts_check = ts_file.read()
-                        # This might be a little over the top
-                        nowstamp = None
+            with span("adversary", record=("actor", act.get('id')), **{"crowdstrike.actor.name": actor_name}) as record_span:
+                digest = content_hash(act, [det for det in act_det if det.get("id") == act.get("id")])
+                existing = already.get(str(act.get('id')))
+                if not already.is_current(str(act.get('id')), digest, act.get("last_modified_date")):
+                    returned = False
+                    event: MISPEvent = self.create_event_from_actor(act, act_det)
+                    self.log.debug("Created adversary event for %s", act.get('name'))
+                    if event:
+                        EVENTS_BUILT.labels(stream="actors").inc()
                         try:
-                            if int(act.get('last_modified_date')) > int(ts_check):
-                                nowstamp = act.get('last_modified_date')
-                        except ValueError:
-                            nowstamp = int(datetime.datetime.today().timestamp())
-                        if nowstamp:
-                            with open(self.actors_timestamp_filename, 'w', encoding="utf-8") as ts_file:
-                                ts_file.write(str(int(nowstamp)+1))
-                    returned = True
+                            #for tag in self.settings["CrowdStrike"]["actors_tags"].split(","):
+                            #    event.add_tag(tag)
+                            # Create an actor specific tag
+                            actor_tag = actor_name.split(" ")[1]
+                            event.add_tag(f"CrowdStrike:adversary:branch: {actor_tag}")
+                            #event.add_tag(f"CrowdStrike:actor: {actor_tag}")
+                            if existing is None:
+                                created = self.misp.upsert_event(event, True)
+                            else:
+                                # Only the attributes that changed are sent for adversaries already in MISP
+                                created = self.misp.update_event_delta(event, existing.get("event_id"), True)
+                            if isinstance(created, MISPEvent):
+                                already.put(str(act.get('id')), created.id, digest)
+                                returned = True
+                            elif self.misp.blocklisted(created):
+                                # Deliberately blocked in MISP, this is not retried
+                                self.log.info("Adversary %s is on the MISP event blocklist (%s), skipping.", actor_name, event.uuid)
+                                record_span.set_attribute("crowdstrike.blocklisted", True)
+                                returned = None
+                            else:
+                                self.log.warning("Could not add event %s.\n%s", event.info, created)
+                        except Exception as err:
+                            self.log.warning("Could not add or tag event %s.\n%s", event.info, str(err))
+                    else:
+                        self.log.warning("Failed to create a MISP event for actor %s.", act)
                 else:
-                    self.log.warning("Failed to create a MISP event for actor %s.", act)
-            else:
-                self.log.debug("Actor %s already exists, skipping", actor_name)
+                    self.log.debug("Actor %s (%s) already exists and is unchanged, skipping", actor_name, info_str)
+                record_result(record_span, returned)
 
         return returned
 
@@ -116,30 +130,51 @@ class ActorsImporter:
             datetime.datetime.today() + datetime.timedelta(days=-int(min(actors_days_before, 730)))
         ).timestamp())
 
-        if os.path.isfile(self.actors_timestamp_filename):
-            with open(self.actors_timestamp_filename, 'r', encoding="utf-8") as ts_file:
-                line = ts_file.readline()
-                if line:
-                    start_get_events = int(line)
+        self.checkpoint.reload()
+        if self.checkpoint.position is not None:
+            start_get_events = self.checkpoint.position
         self.log.info(f"Start importing CrowdStrike Adversaries as events into MISP (past {actors_days_before} days).")
         time_send_request = datetime.datetime.now()
-        actors = self.intel_api_client.get_actors(start_get_events)
-        self.log.info("Got %i adversaries from the Crowdstrike Intel API.", len(actors))
-
-        if len(actors) == 0:
-            with open(self.actors_timestamp_filename, 'w', encoding="utf-8") as ts_file:
-                ts_file.write(str(int(time_send_request.timestamp())))
-        else:
+        actors_count = 0
+        reported = 0
+        # Adversaries are processed one page at a time so memory use stays flat
+        for actors in self.intel_api_client.iter_actors(start_get_events):
+            self.log.info("Got %i adversaries from the Crowdstrike Intel API.", len(actors))
+            RECORDS_FETCHED.labels(stream="actors").inc(len(actors))
+            actors_count += len(actors)
+            memory_snapshot("actors", "fetched", actors=len(actors))
+            modified = [int(ac.get("last_modified_date")) for ac in actors if ac.get("last_modified_date")]
+            page = self.checkpoint.begin(max(modified) + 1 if modified else time_send_request.timestamp())
             actor_details = self.intel_api_client.falcon.get_actor_entities(ids=[x.get("id") for x in actors], fields="__full__")["body"]["resources"]
-            reported = 0
-            with concurrent.futures.ThreadPoolExecutor(self.misp.thread_count, thread_name_prefix="thread") as executor:
+            memory_snapshot("actors", "details", actors=len(actors), actor_details=len(actor_details))
+            failed = []
+            with push_executor(self.scheduler, "actors", self.misp.thread_count) as executor:
                 futures = {
-                    executor.submit(self.batch_import_actors, ac, actor_details, events_already_imported) for ac in actors
+                    executor.submit(self.batch_import_actors, ac, actor_details, events_already_imported): ac for ac in actors
                 }
                 for fut in concurrent.futures.as_completed(futures):
-                    if fut.result():
+                    try:
+                        result = fut.result()
+                    except Exception as err:  # pylint: disable=broad-except
+                        self.log.warning("Could not import adversary %s.\n%s", futures[fut].get("name"), str(err))
+                        result = False
+                    if result:
                         reported += 1
+                    elif result is False:
+                        failed.append(futures[fut].get("id"))
+                    if result is None:
+                        RECORDS_SKIPPED.labels(stream="actors").inc()
+                    else:
+                        EVENTS_PUSHED.labels(stream="actors", result="success" if result else "failed").inc()
+            self.checkpoint.commit(page, failed)
+            memory_snapshot("actors", "pushed", actors=len(actors), actor_details=len(actor_details))
+
+        if actors_count == 0:
+            self.checkpoint.advance(time_send_request.timestamp())
+        else:
             self.log.info("Completed import of %i CrowdStrike adversaries into MISP.", reported)
+        self.checkpoint.close()
+        memory_snapshot("actors", "finished")
 
         self.log.info("Finished importing CrowdStrike Adversaries as events into MISP.")
 
@@ -150,6 +185,8 @@ class ActorsImporter:
 
             return inter
 
+    @profiled("build.actor")
+    @traced("build.actor")
     def create_event_from_actor(self, actor, act_details) -> MISPEvent():
         """Create a MISP event for a valid Actor."""
 
@@ -451,6 +488,7 @@ class ActorsImporter:
                 event.add_tag('iep2-policy:unmodified_resale="must-not"')
             if confirm_boolean_param(self.settings["TAGGING"].get("taxonomic_TLP", False)):
                 event.add_tag("tlp:amber")
+            stamp_uuids(event, "actor", actor.get("id"))
 
         else:
             self.log.warning("Adversary %s missing field name.", actor.get('id'))
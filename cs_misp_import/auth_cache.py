@@ -0,0 +1,155 @@
+"""Reuse of CrowdStrike bearer tokens and configuration validation between runs.
+
+Successful configuration checks and the bearer tokens issued by the CrowdStrike OAuth2 API are
+stored in a small JSON file readable only by the current user. Short, frequent runs skip the
+configuration checks until the configuration file changes, and reuse the token until it is close
+to expiring instead of authenticating once to validate the credentials and again to import.
+API client secrets are never written to the cache, tokens are keyed by a hash of the credentials.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from falconpy import OAuth2
+from ._version import __version__ as MISP_IMPORT_VERSION
+
+
+class AuthCache:
+    """On disk cache of validated configuration files and CrowdStrike bearer tokens."""
+
+    # Seconds before expiry that a cached token is no longer handed out (matches the FalconPy renewal window)
+    RENEW_WINDOW = 120
+
+    def __init__(self, filename: str, logger: logging.Logger = None):
+        """Construct an instance of the AuthCache class.
+
+        :param filename: cache filename
+        :param logger: logging object
+        """
+        self.filename = filename
+        self.log = logger
+        self.lock = threading.Lock()
+
+    def config_validated(self, config_file: str) -> bool:
+        """Confirm if the configuration file has passed validation and has not changed since."""
+        with self.lock:
+            cache = self._read()
+            stored = cache.get("config", {}).get(os.path.abspath(config_file))
+            if not stored or stored.get("version") != MISP_IMPORT_VERSION:
+                return False
+            try:
+                modified = os.stat(config_file).st_mtime
+            except OSError:
+                return False
+            if stored.get("mtime") == modified:
+                return True
+            # Touched but not edited, record the new modification time so the file is not hashed again
+            if stored.get("sha256") == self._file_hash(config_file):
+                stored["mtime"] = modified
+                self._write(cache)
+                return True
+
+        return False
+
+    def mark_config_valid(self, config_file: str):
+        """Record that the configuration file passed validation."""
+        with self.lock:
+            cache = self._read()
+            cache.setdefault("config", {})[os.path.abspath(config_file)] = {
+                "mtime": os.stat(config_file).st_mtime,
+                "sha256": self._file_hash(config_file),
+                "version": MISP_IMPORT_VERSION
+            }
+            self._write(cache)
+
+    def token(self, client_id: str, client_secret: str, base_url: str) -> dict:
+        """Return the cached token for the credentials, or None if there is no token that is still valid."""
+        with self.lock:
+            stored = self._read().get("tokens", {}).get(self._fingerprint(client_id, client_secret, base_url))
+        if not stored or stored.get("expires_at", 0) - self.RENEW_WINDOW <= time.time():
+            return None
+
+        return stored
+
+    def store_token(self, client_id: str, client_secret: str, base_url: str, auth: OAuth2):
+        """Save the bearer token held by an authenticated FalconPy authentication object."""
+        with self.lock:
+            cache = self._read()
+            tokens = {
+                key: val for key, val in cache.get("tokens", {}).items() if val.get("expires_at", 0) > time.time()
+            }
+            tokens[self._fingerprint(client_id, client_secret, base_url)] = {
+                "token": auth.token_value,
+                "expires_at": int(auth.token_time + auth.token_expiration),
+                "base_url": auth.base_url
+            }
+            cache["tokens"] = tokens
+            self._write(cache)
+
+    def oauth(self, client_id: str, client_secret: str, base_url: str = "auto", ssl_verify: bool = True,
+              user_agent: str = None
+              ) -> OAuth2:
+        """Return a FalconPy authentication object, authenticating only if there is no cached token.
+
+        The object keeps the credentials so the token is refreshed as normal once it expires.
+        """
+        auth = OAuth2(client_id=client_id,
+                      client_secret=client_secret,
+                      base_url=base_url,
+                      ssl_verify=ssl_verify,
+                      user_agent=user_agent
+                      )
+        cached = self.token(client_id, client_secret, base_url)
+        if cached:
+            auth.base_url = cached["base_url"]
+            auth.token_value = cached["token"]
+            auth.token_expiration = int(cached["expires_at"] - time.time())
+            auth.token_time = time.time()
+            auth.token_status = 201
+            if self.log:
+                self.log.debug("Reusing cached CrowdStrike API bearer token.")
+        else:
+            auth.login()
+            if auth.token_status == 201:
+                self.store_token(client_id, client_secret, base_url, auth)
+
+        return auth
+
+    @staticmethod
+    def _fingerprint(client_id: str, client_secret: str, base_url: str) -> str:
+        return hashlib.sha256(f"{client_id}:{client_secret}:{base_url}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _file_hash(filename: str) -> str:
+        with open(filename, "rb") as config:
+            return hashlib.sha256(config.read()).hexdigest()
+
+    def _read(self) -> dict:
+        if not os.path.isfile(self.filename):
+            return {}
+        try:
+            with open(self.filename, "r", encoding="utf-8") as cache_file:
+                cache = json.load(cache_file)
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError):
+            if self.log:
+                self.log.warning("Unable to read %s, ignoring.", self.filename)
+            return {}
+
+    def _write(self, cache: dict):
+        temp_file = f"{self.filename}.tmp"
+        # Created readable by the current user only, the cache holds live bearer tokens
+        handle = os.open(temp_file, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+        try:
+            os.chmod(temp_file, 0o600)
+            with os.fdopen(handle, "w", encoding="utf-8") as cache_file:
+                json.dump(cache, cache_file)
+                cache_file.flush()
+                os.fsync(cache_file.fileno())
+        except OSError as err:
+            if self.log:
+                self.log.warning("Unable to write %s: %s", self.filename, err)
+            return
+        os.replace(temp_file, self.filename)
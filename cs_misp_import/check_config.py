@@ -4,7 +4,9 @@ from logging import basicConfig, getLogger, INFO, Logger, DEBUG
 from configparser import ConfigParser
 from datetime import datetime
 from falconpy import BaseURL, Intel
+from .auth_cache import AuthCache
 from .helper import CONFIG_BANNER
+from .indicators import IndicatorsImporter
 
 BOOL_KEYS = [
     "api_enable_ssl", "misp_enable_ssl", "tag_unknown_galaxy_maps", "taxonomic_kill-chain",
@@ -217,7 +219,7 @@ def validate_crowdstrike_creds(c_key: str,
                                logg: ConfigurationCheckResult,
                                auth: dict
                                ):
-    """Validate CrowdStrike client credential and base_url parameters."""
+    """Validate CrowdStrike client credential, base_url and SSL parameters."""
     if c_key == "client_id":  # 32 chars
         auth["creds"][c_key] = c_val
         keyz[c_key] = failure(logg,
@@ -233,6 +235,8 @@ def validate_crowdstrike_creds(c_key: str,
         keyz[c_key] = warning(logg,
             "WARNING: Non-standard CrowdStrike URL specified"
             ) if not valid_base(c_val) else True
+    if c_key == "api_enable_ssl":
+        auth["ssl_verify"] = "f" not in c_val.lower()
 
 
 def validate_misp_creds(c_key: str, c_val: str, keyz: dict, logg: ConfigurationCheckResult):
@@ -295,6 +299,11 @@ def validate_api_limits(c_key: str, c_val: str, keyz: dict, logg: ConfigurationC
             keyz[c_key] = invalid(logg, c_val) if (5000 < int(c_val) or int(c_val) < 0) else True
         except ValueError:
             keyz[c_key] = invalid(logg, c_val)
+    if c_key == "api_request_concurrency" and c_val:
+        try:
+            keyz[c_key] = invalid(logg, c_val) if int(c_val) < 1 else True
+        except ValueError:
+            keyz[c_key] = invalid(logg, c_val)
 
 
 def validate_max_threads(c_key: str, c_val: str, keyz: dict, logg: ConfigurationCheckResult):
@@ -314,9 +323,41 @@ def validate_max_threads(c_key: str, c_val: str, keyz: dict, logg: Configuration
             keyz[c_key] = invalid(logg, c_val)
 
 
-def validate_login(auth: dict, logg: ConfigurationCheckResult):
+def validate_indicator_grouping(c_key: str, c_val: str, keyz: dict, logg: ConfigurationCheckResult):
+    """Validate the indicator grouping dimension."""
+    if c_key == "indicator_grouping" and c_val:
+        keyz[c_key] = invalid(logg, c_val) if c_val.lower() not in IndicatorsImporter.GROUPINGS else True
+
+
+def validate_poll_intervals(c_key: str, c_val: str, keyz: dict, logg: ConfigurationCheckResult):
+    """Validate the daemon mode poll intervals."""
+    if c_key.endswith("_poll_interval") and c_val:
+        try:
+            keyz[c_key] = invalid(logg, c_val) if int(c_val) < 1 else True
+        except ValueError:
+            keyz[c_key] = invalid(logg, c_val)
+
+
+def validate_metrics(c_key: str, c_val: str, keyz: dict, logg: ConfigurationCheckResult):
+    """Validate the metrics endpoint port and textfile interval."""
+    if c_key in ["metrics_port", "metrics_interval"] and c_val:
+        try:
+            upper = 65535 if c_key == "metrics_port" else 86400
+            keyz[c_key] = invalid(logg, c_val) if not 1 <= int(c_val) <= upper else True
+        except ValueError:
+            keyz[c_key] = invalid(logg, c_val)
+
+
+def validate_login(auth: dict, logg: ConfigurationCheckResult, auth_cache: AuthCache = None):
     """Validate that authentication generates a valid bearer token."""
-    auth_check = Intel(creds=auth["creds"], base_url=auth["base_url"])
+    ssl_verify = auth.get("ssl_verify", True)
+    if auth_cache:
+        # A cached token is still valid proof of the credentials, a new token is saved for the import
+        auth_check = auth_cache.oauth(auth["creds"]["client_id"], auth["creds"]["client_secret"], auth["base_url"],
+                                      ssl_verify=ssl_verify
+                                      )
+    else:
+        auth_check = Intel(creds=auth["creds"], base_url=auth["base_url"], ssl_verify=ssl_verify)
     if auth_check.token_status != 201:
         logg.extra = {"key": "authentication"}
         failure(logg, "CRITICAL: Invalid API credentials provided")
@@ -343,8 +384,14 @@ def validate_config(config_file: str = None, debugging: bool = False, no_banner:
     else:
         print(f"[{cur_time()}] INFO     config  CHECK CONFIG")
     config = read_config_file(config_file)
+    auth_cache = None
+    if config.has_section("CrowdStrike") and config["CrowdStrike"].get("auth_cache_filename"):
+        auth_cache = AuthCache(config["CrowdStrike"]["auth_cache_filename"], out.log)
+        if auth_cache.config_validated(config_file):
+            print(f"[{cur_time()}] INFO     config  Configuration unchanged since last validated, skipping checks")
+            return True
     keys = generate_primer()
-    auth_info = {"creds": {"client_id": "Not set", "client_secret": "Not set"}, "base_url": "auto"}
+    auth_info = {"creds": {"client_id": "Not set", "client_secret": "Not set"}, "base_url": "auto", "ssl_verify": True}
     for sect in config.sections() if config.sections() else not_found():
         for key in config[sect]:
             out.extra = {"key": key}
@@ -360,8 +407,14 @@ def validate_config(config_file: str = None, debugging: bool = False, no_banner:
             validate_galaxies_mapping(*vals)
             validate_org_id(*vals)
             validate_max_threads(*vals)
+            validate_indicator_grouping(*vals)
+            validate_poll_intervals(*vals)
+            validate_metrics(*vals)
 
-    validate_login(auth_info, out)
+    validate_login(auth_info, out, auth_cache)
     check_for_missing(out, keys)
+    valid_config = is_valid_config(out)
+    if valid_config and auth_cache:
+        auth_cache.mark_config_valid(config_file)
 
-    return is_valid_config(out)
+    return valid_config
@@ -0,0 +1,217 @@
+"""Crash safe import position tracking.
+
+Each import stream (reports, indicators and adversaries) keeps a high-water mark in its
+timestamp file, which is where the next run resumes from. Pages of work are recorded in
+an append-only journal alongside the timestamp file as they are started and confirmed, and
+the high-water mark only advances past pages where every item was confirmed written to MISP,
+in the order the pages were retrieved. The timestamp file is always replaced atomically.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from .profiling import profiled
+from .metrics import CHECKPOINT_PENDING, track_checkpoint
+
+
+class CheckpointJournal:
+    """Write-ahead journal guarding the high-water mark of a single import stream.
+
+    Journal records are JSON lines:
+      begin  - a page of work was handed to MISP (page sequence and resume position)
+      commit - a page finished, listing any items that could not be written
+      mark   - the high-water mark is about to be advanced (written before the timestamp file)
+      stall  - the run ended with the high-water mark held back by failed items (and when)
+      abandon - failed items were given up on after repeated runs, recorded so they are not lost
+
+    Failed items are only abandoned once they have held the high-water mark back for several
+    runs and for a period of time, so frequent daemon polls during a MISP outage lose nothing.
+    """
+
+    # Runs the high-water mark must be held at the same position by failed items before they are abandoned
+    MAX_ATTEMPTS = 3
+    # Seconds the high-water mark must have been held at the same position before failed items are abandoned
+    STALL_TIMEOUT = 24 * 3600
+
+    def __init__(self, filename: str, logger: logging.Logger = None, stream: str = None):
+        """Open the journal for the specified timestamp file, recovering from any prior crash.
+
+        :param filename: timestamp (high-water mark) filename for the import stream
+        :param logger: logging object
+        :param stream: import stream name used to label metrics, defaults to the timestamp filename
+        """
+        self.filename = filename
+        self.journal_filename = f"{filename}.journal"
+        self.log = logger
+        self.stream = stream or os.path.basename(filename)
+        self.lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """Read the high-water mark from disk, picking up any changes made since the journal was opened."""
+        with self.lock:
+            self.position = self._read_position()
+            self.stalls = []
+            self.pages = {}
+            self.next_page = 0
+            self.next_commit = 0
+            self._recover()
+            track_checkpoint(self.stream, self.position)
+            self._track_pending()
+
+    @staticmethod
+    def reset(filename: str) -> bool:
+        """Remove the timestamp file and journal for an import stream, returning True if either existed."""
+        removed = False
+        for stale in (filename, f"{filename}.journal"):
+            if os.path.isfile(stale):
+                os.remove(stale)
+                removed = True
+
+        return removed
+
+    @profiled("checkpoint.begin")
+    def begin(self, position) -> int:
+        """Record the start of a page of work and return its sequence number.
+
+        :param position: position to resume from once this page (and every earlier page) is confirmed
+        """
+        with self.lock:
+            page = self.next_page
+            self.next_page += 1
+            self.pages[page] = {"position": int(position), "done": False, "failed": []}
+            self._append({"op": "begin", "page": page, "position": int(position)})
+            self._track_pending()
+
+        return page
+
+    @profiled("checkpoint.commit")
+    def commit(self, page: int, failed: list = None):
+        """Record a finished page and advance the high-water mark past any fully confirmed pages.
+
+        :param page: sequence number returned by begin
+        :param failed: identifiers of the items in the page that were not written to MISP
+        """
+        failed = [str(item) for item in failed or []]
+        with self.lock:
+            self.pages[page].update(done=True, failed=failed)
+            self._append({"op": "commit", "page": page, "failed": failed})
+            self._track_pending()
+            if failed and self.log:
+                self.log.warning("%i items were not written to MISP, %s will not advance past them.",
+                                 len(failed), self.filename
+                                 )
+            self._advance()
+
+    @profiled("checkpoint.advance")
+    def advance(self, position):
+        """Move the high-water mark forward when there is no outstanding work (such as an empty run)."""
+        with self.lock:
+            if not any(not p["done"] or p["failed"] for p in self.pages.values()):
+                self._mark(int(position))
+
+    @profiled("checkpoint.close")
+    def close(self):
+        """Finish the run, recording any failed items that are holding back the high-water mark."""
+        with self.lock:
+            failed = [item for page in sorted(self.pages) for item in self.pages[page]["failed"]]
+            if failed:
+                now = time.time()
+                self.stalls.append((self.position, now))
+                stalled = [when for position, when in self.stalls if position == self.position]
+                if len(stalled) >= self.MAX_ATTEMPTS and now - min(stalled) >= self.STALL_TIMEOUT:
+                    if self.log:
+                        self.log.error("Giving up on %i items that failed to import on %i runs over %.1f hours: %s",
+                                       len(failed), len(stalled), (now - min(stalled)) / 3600, ", ".join(failed[:50])
+                                       )
+                    self._append({"op": "abandon", "position": self.position, "items": failed})
+                    for page in self.pages.values():
+                        page["failed"] = []
+                    self._advance()
+                else:
+                    self._append({"op": "stall", "position": self.position, "time": now, "items": failed})
+            self.pages = {}
+            self.next_commit = self.next_page
+            self._track_pending()
+
+    def _advance(self):
+        # Pages are confirmed strictly in the order they were started
+        while self.next_commit in self.pages:
+            page = self.pages[self.next_commit]
+            if not page["done"] or page["failed"]:
+                break
+            self._mark(page["position"])
+            self.next_commit += 1
+
+    def _mark(self, position: int):
+        if self.position is not None and position <= self.position:
+            return
+        self._append({"op": "mark", "position": position})
+        self.position = position
+        self._write_position(position)
+        track_checkpoint(self.stream, position)
+
+    def _track_pending(self):
+        CHECKPOINT_PENDING.labels(stream=self.stream).set(sum(1 for p in self.pages.values() if not p["done"]))
+
+    def _append(self, record: dict):
+        with open(self.journal_filename, "a", encoding="utf-8") as journal:
+            journal.write(json.dumps(record) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _read_position(self):
+        if not os.path.isfile(self.filename):
+            return None
+        try:
+            with open(self.filename, "r", encoding="utf-8") as ts_file:
+                line = ts_file.readline().strip()
+            return int(line) if line else None
+        except ValueError:
+            if self.log:
+                self.log.warning("Invalid timestamp found in %s, ignoring.", self.filename)
+            return None
+
+    def _write_position(self, position: int):
+        temp_file = f"{self.filename}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as ts_file:
+            ts_file.write(str(position))
+            ts_file.flush()
+            os.fsync(ts_file.fileno())
+        os.replace(temp_file, self.filename)
+
+    def _recover(self):
+        """Replay the journal from the previous run and compact it."""
+        if not os.path.isfile(self.journal_filename):
+            return
+        marked = None
+        with open(self.journal_filename, "r", encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Partially written final record from an interrupted run
+                    continue
+                if record.get("op") == "mark":
+                    marked = record["position"] if marked is None else max(marked, record["position"])
+                elif record.get("op") == "stall":
+                    # Stalls journaled without a time are counted from when they were recovered
+                    self.stalls.append((record["position"], record.get("time", time.time())))
+        if marked is not None and (self.position is None or marked > self.position):
+            # The run stopped between journaling the mark and replacing the timestamp file
+            if self.log:
+                self.log.info("Recovered import position %i for %s from the checkpoint journal.", marked, self.filename)
+            self.position = marked
+            self._write_position(marked)
+        # Only stalls at the current position count towards abandoning failed items
+        self.stalls = [(pos, when) for pos, when in self.stalls if pos == self.position]
+        compacted = [{"op": "stall", "position": pos, "time": when} for pos, when in self.stalls]
+        if self.position is not None:
+            compacted.insert(0, {"op": "mark", "position": self.position})
+        temp_file = f"{self.journal_filename}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as journal:
+            journal.writelines(json.dumps(record) + "\n" for record in compacted)
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temp_file, self.journal_filename)
@@ -0,0 +1,184 @@
+"""Bulk removal of CrowdStrike events from a MISP instance.
+
+Every tag is searched concurrently with `search_index`, a page at a time. The matching event
+IDs are then deduplicated, since an event can carry several of the tags, and deleted
+concurrently with one bulk request per batch. Overall throughput is reported while the events
+are deleted.
+
+MISP blocklists the UUID of each deleted event by default. CrowdStrike events keep the same
+UUID for each record, so the blocklist entries of the deleted events are removed afterwards
+to let the records be imported again.
+"""
+import concurrent.futures
+import logging
+import threading
+import time
+
+
+class EventCleaner:
+    """Delete every MISP event matching a list of tags using paginated, batched requests."""
+
+    # Seconds between progress messages
+    PROGRESS_INTERVAL = 10
+
+    def __init__(self, misp_client, logger: logging.Logger, force: bool = False, batch_size: int = 500):
+        """Construct an instance of the EventCleaner class.
+
+        :param misp_client: client for the MISP instance (threaded_misp.MISP)
+        :param logger: logging object
+        :param force: retrieve full event metadata instead of the minimal listing
+        :param batch_size: number of events requested and deleted per call
+        """
+        self.misp = misp_client
+        self.log = logger
+        self.force = force
+        self.batch_size = max(1, int(batch_size))
+        self.deleted_uuids = set()
+        self.remaining = set()
+        self.failed_tags = set()
+        self.lock = threading.Lock()
+
+    @property
+    def complete(self) -> bool:
+        """Return True when the last clean found and deleted every matching event."""
+        return not self.remaining and not self.failed_tags
+
+    def clean(self, tags: list, **search_params) -> int:
+        """Delete every event tagged with any of the provided tags, returning the number deleted.
+
+        The IDs of matching events that could not be deleted are left in `remaining`, and the tags
+        that could not be searched in `failed_tags`.
+
+        :param tags: event tags to hunt, each tag is searched independently
+        :param search_params: additional search_index filters (such as timestamp)
+        """
+        self.deleted_uuids = set()
+        self.remaining = set()
+        self.failed_tags = set()
+        # An event carrying several of the tags is found once per tag, so it is only deleted once
+        events = {}
+        with concurrent.futures.ThreadPoolExecutor(self.misp.thread_count, thread_name_prefix="thread") as executor:
+            futures = {executor.submit(self.find_tag, tag, **search_params): tag for tag in tags}
+            for fut in concurrent.futures.as_completed(futures):
+                try:
+                    events.update(fut.result())
+                except Exception as err:  # pylint: disable=W0703
+                    self.log.warning("Unable to search for events tagged %s: %s", futures[fut], err)
+                    self.failed_tags.add(futures[fut])
+        if not events:
+            return 0
+
+        event_ids = sorted(events, key=lambda event_id: int(event_id) if event_id.isdigit() else 0)
+        batches = [event_ids[pos:pos+self.batch_size] for pos in range(0, len(event_ids), self.batch_size)]
+        deleted = 0
+        finished = threading.Event()
+        reporter = threading.Thread(target=self._report_progress,
+                                    args=(finished, self.misp.deleted_event_count, time.monotonic()),
+                                    name="cleanup-progress",
+                                    daemon=True
+                                    )
+        reporter.start()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.misp.thread_count, thread_name_prefix="thread") as executor:
+                futures = {executor.submit(self.delete_batch, batch, events): batch for batch in batches}
+                for fut in concurrent.futures.as_completed(futures):
+                    try:
+                        deleted += fut.result()
+                    except Exception as err:  # pylint: disable=W0703
+                        self.log.warning("Unable to delete a batch of events: %s", err)
+                        self.remaining.update(futures[fut])
+        finally:
+            finished.set()
+            reporter.join()
+        self.misp.delete_event_blocklists(self.deleted_uuids)
+
+        return deleted
+
+    def find_tag(self, tag: str, **search_params) -> dict:
+        """Return the UUIDs of every event with the specified tag, keyed by event ID."""
+        found = {}
+        page = 1
+        while True:
+            events = self.search_page(tag, page, **search_params)
+            found.update((str(evt["id"]), evt.get("uuid")) for evt in events if evt.get("id") is not None)
+            if len(events) < self.batch_size:
+                break
+            page += 1
+
+        return found
+
+    def delete_batch(self, event_ids: list, event_uuids: dict) -> int:
+        """Delete a batch of events with a single request, returning the number deleted.
+
+        Events the bulk request did not remove are retried one at a time, so a single problem
+        event does not hold back the rest.
+        """
+        removed = set(self.misp.delete_events(event_ids))
+        retried = [event_id for event_id in event_ids if event_id not in removed]
+        not_deleted = self.delete_individually(retried) if retried else set()
+        if not_deleted:
+            self.log.warning("Unable to delete %i events.", len(not_deleted))
+            with self.lock:
+                self.remaining.update(not_deleted)
+        self._deleted(event_uuids, [event_id for event_id in event_ids if event_id not in not_deleted])
+
+        return len(event_ids) - len(not_deleted)
+
+    def _deleted(self, event_uuids: dict, event_ids: list):
+        """Note the UUIDs of deleted events so their blocklist entries can be removed."""
+        with self.lock:
+            self.deleted_uuids.update(event_uuids[event_id] for event_id in event_ids if event_uuids.get(event_id))
+
+    def oldest_timestamp(self, tags: list, **search_params) -> int:
+        """Return the earliest timestamp of any event with the provided tags, or None if there are no matches."""
+        oldest = None
+        for tag in tags:
+            params = {"tags": [tag], "limit": 1, "page": 1, "minimal": True, "sort": "timestamp", "desc": False,
+                      **search_params
+                      }
+            events = self.misp.search_index(**params)
+            if not isinstance(events, list):
+                self.log.warning("Unable to search for events tagged %s: %s", tag, events)
+                continue
+            for evt in events:
+                try:
+                    stamp = int(evt["timestamp"])
+                except (KeyError, TypeError, ValueError):
+                    # Unable to tell how old the matches are, search from the beginning
+                    stamp = 0
+                oldest = stamp if oldest is None else min(oldest, stamp)
+
+        return oldest
+
+    def delete_individually(self, event_ids: list) -> set:
+        """Delete events one at a time, returning the IDs that could not be deleted."""
+        not_deleted = set()
+        for event_id in event_ids:
+            try:
+                result = self.misp.delete_event(event_id)
+            except Exception as err:  # pylint: disable=W0703
+                result = {"errors": str(err)}
+            if not isinstance(result, dict) or "errors" in result:
+                not_deleted.add(event_id)
+
+        return not_deleted
+
+    def search_page(self, tag: str, page: int, **search_params) -> list:
+        """Retrieve one page of events with the specified tag."""
+        params = {"tags": [tag], "limit": self.batch_size, "page": page, **search_params}
+        if not self.force:
+            params["minimal"] = True
+        events = self.misp.search_index(**params)
+        if not isinstance(events, list):
+            self.log.warning("Unable to search for events tagged %s: %s", tag, events)
+            with self.lock:
+                self.failed_tags.add(tag)
+            return []
+
+        return events
+
+    def _report_progress(self, finished: threading.Event, started: int, start_time: float):
+        while not finished.wait(self.PROGRESS_INTERVAL):
+            deleted = self.misp.deleted_event_count - started
+            elapsed = max(time.monotonic() - start_time, 0.001)
+            self.log.info("%i events deleted (%.1f events/sec)", deleted, deleted / elapsed)
@@ -1,93 +1,203 @@
 """Helper methods."""
+import collections
+import hashlib
+import json
+import uuid
 from logging import Logger
 from ._version import __version__ as MISP_IMPORT_VERSION
 
 try:
-    from pymisp import MISPObject, MISPAttribute
+    from pymisp import MISPObject, MISPAttribute, MISPEvent
 except ImportError as no_pymisp:
     raise SystemExit(
         "The PyMISP package must be installed to use this program."
         ) from no_pymisp
 
+# Namespace for the UUIDs generated for CrowdStrike sourced MISP content, never change this value
+CROWDSTRIKE_UUID_NAMESPACE = uuid.UUID("749934b6-c48d-48ec-a4ff-1a0788b41c34")
+
+
+def deterministic_uuid(*parts) -> str:
+    """Return a stable (UUIDv5) UUID string derived from the provided values."""
+    return str(uuid.uuid5(CROWDSTRIKE_UUID_NAMESPACE, ":".join(str(part) for part in parts)))
+
+
+def content_hash(*parts) -> str:
+    """Return a stable hash of upstream record content, used to detect records that have changed.
+
+    The importer version is included so events are refreshed when the way they are built changes.
+    """
+    content = json.dumps([MISP_IMPORT_VERSION, *parts], sort_keys=True, default=str)
+
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def stamp_uuids(event: MISPEvent, *seed) -> MISPEvent:
+    """Replace the random UUIDs within an event with stable UUIDs derived from the seed values.
+
+    The event, its attributes, objects, object attributes and event reports all receive
+    UUIDs based upon the seed (CrowdStrike ID, report ID or indicator value) and their own
+    content, so rebuilding the same record always produces the same UUIDs. Object references
+    are updated to match.
+    """
+    event_uuid = deterministic_uuid("event", *seed)
+    event.uuid = event_uuid
+    remapped = {}
+    issued = set()
+
+    def stable(*parts) -> str:
+        # Identical content within one event (a repeated tag comment, etc.) gets a positional suffix
+        returned = deterministic_uuid(event_uuid, *parts)
+        position = 0
+        while returned in issued:
+            position += 1
+            returned = deterministic_uuid(event_uuid, *parts, position)
+        issued.add(returned)
+
+        return returned
+
+    for attribute in event.attributes:
+        remapped[attribute.uuid] = attribute.uuid = stable("attribute", attribute.type, attribute.value)
+    for misp_object in event.objects:
+        content = sorted(f"{att.object_relation}={att.value}" for att in misp_object.attributes)
+        remapped[misp_object.uuid] = misp_object.uuid = stable("object", misp_object.name, *content)
+        for attribute in misp_object.attributes:
+            remapped[attribute.uuid] = attribute.uuid = stable(
+                "object-attribute", misp_object.uuid, attribute.object_relation, attribute.value
+                )
+    for misp_object in event.objects:
+        for reference in misp_object.references:
+            reference.object_uuid = misp_object.uuid
+            reference.referenced_uuid = remapped.get(reference.referenced_uuid, reference.referenced_uuid)
+            reference.uuid = stable("reference", reference.object_uuid, reference.referenced_uuid)
+    for event_report in event.event_reports:
+        event_report.uuid = stable("event-report", event_report.name)
+
+    return event
+
+
+def stamped_uuids(event: MISPEvent) -> set:
+    """Return the UUIDs of the attributes and objects within an event that stamp_uuids issued.
+
+    Content is only counted when its UUID is the one stamp_uuids derives from the event UUID
+    and the content itself, so attributes and objects added by analysts, and the content of
+    events created with random UUIDs, are never included.
+    """
+    positions = collections.Counter()
+    candidates = set()
+
+    def stable(*parts):
+        position = positions[parts]
+        positions[parts] += 1
+        candidates.add(deterministic_uuid(event.uuid, *parts, position) if position else deterministic_uuid(event.uuid, *parts))
+
+    for attribute in event.attributes:
+        stable("attribute", attribute.type, attribute.value)
+    for misp_object in event.objects:
+        stable("object", misp_object.name, *sorted(f"{att.object_relation}={att.value}" for att in misp_object.attributes))
+
+    return {item.uuid for item in [*event.attributes, *event.objects] if item.uuid in candidates}
+
+# Indicator types stored as MISP objects: Type -> (Object_Type, Attribute Name)
+INDICATOR_OBJECTS = {
+    "password": ("credential", "password"),
+    "username": ("credential", "username"),
+    "x509_serial": ("x509", "serial-number"),
+    "x509_subject": ("x509", "subject"),
+}
+# Indicator types stored as MISP attributes: Type -> (Category, Attribute Type)
+INDICATOR_ATTRIBUTES = {
+    "hash_md5": ("Artifacts dropped", "md5"),
+    "hash_sha256": ("Artifacts dropped", "sha256"),
+    "hash_sha1": ("Artifacts dropped", "sha1"),
+    "hash_imphash": ("Artifacts dropped", "imphash"),
+    "file_name": ("Artifacts dropped", "filename"),
+    "file_path": ("Payload delivery", "filename"),
+    "url": ("Network activity", "url"),
+    "mutex_name": ("Artifacts dropped", "mutex"),
+    "bitcoin_address": ("Financial fraud", "btc"),
+    "coin_address": ("Financial fraud", "bic"),
+    "email_address": ("Payload delivery", "email-reply-to"),
+    "email_subject": ("Payload delivery", "email-subject"),
+    "registry": ("Persistence mechanism", "regkey"),
+    "device_name": ("Targeting data", "target-machine"),
+    "domain": ("Network activity", "domain"),
+    "campaign_id": ("Attribution", "campaign-id"),
+    "ip_address": ("Network activity", "ip-src"),
+    "service_name": ("Artifacts dropped", "windows-service-name"),
+    "user_agent": ("Network activity", "user-agent"),
+    "port": ("Network activity", "port"),
+}
+
+
+def _object_converter(object_type: str, relation: str):
+    """Return a converter creating a single attribute MISP object of the provided type."""
+    type_tag = f"CrowdStrike:indicator:type: {relation.upper()}"
+
+    def convert(value, first_seen, last_seen) -> MISPObject:
+        indicator_object = MISPObject(object_type)
+        att = indicator_object.add_attribute(relation, value)
+        if first_seen:
+            att.first_seen = first_seen
+        if last_seen:
+            att.last_seen = last_seen
+        att.add_tag(type_tag)
+
+        return indicator_object
+
+    return convert
+
+
+def _attribute_converter(category: str, attribute_type: str):
+    """Return a converter creating a MISP attribute of the provided category and type."""
+    def convert(value, first_seen, last_seen) -> MISPAttribute:  # pylint: disable=W0613
+        indicator_attribute = MISPAttribute()
+        indicator_attribute.category = category
+        indicator_attribute.type = attribute_type
+        indicator_attribute.value = value
+
+        return indicator_attribute
+
+    return convert
+
+
+# Conversion table, built once so each indicator costs a single lookup
+INDICATOR_CONVERTERS = {
+    **{ind_type: _object_converter(*mapping) for ind_type, mapping in INDICATOR_OBJECTS.items()},
+    **{ind_type: _attribute_converter(*mapping) for ind_type, mapping in INDICATOR_ATTRIBUTES.items()},
+}
+
+
+def gen_indicators(indicators: list) -> list:
+    """Create the appropriate MISP object or attribute for each indicator in a page.
+
+    Returns a list in the same order as the indicators. It holds False for any indicator that
+    is missing its value or is of an unsupported type, and the raised exception for any
+    indicator that could not be converted, so one bad record does not fail the page.
+    """
+    converters = INDICATOR_CONVERTERS
+    returned = []
+    for indicator in indicators:
+        convert = converters.get(indicator.get('type'))
+        indicator_value = indicator.get('indicator')
+        if convert is None or not indicator_value:
+            returned.append(False)
+            continue
+        try:
+            returned.append(convert(indicator_value, indicator.get("published_date", 0), indicator.get("last_updated", 0)))
+        except Exception as err:  # pylint: disable=broad-except
+            returned.append(err)
+
+    return returned
+
+
 def gen_indicator(indicator, tag_list) -> MISPObject or MISPAttribute:
         """Create the appropriate MISP event object for the indicator (based upon type)."""
-        if not indicator.get('type') or not indicator.get('indicator'):
+        convert = INDICATOR_CONVERTERS.get(indicator.get('type'))
+        if convert is None or not indicator.get('indicator'):
             return False
 
-        indicator_type = indicator.get('type')
-        indicator_value = indicator.get('indicator')
-        indicator_first = indicator.get("published_date", 0)
-        indicator_last = indicator.get("last_updated", 0)
-        # Type, Object_Type, Attribute Name
-        ind_objects = [
-            # ["hash_md5", "file", "md5"],
-            # ["hash_sha256", "file", "sha256"],
-            # ["hash_sha1", "file", "sha1"],
-            # ["file_name", "file", "filename"],
-            # ["mutex_name", "mutex", "name"],
-            ["password", "credential", "password"],
-            # ["url", "url", "url"],
-            # ["email_address", "email", "reply-to"],
-            ["username", "credential", "username"],
-            # ["bitcoin_address", "btc-transaction", "btc-address"],
-            # ["registry", "registry-key", "key"],
-            ["x509_serial", "x509", "serial-number"],
-            # ["file_path", "file", "fullpath"],
-            # ["email_subject", "email", "subject"],
-            # ["coin_address", "coin-address", "address"],
-            ["x509_subject", "x509", "subject"],
-            #["device_name", "device", "name"],
-            # ["hash_imphash", "pe", "imphash"]
-        ]
-
-        for ind_obj in ind_objects:
-            if indicator_type == ind_obj[0]:
-                indicator_object = MISPObject(ind_obj[1])
-                att = indicator_object.add_attribute(ind_obj[2], indicator_value)
-                if indicator_first:
-                    att.first_seen = indicator_first
-                if indicator_last:
-                    att.last_seen = indicator_last
-                att.add_tag(f"CrowdStrike:indicator:type: {ind_obj[2].upper()}")
-                #for tag in tag_list:
-                #    att.add_tag(tag)
-
-                return indicator_object
-
-        # Type, Category, Attribute Type
-        ind_attributes = [
-            ["hash_md5", "Artifacts dropped", "md5"],
-            ["hash_sha256", "Artifacts dropped", "sha256"],
-            ["hash_sha1", "Artifacts dropped", "sha1"],
-            ["hash_imphash", "Artifacts dropped", "imphash"],
-            ["file_name", "Artifacts dropped", "filename"],
-            ["file_path", "Payload delivery", "filename"],
-            ["url", "Network activity", "url"],
-            ["mutex_name", "Artifacts dropped", "mutex"],
-            ["bitcoin_address", "Financial fraud", "btc"],
-            ["coin_address", "Financial fraud", "bic"],
-            ["email_address", "Payload delivery", "email-reply-to"],
-            ["email_subject", "Payload delivery", "email-subject"],
-            ["registry", "Persistence mechanism", "regkey"],
-            ["device_name", "Targeting data", "target-machine"],
-            ["domain", "Network activity", "domain"],
-            ["campaign_id", "Attribution", "campaign-id"],
-            ["ip_address", "Network activity", "ip-src"],
-            ["service_name", "Artifacts Dropped", "windows-service-name"],
-            ["user_agent", "Network activity", "user-agent"],
-            ["port", "Network activity", "port"]
-        ]
-
-        for ind_att in ind_attributes:
-            if indicator_type == ind_att[0]:
-                indicator_attribute = MISPAttribute()
-                indicator_attribute.category = ind_att[1]
-                indicator_attribute.type = ind_att[2]
-                indicator_attribute.value = indicator_value
-
-                return indicator_attribute
-
-        return False
+        return convert(indicator.get('indicator'), indicator.get("published_date", 0), indicator.get("last_updated", 0))
 
 
 def confirm_boolean_param(val: str or bool) -> bool:
@@ -187,6 +297,7 @@ FINISHED_BANNER = r"""
 |__|     |__| |__| \__| |__| |_______/    |__|  |__| |_______||_______/
 """
 
+# Every type listed here has an entry in INDICATOR_CONVERTERS
 INDICATOR_TYPES = [
     "hash_md5",
     "hash_sha256",
@@ -0,0 +1,176 @@
+"""Persistent local index of CrowdStrike records already imported into MISP.
+
+The index replaces the startup `search_index` scan used for duplicate checking. Records are
+written as events are pushed, and the index is only rebuilt from MISP when requested (or when
+a record type has never been indexed), so startup cost does not grow with the MISP instance.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from .profiling import profiled
+
+
+class ImportIndex:
+    """SQLite backed index of imported reports, adversaries and indicators.
+
+    Each record is keyed by its type (`report`, `actor` or `indicator`) and CrowdStrike
+    identifier, and stores the MISP event ID and content hash of the imported event.
+    """
+
+    # Number of writes to buffer before committing to disk
+    COMMIT_INTERVAL = 500
+
+    def __init__(self, filename: str, logger: logging.Logger = None):
+        """Open (or create) the index database."""
+        self.filename = filename
+        self.log = logger
+        self.lock = threading.RLock()
+        self.pending = 0
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS imported ("
+                "kind TEXT NOT NULL, record_id TEXT NOT NULL, event_id TEXT, content_hash TEXT, "
+                "updated INTEGER, PRIMARY KEY (kind, record_id))"
+                )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS built (kind TEXT PRIMARY KEY, updated INTEGER)")
+            self.conn.commit()
+
+    def get(self, kind: str, record_id: str) -> dict:
+        """Return the index entry for a record, or None if it has not been imported."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT event_id, content_hash, updated FROM imported WHERE kind = ? AND record_id = ?",
+                (kind, str(record_id))
+                ).fetchone()
+        if row is None:
+            return None
+
+        return {"event_id": row[0], "content_hash": row[1], "updated": row[2]}
+
+    @profiled("checkpoint.index_put")
+    def put(self, kind: str, record_id: str, event_id: str = None, content_hash: str = None):
+        """Record (or update) an imported record."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO imported (kind, record_id, event_id, content_hash, updated) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (kind, str(record_id), None if event_id is None else str(event_id), content_hash, int(time.time()))
+                )
+            self._written()
+
+    def remove(self, kind: str, record_id: str):
+        """Remove a record from the index."""
+        with self.lock:
+            self.conn.execute("DELETE FROM imported WHERE kind = ? AND record_id = ?", (kind, str(record_id)))
+            self._written()
+
+    def clear(self, kind: str):
+        """Remove every record of the specified type and flag it as requiring a rebuild."""
+        with self.lock:
+            self.conn.execute("DELETE FROM imported WHERE kind = ?", (kind,))
+            self.conn.execute("DELETE FROM built WHERE kind = ?", (kind,))
+            self.conn.commit()
+            self.pending = 0
+
+    def count(self, kind: str) -> int:
+        """Return the number of indexed records of the specified type."""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM imported WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def is_built(self, kind: str) -> bool:
+        """Confirm if the specified record type has been indexed from MISP."""
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM built WHERE kind = ?", (kind,)).fetchone() is not None
+
+    def mark_built(self, kind: str):
+        """Flag the specified record type as indexed."""
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO built (kind, updated) VALUES (?, ?)", (kind, int(time.time())))
+            self.conn.commit()
+            self.pending = 0
+
+    def view(self, kind: str):
+        """Return a dictionary style view of the records of the specified type."""
+        return ImportIndexView(self, kind)
+
+    @profiled("checkpoint.index_flush")
+    def flush(self):
+        """Commit any buffered writes to disk."""
+        with self.lock:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        """Commit any buffered writes and close the database."""
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def _written(self):
+        self.pending += 1
+        if self.pending >= self.COMMIT_INTERVAL:
+            self.conn.commit()
+            self.pending = 0
+
+
+class ImportIndexView:
+    """Dictionary style access to one record type within the import index.
+
+    This allows the importers to use the index anywhere they previously used a dictionary
+    of already imported events. Assigned values are stored as the MISP event ID.
+    """
+
+    def __init__(self, index: ImportIndex, kind: str):
+        """Construct a view of the specified record type."""
+        self.index = index
+        self.kind = kind
+
+    def get(self, record_id, default=None):
+        """Return the index entry for the record, or the default if it has not been imported."""
+        found = self.index.get(self.kind, record_id)
+        return default if found is None else found
+
+    def __getitem__(self, record_id):
+        found = self.index.get(self.kind, record_id)
+        if found is None:
+            raise KeyError(record_id)
+        return found
+
+    def put(self, record_id, event_id=None, content_hash: str = None):
+        """Record an imported record along with the content hash of the upstream record."""
+        self.index.put(self.kind, record_id, event_id, content_hash)
+
+    def is_current(self, record_id, content_hash: str, modified=None) -> bool:
+        """Confirm if the imported copy of a record matches the upstream record.
+
+        Records indexed without a content hash (rebuilt from MISP or imported by an earlier
+        version) are treated as current unless the upstream record was modified after it was indexed.
+        """
+        found = self.index.get(self.kind, record_id)
+        if found is None:
+            return False
+        if found["content_hash"]:
+            return found["content_hash"] == content_hash
+        try:
+            return int(modified) <= found["updated"]
+        except (TypeError, ValueError):
+            return False
+
+    def __setitem__(self, record_id, event_id):
+        self.index.put(self.kind, record_id, None if isinstance(event_id, bool) else event_id)
+
+    def __contains__(self, record_id):
+        return self.index.get(self.kind, record_id) is not None
+
+    def __len__(self):
+        return self.index.count(self.kind)
+
+    def pop(self, record_id, default=None):
+        """Remove the record from the index, returning the previous entry."""
+        found = self.get(record_id, default)
+        self.index.remove(self.kind, record_id)
+        return found
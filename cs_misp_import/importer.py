@@ -1,5 +1,9 @@
 import datetime
 import logging
+import os
+import signal
+import threading
+import time
 import concurrent.futures
 from .adversary import Adversary
 from .report_type import ReportType
@@ -7,6 +11,10 @@ from .actors import ActorsImporter
 from .indicators import IndicatorsImporter
 from .reports import ReportsImporter
 from .threaded_misp import MISP
+from .import_index import ImportIndex
+from .cleanup import EventCleaner
+from .scheduler import FairScheduler
+from .metrics import LAST_SUCCESS
 from .helper import IMPORT_BANNER, DELETE_BANNER, INDICATOR_TYPES, display_banner
 
 class CrowdstrikeToMISPImporter:
@@ -16,6 +24,10 @@ class CrowdstrikeToMISPImporter:
     :param import_settings: dictionary containing settings specified in settings.py
     :param provided_arguments: dictionary containing provided command line arguments
     """
+    # Number of events retrieved per request when indexing existing MISP events
+    INDEX_PAGE_SIZE = 1000
+    # Number of days of events removed per pass when purging events by age
+    PURGE_WINDOW_DAYS = 30
 
     def __init__(self, intel_api_client, import_settings, provided_arguments, settings, logger: logging.Logger):
         """Construct an instance of the CrowdstrikeToMISPImporter class."""
@@ -50,7 +62,11 @@ class CrowdstrikeToMISPImporter:
         # }
         self.import_settings = import_settings
         self.log = logger
-        self.event_ids = {}
+        # Without an index file the index is kept in memory and rebuilt from MISP on every run
+        self.persistent_index = bool(import_settings.get("import_index_filename"))
+        self.import_index = ImportIndex(import_settings.get("import_index_filename") or ":memory:", logger)
+        # Streams imported together share one bounded, fairly scheduled pool of MISP workers
+        self.scheduler = FairScheduler(self.misp_client.thread_count, logger=logger)
 
         if self.config["actors"]:
             self.actors_importer = ActorsImporter(self.misp_client,
@@ -59,7 +75,8 @@ class CrowdstrikeToMISPImporter:
                                                   import_settings["actors_timestamp_filename"],
                                                   self.settings,
                                                   self.import_settings,
-                                                  logger=logger
+                                                  logger=logger,
+                                                  scheduler=self.scheduler
                                                   )
         if self.config["reports"]:
             self.reports_importer = ReportsImporter(self.misp_client,
@@ -68,7 +85,8 @@ class CrowdstrikeToMISPImporter:
                                                     import_settings["reports_timestamp_filename"],
                                                     self.settings,
                                                     self.import_settings,
-                                                    logger=logger
+                                                    logger=logger,
+                                                    scheduler=self.scheduler
                                                     )
         if self.config["indicators"]:
             self.indicators_importer = IndicatorsImporter(self.misp_client, intel_api_client,
@@ -78,9 +96,15 @@ class CrowdstrikeToMISPImporter:
                                                           self.config["delete_outdated_indicators"],
                                                           self.settings,
                                                           self.import_settings,
-                                                          logger=logger
+                                                          logger=logger,
+                                                          scheduler=self.scheduler
                                                           )
 
+    def close(self):
+        """Stop the shared MISP workers once their queued work completes, and close the import index."""
+        self.scheduler.shutdown()
+        self.import_index.close()
+
 
     def clean_crowdstrike_events(self, clean_reports, clean_indicators, clean_actors):
         """Delete events from a MISP instance."""
@@ -92,44 +116,37 @@ class CrowdstrikeToMISPImporter:
         #   Reports: "CrowdStrike:reports:type: {REPORT TYPE}"
         #
         # Passing in a list of tags to the search_index solution is pulling too many matches
-        # back in environments with large numbers of events.
-        def perform_threaded_delete(tag_to_hunt: str, tag_type: str):
-            self.log.info("Start clean up CrowdStrike %s events from MISP.", tag_type)
-            #qry = self.misp_client.build_complex_query(or_parameters=tag_to_hunt)
-            params = {
-                "tags": [tag_to_hunt]
-            }
-            if not self.import_settings["force"]:
-                params["minimal"] = True
-            with concurrent.futures.ThreadPoolExecutor(self.misp_client.thread_count, thread_name_prefix="thread") as executor:
-                #executor.map(self.misp_client.delete_event, self.misp_client.search_index(tags=tags, minimal=True))
-                #executor.map(self.misp_client.delete_event, self.misp_client.search(tag=qry, minimal=True))  # seems to bog down
-                executor.map(self.misp_client.delete_event, self.misp_client.search_index(**params))
-
+        # back in environments with large numbers of events, so each tag is searched separately.
         display_banner(banner=DELETE_BANNER,
                        logger=self.log,
                        fallback="BEGIN DELETE",
                        hide_cool_banners=self.import_settings["no_banners"]
                        )
         #self.log.info(DELETE_BANNER)
+        tags = self.crowdstrike_event_tags(clean_reports, clean_indicators, clean_actors)
+        for kind, selected in (("report", clean_reports), ("indicator", clean_indicators), ("actor", clean_actors)):
+            if selected:
+                self.import_index.clear(kind)
 
-        if clean_reports:
-            for report_type in [r for r in dir(ReportType) if "__" not in r]:
-                perform_threaded_delete(tag_to_hunt=f"CrowdStrike:report:type: {report_type}", tag_type=f"{report_type} report")
+        self.log.info("Start clean up of CrowdStrike events from MISP (%i tags).", len(tags))
+        deleted = EventCleaner(self.misp_client, self.log, force=self.import_settings["force"]).clean(tags)
 
-        if clean_indicators:
-                for ind_type in INDICATOR_TYPES:
-                    perform_threaded_delete(
-                        tag_to_hunt=f"CrowdStrike:indicator:type: {ind_type.upper()}",
-                        tag_type=f"{ind_type.upper()} indicator"
-                        )
+        self.log.info("Finished cleaning up CrowdStrike related events from MISP, %i events deleted.", deleted)
 
-        if clean_actors:
-            for adv_type in [a for a in dir(Adversary) if "__" not in a]:
-                perform_threaded_delete(tag_to_hunt=f"CrowdStrike:adversary:branch: {adv_type}", tag_type=f"Adversary ({adv_type})")
+    @staticmethod
+    def crowdstrike_event_tags(reports: bool = True, indicators: bool = True, actors: bool = True) -> list:
+        """Return the event tags that identify each selected type of CrowdStrike event."""
+        tags = []
+        if reports:
+            tags.extend(f"CrowdStrike:report:type: {r}" for r in dir(ReportType) if "__" not in r)
+        if indicators:
+            tags.extend(f"CrowdStrike:indicator:type: {i.upper()}" for i in INDICATOR_TYPES)
+            tags.extend(f"CrowdStrike:indicator:group: {g.upper()}" for g in IndicatorsImporter.GROUPINGS)
+        if actors:
+            tags.extend(f"CrowdStrike:adversary:branch: {a}" for a in dir(Adversary) if "__" not in a)
+
+        return tags
 
-        self.log.info("Finished cleaning up CrowdStrike related events from MISP, %i events deleted.", self.misp_client.deleted_event_count)
-            
     def remove_crowdstrike_tags(self):
         """Remove all CrowdStrike local tags from the MISP instance."""
         display_banner(banner=DELETE_BANNER,
@@ -149,25 +166,71 @@ class CrowdstrikeToMISPImporter:
         self.log.info("Finished cleaning up CrowdStrike related tags from MISP, %i tags deleted.", removed)
 
     def clean_old_crowdstrike_events(self, max_age):
-        """Remove events from MISP that are dated greater than the specified max_age value."""
-        # TODO: Revisions required, this logic will no longer work as it is written.
+        """Remove events from MISP that are dated greater than the specified max_age value.
+
+        Matching events are purged one timestamp window at a time, oldest first. The end of each
+        completed window is saved to the purge checkpoint file, so an interrupted purge resumes
+        where it stopped and later runs only search the period that has aged out since. The purge
+        stops at the first window with events that could not be deleted, so they are retried.
+        """
         display_banner(banner=DELETE_BANNER,
                        logger=self.log,
                        fallback="BEGIN DELETE",
                        hide_cool_banners=self.import_settings["no_banners"]
                        )
         #self.log.info(DELETE_BANNER)
-        if max_age is not None:
-            timestamp_max = int((datetime.date.today() - datetime.timedelta(max_age)).strftime("%s"))
-            events = self.misp_client.search(tags=["CrowdStrike:report%",
-                                                   "CrowdStrike:indicator%",
-                                                   "CrowdStrike:adversary%"
-                                                   ],
-                                             timestamp=[0, timestamp_max]
-                                             )
-            with concurrent.futures.ThreadPoolExecutor(self.misp_client.thread_count, thread_name_prefix="thread") as executor:
-                executor.map(self.misp_client.delete_event, events)
-            self.log.info("Finished cleaning up CrowdStrike related events from MISP.")
+        if max_age is None:
+            return
+        timestamp_max = int((datetime.datetime.now() - datetime.timedelta(days=max_age)).timestamp())
+        tags = self.crowdstrike_event_tags()
+        cleaner = EventCleaner(self.misp_client, self.log, force=self.import_settings["force"])
+        checkpoint_file = self.import_settings.get("purge_checkpoint_filename")
+        window_start = self.read_purge_checkpoint(checkpoint_file)
+        if window_start is None:
+            window_start = cleaner.oldest_timestamp(tags, timestamp=[0, timestamp_max])
+        if window_start is None or window_start >= timestamp_max:
+            self.log.info("No CrowdStrike related events older than %i days found in MISP.", max_age)
+            return
+
+        deleted = 0
+        window = self.PURGE_WINDOW_DAYS * 86400
+        while window_start < timestamp_max:
+            window_end = min(window_start + window, timestamp_max)
+            self.log.info("Removing CrowdStrike related events last updated between %s and %s.",
+                          datetime.datetime.fromtimestamp(window_start).strftime("%Y-%m-%d %H:%M:%S"),
+                          datetime.datetime.fromtimestamp(window_end).strftime("%Y-%m-%d %H:%M:%S")
+                          )
+            deleted += cleaner.clean(tags, timestamp=[window_start, window_end])
+            if not cleaner.complete:
+                # Leave the checkpoint at the start of this window so the next run retries it
+                self.log.warning("Unable to remove every CrowdStrike related event in this window "
+                                 "(%i events not deleted, %i tags not searched), stopping the purge here.",
+                                 len(cleaner.remaining), len(cleaner.failed_tags)
+                                 )
+                break
+            self.write_purge_checkpoint(checkpoint_file, window_end)
+            window_start = window_end
+        self.log.info("Finished cleaning up CrowdStrike related events from MISP, %i events deleted.", deleted)
+
+    def read_purge_checkpoint(self, filename: str) -> int:
+        """Return the timestamp the previous age based purge completed up to, if available."""
+        if not filename or not os.path.isfile(filename):
+            return None
+        try:
+            with open(filename, "r", encoding="utf-8") as checkpoint:
+                return int(checkpoint.read().strip())
+        except ValueError:
+            self.log.warning("Invalid purge checkpoint found in %s, searching all events.", filename)
+            return None
+
+    @staticmethod
+    def write_purge_checkpoint(filename: str, timestamp: int):
+        """Save the timestamp the age based purge has completed up to."""
+        if not filename:
+            return
+        with open(f"{filename}.tmp", "w", encoding="utf-8") as checkpoint:
+            checkpoint.write(str(timestamp))
+        os.replace(f"{filename}.tmp", filename)
 
     def import_from_crowdstrike(self,
                                 reports_days_before: int = 1,
@@ -186,23 +249,147 @@ class CrowdstrikeToMISPImporter:
                        hide_cool_banners=self.import_settings["no_banners"]
                        )
         #self.log.info(IMPORT_BANNER)
+        streams = self.import_streams(reports_days_before, indicators_minutes_before, actors_days_before)
+        # Each stream runs in its own thread, writes to MISP are shared out by the scheduler
+        failures = []
+        with concurrent.futures.ThreadPoolExecutor(max(len(streams), 1), thread_name_prefix="stream") as executor:
+            futures = {executor.submit(process, *args): name for name, (process, *args) in streams.items()}
+            for fut in concurrent.futures.as_completed(futures):
+                try:
+                    fut.result()
+                    LAST_SUCCESS.labels(stream=futures[fut]).set(time.time())
+                except Exception as err:  # pylint: disable=broad-except
+                    self.log.exception("Unable to complete the %s import.", futures[fut])
+                    failures.append(err)
+        self.import_index.flush()
+        if failures:
+            raise failures[0]
+
+    def import_streams(self, reports_days_before: int, indicators_minutes_before: int, actors_days_before: int) -> dict:
+        """Return the selected import streams as (process method, arguments) keyed by stream name."""
+        streams = {}
         if self.config["actors"]:
-            self.actors_importer.process_actors(actors_days_before, self.event_ids)
+            streams["actors"] = (self.actors_importer.process_actors, actors_days_before, self.imported_records("actor"))
         if self.config["reports"]:
-            self.reports_importer.process_reports(reports_days_before, self.event_ids)
+            streams["reports"] = (self.reports_importer.process_reports, reports_days_before, self.imported_records("report"))
         if self.config["indicators"]:
-            self.indicators_importer.process_indicators(indicators_minutes_before, self.event_ids)
+            streams["indicators"] = (self.indicators_importer.process_indicators,
+                                     indicators_minutes_before,
+                                     self.imported_records("indicator")
+                                     )
+
+        return streams
+
+    def run_daemon(self,
+                   intervals: dict,
+                   reports_days_before: int = 1,
+                   indicators_minutes_before: int = 1,
+                   actors_days_before: int = 1,
+                   max_age: int = None
+                   ):
+        """Continuously import from the Crowdstrike Intel API, polling each stream on its own interval.
+
+        Clients and the import index stay loaded between polls, the adversary names and details
+        cached by the reports stream are retrieved again on each poll. Runs until SIGINT or SIGTERM
+        is received, allowing any poll that is underway to finish.
+
+        :param intervals: seconds between polls keyed by stream (actors, reports, indicators and purge)
+        :param reports_days_before: in case on an initial run, this is the age of the reports pulled in days
+        :param indicators_minutes_before: in case on an initial run, this is the age of the indicators pulled in minutes
+        :param actors_days_before: in case on an initial run, this is the age of the actors pulled in days
+        :param max_age: when provided, events older than this many days are purged on the purge interval
+        """
+        display_banner(banner=IMPORT_BANNER,
+                       logger=self.log,
+                       fallback=None,
+                       hide_cool_banners=self.import_settings["no_banners"]
+                       )
+        streams = self.import_streams(reports_days_before, indicators_minutes_before, actors_days_before)
+        if max_age is not None:
+            streams["purge"] = (self.clean_old_crowdstrike_events, max_age)
+        stop = threading.Event()
+
+        def request_stop(signum, _):
+            self.log.info("Received %s, stopping once the current imports finish.", signal.Signals(signum).name)
+            stop.set()
+
+        previous = {sig: signal.signal(sig, request_stop) for sig in (signal.SIGINT, signal.SIGTERM)}
+        pollers = [threading.Thread(target=self._poll_stream,
+                                    args=(name, process, args, intervals[name], stop),
+                                    name=name
+                                    ) for name, (process, *args) in streams.items()
+                   ]
+        self.log.info("Daemon started, polling %s.",
+                      ", ".join(f"{name} every {intervals[name]} seconds" for name in streams)
+                      )
+        try:
+            for poller in pollers:
+                poller.start()
+            while not stop.is_set():
+                stop.wait(1)
+        finally:
+            stop.set()
+            for poller in pollers:
+                poller.join()
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+            self.import_index.flush()
+        self.log.info("Daemon stopped.")
 
+    def _poll_stream(self, name: str, process, args: tuple, interval: float, stop: threading.Event):
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                self._refresh_caches(name)
+                process(*args)
+                LAST_SUCCESS.labels(stream=name).set(time.time())
+            except Exception:  # pylint: disable=broad-except
+                self.log.exception("Unable to complete the %s import, retrying in %i seconds.", name, interval)
+            self.import_index.flush()
+            stop.wait(max(0.0, interval - (time.monotonic() - started)))
+
+    def _refresh_caches(self, name: str):
+        """Discard what the previous poll of a stream cached, so it is retrieved from the Intel API again."""
+        if name == "reports":
+            # Adversaries published since the last poll are matched when tagging reports
+            self.reports_importer.known_actors = []
+            self.reports_importer.intel_api_client.actor_cache.clear()
+
+    def imported_records(self, kind: str):
+        """Return the lookup of records of the specified type already imported into MISP.
+
+        :param kind: record type (actor, report or indicator)
+        """
+        return self.import_index.view(kind)
+
+    def index_requires_rebuild(self, kind: str, rebuild: bool = False) -> bool:
+        """Confirm if the existing events of the specified type need to be retrieved from MISP.
+
+        :param kind: record type (actor or report)
+        :param rebuild: force the local import index to be rebuilt from MISP
+        """
+        return not self.persistent_index or rebuild or not self.import_index.is_built(kind)
 
     def import_from_misp(self, tags, do_reports: bool = False):
-        """Retrieve existing MISP events."""
-        events = self.misp_client.search_index(tags=tags)
-        for event in events:
-            if event.get('info'):
-                if not do_reports:
-                    self.event_ids[event.get('info')] = True
+        """Retrieve existing MISP events, rebuilding the local import index if enabled."""
+        kind = "report" if do_reports else "actor"
+        if self.persistent_index:
+            self.log.info("Rebuilding local %s import index from MISP.", kind)
+        self.import_index.clear(kind)
+        imported = self.imported_records(kind)
+        page = 1
+        while True:
+            events = self.misp_client.search_index(tags=tags, limit=self.INDEX_PAGE_SIZE, page=page)
+            for event in events:
+                if event.get('info'):
+                    record_id = event.get("info").split(" ")[0]
+                    if not do_reports:
+                        record_id = record_id.replace("ADV-", "", 1)
+                    imported[record_id] = event.get("id")
                 else:
-                    self.event_ids[event.get("info").split(" ")[0].split("-")[1]] = True
-
-            else:
-                self.log.warning("Event %s missing info field.", event)
\ No newline at end of file
+                    self.log.warning("Event %s missing info field.", event)
+            if len(events) < self.INDEX_PAGE_SIZE:
+                break
+            page += 1
+        self.import_index.mark_built(kind)
+        self.log.info("Indexed %i existing %s events.", self.import_index.count(kind), kind)
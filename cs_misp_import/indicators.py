@@ -20,22 +20,42 @@
 :    ::    :   :: :  :   :     :: :: :   :   : :     :      : :  :    :   : :  :: : :
 
 """
+import collections
 import datetime
 import logging
 import os
+import queue
+import threading
 
 import concurrent.futures
 from .confidence import MaliciousConfidence
-from .helper import confirm_boolean_param, gen_indicator, INDICATORS_BANNER, display_banner
+from .helper import (
+    confirm_boolean_param,
+    gen_indicator,
+    gen_indicators,
+    INDICATORS_BANNER,
+    display_banner,
+    deterministic_uuid,
+    stamp_uuids
+)
 from .adversary import Adversary
 from .kill_chain import KillChain
+from .checkpoint import CheckpointJournal
+from .scheduler import push_executor
+from .profiling import profiled
+from .tracing import span
+from .memory_profiling import memory_snapshot
+from .metrics import EVENTS_BUILT, EVENTS_PUSHED, QUEUE_DEPTH, RECORDS_FETCHED, RECORDS_SKIPPED
 try:
-    from pymisp import MISPObject, MISPEvent, MISPAttribute, ExpandedPyMISP, MISPTag
+    from pymisp import MISPObject, MISPEvent, MISPAttribute, ExpandedPyMISP, MISPTag, PyMISPError
 except ImportError as no_pymisp:
     raise SystemExit(
         "The PyMISP package must be installed to use this program."
         ) from no_pymisp
 
+# Marks the end of the indicator pipeline
+PIPELINE_DONE = object()
+
 class IndicatorsImporter:
     """Tool used to import indicators from the Crowdstrike Intel API.
 
@@ -45,6 +65,14 @@ class IndicatorsImporter:
     :param intel_api_client: client for the Crowdstrike Intel API
     """
     MISSING_GALAXIES = None
+    # Number of pages allowed to queue up between each pipeline stage
+    PIPELINE_DEPTH = 2
+    # Seconds a pipeline stage waits on a queue before checking whether the pipeline has stopped
+    PIPELINE_POLL = 0.5
+    # Maximum number of attributes appended to a grouped event per request
+    GROUPED_BATCH_SIZE = 500
+    # Supported dimensions for grouping indicators into shared events
+    GROUPINGS = ["day", "malware_family", "adversary", "type"]
     def __init__(self,
                  misp_client,
                  intel_api_client,
@@ -54,12 +82,14 @@ class IndicatorsImporter:
                  delete_outdated,
                  settings,
                  import_settings,
-                 logger
+                 logger,
+                 scheduler = None
                  ):
         """Construct an instance of the IndicatorsImporter class."""
         self.misp: ExpandedPyMISP = misp_client
         self.intel_api_client = intel_api_client
         self.indicators_timestamp_filename = indicators_timestamp_filename
+        self.checkpoint = CheckpointJournal(indicators_timestamp_filename, logger, "indicators")
         self.import_all_indicators = import_all_indicators
         self.delete_outdated = delete_outdated
         self.settings = settings
@@ -69,6 +99,14 @@ class IndicatorsImporter:
         self.import_settings = import_settings
         self.galaxy_miss_file = import_settings.get("miss_track_file", "no_galaxy_mapping.log")
         self.log: logging.Logger = logger
+        # Shared MISP worker pool when streams are imported concurrently
+        self.scheduler = scheduler
+        self.grouping = str(import_settings.get("indicator_grouping") or "").lower()
+        if self.grouping not in self.GROUPINGS:
+            self.grouping = None
+        self.bucket_events = {}
+        self._bucket_lock = threading.Lock()
+        self._bucket_key_locks = {}
 
     def _log_galaxy_miss(self, family: str):
         if self.MISSING_GALAXIES is None:
@@ -109,11 +147,9 @@ class IndicatorsImporter:
         start_get_events = int((
             datetime.datetime.today() + datetime.timedelta(minutes=-int(min(indicators_mins_before, 20220)))
             ).timestamp())
-        if not self.import_settings.get("force", False):
-            if os.path.isfile(self.indicators_timestamp_filename):
-                with open(self.indicators_timestamp_filename, 'r', encoding="utf-8") as ts_file:
-                    line = ts_file.readline()
-                    start_get_events = int(line)
+        self.checkpoint.reload()
+        if not self.import_settings.get("force", False) and self.checkpoint.position is not None:
+            start_get_events = self.checkpoint.position
 
         # Let's see if we can't speed this up a bit
         self.already_imported = events_already_imported
@@ -121,86 +157,362 @@ class IndicatorsImporter:
         self.log.info("Started getting indicators from Crowdstrike Intel API and pushing them in MISP.")
         time_send_request = datetime.datetime.now()
 
-        indicators_count = 0
-        for indicators_page in self.intel_api_client.get_indicators(start_get_events, self.delete_outdated):
-            self.push_indicators(indicators_page)
-            indicators_count += len(indicators_page)
+        # Staged pipeline: fetch -> convert -> push. Each stage hands off through a bounded
+        # queue so page N+1 is downloaded and converted while page N is written to MISP.
+        # If the push stage fails, the stop flag releases the stages blocked on a full queue
+        fetched = queue.Queue(maxsize=self.PIPELINE_DEPTH)
+        converted = queue.Queue(maxsize=self.PIPELINE_DEPTH)
+        stop = threading.Event()
+        stages = [
+            threading.Thread(target=self._fetch_stage, args=(start_get_events, fetched, stop), name="fetch", daemon=True),
+            threading.Thread(target=self._convert_stage, args=(fetched, converted, stop), name="convert", daemon=True)
+        ]
+        for stage in stages:
+            stage.start()
+        try:
+            with push_executor(self.scheduler, "indicators", self.misp.thread_count) as executor:
+                indicators_count = self._push_stage(converted, executor)
+        finally:
+            stop.set()
+            for stage in stages:
+                stage.join()
+            # Release any pages left queued by a failed run
+            for pending in (fetched, converted):
+                while not pending.empty():
+                    pending.get_nowait()
 
         self.log.info("Got %i indicators from the Crowdstrike Intel API.", indicators_count)
+        self._note_galaxy_misses()
 
         if indicators_count == 0:
-            self._note_timestamp(time_send_request.timestamp())
+            self.checkpoint.advance(time_send_request.timestamp())
+        self.checkpoint.close()
+        memory_snapshot("indicators", "finished")
         #else:
             #self.get_cs_reports_from_misp()
             #self.push_indicators(indicators, events_already_imported)
 
         self.log.info("Finished getting indicators from Crowdstrike Intel API and pushing them in MISP.")
 
+    def _put(self, pipeline: queue.Queue, item, stop: threading.Event) -> bool:
+        """Queue an item for the next stage, returning False if the pipeline stopped first."""
+        while not stop.is_set():
+            try:
+                pipeline.put(item, timeout=self.PIPELINE_POLL)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _get(self, pipeline: queue.Queue, stop: threading.Event):
+        """Return the next item from the previous stage, or PIPELINE_DONE if the pipeline stopped first."""
+        while not stop.is_set():
+            try:
+                return pipeline.get(timeout=self.PIPELINE_POLL)
+            except queue.Empty:
+                continue
+
+        return PIPELINE_DONE
+
+    def _fetch_stage(self, start_get_events, fetched: queue.Queue, stop: threading.Event):
+        """Retrieve indicator pages from the Intel API and hand them to the convert stage."""
+        try:
+            for indicators_page in self.intel_api_client.get_indicators(start_get_events, self.delete_outdated):
+                RECORDS_FETCHED.labels(stream="indicators").inc(len(indicators_page))
+                memory_snapshot("indicators", "fetched", indicators=len(indicators_page))
+                if not self._put(fetched, indicators_page, stop):
+                    return
+                QUEUE_DEPTH.labels(stream="indicators", queue="fetched").set(fetched.qsize())
+            self._put(fetched, PIPELINE_DONE, stop)
+        except Exception as err:  # pylint: disable=broad-except
+            self._put(fetched, err, stop)
+
+    def _convert_stage(self, fetched: queue.Queue, converted: queue.Queue, stop: threading.Event):
+        """Build MISP events for each fetched page and hand them to the push stage."""
+        while True:
+            indicators_page = self._get(fetched, stop)
+            QUEUE_DEPTH.labels(stream="indicators", queue="fetched").set(fetched.qsize())
+            if indicators_page is PIPELINE_DONE or isinstance(indicators_page, Exception):
+                self._put(converted, indicators_page, stop)
+                break
+            try:
+                work = self.convert_indicators(indicators_page)
+                memory_snapshot("indicators", "converted", indicators=len(indicators_page), events=len(work))
+                if not self._put(converted, (indicators_page, work), stop):
+                    break
+                QUEUE_DEPTH.labels(stream="indicators", queue="converted").set(converted.qsize())
+            except Exception as err:  # pylint: disable=broad-except
+                self._put(converted, err, stop)
+                break
+
+    def _push_stage(self, converted: queue.Queue, executor) -> int:
+        """Push converted pages into MISP using the long-lived worker pool.
+
+        Each page is journaled before it is handed to MISP, and the checkpoint journal only
+        advances the timestamp file past pages where every push was confirmed.
+        """
+        in_flight = collections.deque()
+        indicators_count = 0
+        while True:
+            page = converted.get()
+            QUEUE_DEPTH.labels(stream="indicators", queue="converted").set(converted.qsize())
+            if page is PIPELINE_DONE:
+                break
+            if isinstance(page, Exception):
+                # Let the pages already handed to MISP finish before surfacing the failure
+                while in_flight:
+                    self._complete_page(*in_flight.popleft())
+                raise page
+            indicators_page, work = page
+            checkpoint_page = self.checkpoint.begin(self._page_position(indicators_page))
+            futures = [executor.submit(push, *args) for push, args in work]
+            in_flight.append((indicators_page, work, futures, checkpoint_page))
+            indicators_count += len(indicators_page)
+            while len(in_flight) > self.PIPELINE_DEPTH:
+                self._complete_page(*in_flight.popleft())
+        while in_flight:
+            self._complete_page(*in_flight.popleft())
+
+        return indicators_count
+
+    def _page_position(self, indicators: list) -> int:
+        """Return the position to resume from once a page of indicators has been written."""
+        last_updated = next(
+            (i.get('last_updated') for i in reversed(indicators) if i.get('last_updated') is not None), None
+            )
+        if last_updated is None:
+            return self.checkpoint.position or 0
+
+        return int(last_updated)
+
+    def _complete_page(self, indicators: list, work: list, futures: list, checkpoint_page: int):
+        """Wait for a page of indicator pushes to finish and confirm it in the checkpoint journal."""
+        concurrent.futures.wait(futures)
+        failed = []
+        for (push, args), fut in zip(work, futures):
+            if fut.exception() is not None or fut.result() is False:
+                if push == self.__push_indicator_bucket:
+                    failed.extend(i.get("id") for i in args[1])
+                else:
+                    failed.append(args[0].get("id"))
+        self.checkpoint.commit(checkpoint_page, failed)
+        memory_snapshot("indicators", "pushed", indicators=len(indicators), events=len(work))
+        EVENTS_PUSHED.labels(stream="indicators", result="success").inc(len(indicators) - len(failed))
+        EVENTS_PUSHED.labels(stream="indicators", result="failed").inc(len(failed))
+
+        self.log.info("Pushed %i indicators to MISP.", len(indicators) - len(failed))
+
+    @profiled("build.indicators")
+    def convert_indicators(self, indicators) -> list:
+        """Convert a page of indicators into a list of (push method, arguments) work items."""
+        converted = []
+        if self.import_all_indicators:
+            if self.grouping:
+                converted = self._convert_grouped_indicators(indicators)
+                EVENTS_BUILT.labels(stream="indicators").inc(sum(len(args[1]) for _, args in converted))
+                return converted
+            # The whole page is converted at once, each event is then built around its converted indicator
+            for indicator, indicator_object in zip(indicators, gen_indicators(indicators)):
+                if indicator.get('indicator'):
+                    try:
+                        with span("build.indicator", record=("indicator", indicator.get("id")),
+                                  **{"crowdstrike.indicator.type": indicator.get("type")}
+                                  ):
+                            event = self.__create_indicator_event(indicator, indicator_object)
+                        converted.append((self.__push_indicator_event, (indicator, event)))
+                    except Exception as err:  # pylint: disable=broad-except
+                        self.log.warning("Could not create event for indicator %s.\n%s", indicator.get('id'), str(err))
+            EVENTS_BUILT.labels(stream="indicators").inc(len(converted))
+
+        return converted
+
+    def _group_key(self, indicator) -> str:
+        """Return the bucket an indicator belongs to for the configured grouping dimension."""
+        key = None
+        if self.grouping == "day":
+            stamp = indicator.get("published_date") or indicator.get("last_updated")
+            if stamp:
+                key = datetime.datetime.utcfromtimestamp(stamp).strftime("%Y-%m-%d")
+        elif self.grouping == "malware_family":
+            families = indicator.get("malware_families", [])
+            key = families[0] if families else None
+        elif self.grouping == "adversary":
+            actors = indicator.get("actors", [])
+            key = actors[0] if actors else None
+        elif self.grouping == "type":
+            key = indicator.get("type", "").upper() or None
+
+        return key if key else "UNATTRIBUTED"
+
+    def _convert_grouped_indicators(self, indicators) -> list:
+        """Bucket a page of indicators and build the attributes and objects to append to each bucket event."""
+        buckets = {}
+        for indicator, indicator_object in zip(indicators, gen_indicators(indicators)):
+            if not indicator.get('indicator'):
+                continue
+            key = self._group_key(indicator)
+            try:
+                with span("build.indicator", record=("indicator", indicator.get("id")),
+                          **{"crowdstrike.indicator.type": indicator.get("type")}
+                          ):
+                    converted = self.__create_indicator_attribute(indicator, indicator_object, self._bucket_uuid(key))
+            except Exception as err:  # pylint: disable=broad-except
+                self.log.warning("Could not convert indicator %s.\n%s", indicator.get('id'), str(err))
+                continue
+            if converted:
+                bucket = buckets.setdefault(key, ([], [], []))
+                bucket[0].append(indicator)
+                bucket[1 if isinstance(converted, MISPAttribute) else 2].append(converted)
+
+        return [(self.__push_indicator_bucket, (key, *bucket)) for key, bucket in buckets.items()]
+
+    def __create_indicator_attribute(self, indicator, indicator_object = None, event_uuid: str = None) -> MISPAttribute or MISPObject:
+        """Create a tagged attribute (or object) for an indicator stored within a grouped event.
+
+        :param indicator: indicator record
+        :param indicator_object: the indicator already converted by gen_indicators (optional)
+        :param event_uuid: UUID of the grouped event, the indicator's UUIDs are scoped to it
+        """
+        if indicator_object is None:
+            indicator_object = gen_indicator(indicator, [])
+        if isinstance(indicator_object, Exception):
+            raise indicator_object
+        if not indicator_object:
+            return indicator_object
+        tags = [f"CrowdStrike:indicator:type: {indicator.get('type').upper()}"]
+        for malware_family in indicator.get('malware_families', []):
+            galaxy = self.import_settings["galaxy_map"].get(malware_family)
+            if galaxy is not None:
+                tags.append(galaxy)
+            else:
+                self._log_galaxy_miss(malware_family)
+        if indicator.get('malicious_confidence'):
+            tags.append(f"CrowdStrike:indicator:malicious-confidence: {indicator.get('malicious_confidence').upper()}")
+        for actor in indicator.get('actors', []):
+            for adv in [a for a in dir(Adversary) if "__" not in a]:
+                if actor.upper().endswith(adv):
+                    tags.append(f"CrowdStrike:adversary:branch: {adv}")
+        for threat_type in indicator.get("threat_types") or []:
+            tags.append(f"CrowdStrike:indicator:threat: {threat_type.upper()}")
+
+        indicator_uuid = deterministic_uuid("indicator", event_uuid or "", indicator.get("id") or indicator.get("indicator"))
+        indicator_object.uuid = indicator_uuid
+        if isinstance(indicator_object, MISPObject):
+            for att in indicator_object.attributes:
+                att.uuid = deterministic_uuid(indicator_uuid, att.object_relation, att.value)
+                for tag in tags:
+                    att.add_tag(tag)
+        else:
+            if indicator.get("published_date"):
+                indicator_object.first_seen = indicator.get("published_date")
+            if indicator.get("last_updated"):
+                indicator_object.last_seen = indicator.get("last_updated")
+            indicator_object.comment = indicator.get("id", "")
+            for tag in tags:
+                indicator_object.add_tag(tag)
+
+        return indicator_object
+
+    def _bucket_uuid(self, key: str) -> str:
+        """Return the stable UUID of the grouped event for an indicator bucket."""
+        return deterministic_uuid("event", "indicator-group", self.grouping, key)
+
+    def _bucket_event_id(self, key: str):
+        """Return the MISP event ID for a grouped indicator bucket, creating the event if required."""
+        with self._bucket_lock:
+            key_lock = self._bucket_key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self.bucket_events:
+                event = MISPEvent()
+                event.analysis = 2
+                event.orgc = self.crowdstrike_org
+                event.info = f"CrowdStrike Indicators ({self.grouping.replace('_', ' ')}): {key}"
+                # Bucket events have stable UUIDs, so an existing bucket is addressed without a lookup
+                event.uuid = self._bucket_uuid(key)
+                event.add_tag(f"CrowdStrike:indicator:group: {self.grouping.upper()}")
+                if self.grouping == "type":
+                    event.add_tag(f"CrowdStrike:indicator:type: {key}")
+                self.__add_taxonomy_tags(event)
+                created = self.misp.add_event(event)
+                if "errors" in created and not self.misp.already_exists(created):
+                    raise PyMISPError(f"Unable to create grouped event {event.info}: {created['errors']}")
+                self.bucket_events[key] = event.uuid
+                self.log.debug("Using grouped indicator event %s", event.info)
+
+        return self.bucket_events[key]
+
+    def __push_indicator_bucket(self, key: str, indicators: list, attributes: list, objects: list):
+        """Append a batch of indicator attributes and objects to the shared event for their bucket."""
+        # Grouped pushes carry many indicators, so they are traced on their own rather than per record
+        with span("push.indicator_bucket",
+                  **{"crowdstrike.indicator.group": key, "crowdstrike.indicator.count": len(indicators)}
+                  ) as bucket_span:
+            try:
+                event_id = self._bucket_event_id(key)
+                errors = []
+                for pos in range(0, len(attributes), self.GROUPED_BATCH_SIZE):
+                    batch = attributes[pos:pos+self.GROUPED_BATCH_SIZE]
+                    response = self.misp.add_attribute(event_id, batch, break_on_duplicate=False)
+                    errors.extend(self._update_duplicates(response, batch, self.misp.update_attribute))
+                for indicator_object in objects:
+                    response = self.misp.add_object(event_id, indicator_object)
+                    errors.extend(self._update_duplicates(response, [indicator_object], self.misp.update_object))
+                if errors:
+                    raise PyMISPError(str(errors[0]))
+                if self.already_imported is not None:
+                    for indicator in indicators:
+                        self.already_imported[indicator.get('indicator')] = event_id
+                self.log.debug("Added %i indicators to grouped event %s", len(indicators), key)
+            except Exception as err:
+                self.log.warning("Could not add indicators to grouped event %s.\n%s", key, str(err))
+                bucket_span.set_error(err)
+                return False
+
+        return True
+
+    def _update_duplicates(self, response, items: list, update) -> list:
+        """Update the items an add rejected as already present, returning the errors of any other failures.
+
+        Indicators are only retrieved again when they change, so an indicator already in its
+        grouped event is updated in place.
+
+        :param response: MISP response to adding the items
+        :param items: attributes or objects submitted, in order
+        :param update: MISP client method that updates one of the items
+        """
+        errors = []
+        for key, messages in self.misp.item_errors(response).items():
+            if not self.misp.duplicate(messages):
+                errors.append(messages)
+                continue
+            # Errors reported for the request as a whole apply to every item
+            for item in [items[int(key)]] if key.isdigit() and int(key) < len(items) else items:
+                updated = update(item, item.uuid)
+                # Not found when the duplicate is a matching value with a different UUID, which is left alone
+                if isinstance(updated, dict) and "errors" in updated and self.misp.error_status(updated) != 404:
+                    errors.append(updated["errors"])
+
+        return errors
+
     def push_indicators(self, indicators, events_already_imported = None):
         """Push valid indicators into MISP."""
-        def threaded_indicator_push(indicator):
-            # if not self.import_all_indicators and len(indicators.get('reports', [])) == 0:
-            #     return
-            indicator_name = indicator.get('indicator')
-
-            # if self.delete_outdated and indicator_name is not None and indicator.get('deleted', False):
-            #     events = self.misp.search_index(eventinfo=indicator_name, pythonify=True)
-            #     for event in events:
-            #         self.misp.delete_event(event)
-            #         try:
-            #             events_already_imported.pop(indicator_name)
-            #         except Exception as err:
-            #             self.log.debug("indicator %s was marked as deleted in intel API but is not stored in MISP."
-            #                           " skipping.\n%s",
-            #                           indicator_name,
-            #                           str(err)
-            #                           )
-            #         self.log.warning('deleted indicator %s', indicator_name)
-            #     return
-            # elif indicator_name is not None and events_already_imported.get(indicator_name) is not None:
-            #     return
-            # else:
-                #related_to_a_misp_report = False
-            if indicator_name:
-                #for report in indicator.get('reports', []):
-                # #    event = self.reports_ids.get(report)
-                # #    if event:
-                # #        related_to_a_misp_report = True
-                #         #indicator_object = self.__create_object_for_indicator(indicator)
-                # indicator_object = gen_indicator(indicator, self.settings["CrowdStrike"].get("indicators_tags", [])].split(","))
-                # if indicator_object:
-                #     try:
-                #         if isinstance(indicator_object, MISPObject):
-                #             self.misp.add_object(event, indicator_object, True)
-                #         elif isinstance(indicator_object, MISPAttribute):
-                #             self.misp.add_attribute(event, indicator_object, True)
-                #     except Exception as err:
-                #         self.log.warning("Could not add object or attribute %s for event %s.\n%s",
-                #                         indicator_object,
-                #                         event,
-                #                         str(err)
-                #                         )
-                # else:
-                #     self.log.warning("Indicator %s missing indicator field.", indicator.get('id'))
-
-                #if related_to_a_misp_report or self.import_all_indicators:
-                if self.import_all_indicators:
-                    self.__add_indicator_event(indicator)
-                    if indicator_name is not None:
-                        events_already_imported[indicator_name] = True
-
-        if events_already_imported is None:
-            events_already_imported = self.already_imported
-        with concurrent.futures.ThreadPoolExecutor(self.misp.thread_count, thread_name_prefix="thread") as executor:
-            executor.map(threaded_indicator_push, indicators)
-
-        last_updated = next(i.get('last_updated') for i in reversed(indicators) if i.get('last_updated') is not None)
-        self._note_timestamp(str(last_updated))
-
-        self.log.info("Pushed %i indicators to MISP.", len(indicators))
-
-    def __add_indicator_event(self, indicator):
-        """Add an indicator event for the indicator specified."""
+        if events_already_imported is not None:
+            self.already_imported = events_already_imported
+        with push_executor(self.scheduler, "indicators", self.misp.thread_count) as executor:
+            checkpoint_page = self.checkpoint.begin(self._page_position(indicators))
+            work = self.convert_indicators(indicators)
+            futures = [executor.submit(push, *args) for push, args in work]
+            self._complete_page(indicators, work, futures, checkpoint_page)
+
+    def __create_indicator_event(self, indicator, indicator_object = None) -> MISPEvent:
+        """Create an indicator event for the indicator specified.
+
+        :param indicator: indicator record
+        :param indicator_object: the indicator already converted by gen_indicators (optional)
+        """
+        if isinstance(indicator_object, Exception):
+            raise indicator_object
         event = MISPEvent()
         event.analysis = 2
         event.orgc = self.crowdstrike_org
@@ -218,7 +530,8 @@ class IndicatorsImporter:
             #event.info = f"{indicator_value} ({indicator_type.upper()})"
             event.info = indicator_value
             #indicator_object = self.__create_object_for_indicator(indicator)
-            indicator_object = gen_indicator(indicator, [])
+            if indicator_object is None:
+                indicator_object = gen_indicator(indicator, [])
 
             if indicator_object:
                 if isinstance(indicator_object, MISPObject):
@@ -290,14 +603,16 @@ class IndicatorsImporter:
             tag_list = __update_tag_list(tag_list, f"CrowdStrike:indicator:type: {indicator.get('type').upper()}")
 
         family_found = False
-        for malware_family in indicator.get('malware_families', []):
+        malware_families = indicator.get('malware_families', [])
+        for malware_family in malware_families:
             galaxy = self.import_settings["galaxy_map"].get(malware_family)
             if galaxy is not None:
                 tag_list = __update_tag_list(tag_list, galaxy)
                 family_found = True
 
         if not family_found:
-            self._log_galaxy_miss(malware_family)
+            for malware_family in malware_families:
+                self._log_galaxy_miss(malware_family)
             if confirm_boolean_param(self.settings["TAGGING"].get("taxonomic_WORKFLOW", False)):
                 tag_list = __update_tag_list(tag_list, 'workflow:todo="add-missing-misp-galaxy-cluster-values"')
             else:
@@ -368,6 +683,13 @@ class IndicatorsImporter:
         for _tag in tag_list:
             #self.log.debug("Indicator event tagged as %s", _tag)
             event.add_tag(_tag)
+        self.__add_taxonomy_tags(event)
+        stamp_uuids(event, "indicator", indicator.get("id") or indicator_value)
+
+        return event
+
+    def __add_taxonomy_tags(self, event: MISPEvent):
+        """Apply the configured taxonomic tags to an indicator event."""
         # TYPE Taxonomic tag, all events
         if confirm_boolean_param(self.settings["TAGGING"].get("taxonomic_TYPE", False)):
             event.add_tag('type:CYBINT')
@@ -388,16 +710,36 @@ class IndicatorsImporter:
         if confirm_boolean_param(self.settings["TAGGING"].get("taxonomic_TLP", False)):
             event.add_tag("tlp:amber")
 
-        try:
-            self.misp.add_event(event)
-            self.log.debug("Successfully added unattributed indicator event for indicator %s", event.info)
-        except Exception as err:
-            self.log.warning("Could not add event %s.\n%s", event.info, str(err))
-
+    def __push_indicator_event(self, indicator, event: MISPEvent):
+        """Add the indicator event to MISP.
 
-    def _note_timestamp(self, timestamp):
-        with open(self.indicators_timestamp_filename, 'w', encoding="utf-8") as ts_file:
-            ts_file.write(str(int(timestamp)))
+        Returns True when the event was written, None when MISP has blocklisted the event and False on failure.
+        """
+        with span("push.indicator", record=("indicator", indicator.get("id"))) as push_span:
+            try:
+                created = self.misp.upsert_event(event)
+                if self.misp.blocklisted(created):
+                    # Deliberately blocked in MISP, this is not retried
+                    self.log.info("Indicator %s is on the MISP event blocklist (%s), skipping.", event.info, event.uuid)
+                    push_span.set_attribute("crowdstrike.blocklisted", True)
+                    RECORDS_SKIPPED.labels(stream="indicators").inc()
+                    return None
+                if "errors" in created:
+                    self.log.warning("Could not add event %s.\n%s", event.info, created["errors"])
+                    push_span.set_error(created["errors"])
+                    return False
+                self.log.debug("Successfully added unattributed indicator event for indicator %s", event.info)
+                if self.already_imported is not None:
+                    self.already_imported[indicator.get('indicator')] = created.get("Event", {}).get("id")
+            except Exception as err:
+                self.log.warning("Could not add event %s.\n%s", event.info, str(err))
+                push_span.set_error(err)
+                return False
+
+        return True
+
+
+    def _note_galaxy_misses(self):
         if self.MISSING_GALAXIES:
             for _galaxy in self.MISSING_GALAXIES:
                 self.log.warning("No galaxy mapping found for %s malware family.", _galaxy)
@@ -1,4 +1,7 @@
 import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import reduce
 try:
     from falconpy import Intel, __version__ as FALCONPY_VERSION
@@ -7,6 +10,9 @@ except ImportError as no_falconpy:
         "The CrowdStrike FalconPy package must be installed to use this program."
         ) from no_falconpy
 from ._version import __version__ as MISPImportVersion
+from .rate_limit import RateLimitGovernor, GovernedIntel
+from .auth_cache import AuthCache
+from .tracing import span
 
 current = FALCONPY_VERSION.split(".")
 requested = "0.9.0".split(".")
@@ -17,7 +23,17 @@ if bool(float(f"{current[0]}.{current[1]}") < float(f"{requested[0]}.{requested[
 class IntelAPIClient:
     """This class provides the interface for the CrowdStrike Intel API."""
 
-    def __init__(self, client_id, client_secret, crowdstrike_url, api_request_max, use_ssl: bool = True, logger: logging.Logger = None):
+    def __init__(self,
+                 client_id,
+                 client_secret,
+                 crowdstrike_url,
+                 api_request_max,
+                 use_ssl: bool = True,
+                 logger: logging.Logger = None,
+                 api_request_concurrency: int = 4,
+                 auth_cache: AuthCache = None,
+                 service=None
+                 ):
         """Construct an instance of the IntelAPIClient class.
 
         :param client_id: CrowdStrike API Client ID
@@ -25,42 +41,55 @@ class IntelAPIClient:
         :param crowdstrike_url: CrowdStrike Base URL / Base URL shortname
         :param api_request_max [int]: Maximum number of records to return per API request
         :param use_ssl [bool]: Enable SSL validation to the CrowdStrike Cloud (default: True)
+        :param api_request_concurrency [int]: Maximum number of result pages to retrieve at once (default: 4)
+        :param auth_cache [AuthCache]: Reuse a previously issued bearer token until it expires (default: None)
+        :param service: Intel API service to use instead of FalconPy, such as a synthetic stand-in (default: None)
         """
         
         ua = f"crowdstrike-misp-import/{MISPImportVersion}"
-        self.falcon = Intel(client_id=client_id, client_secret=client_secret, base_url=crowdstrike_url, ssl_verify=use_ssl, user_agent=ua)
-        self.valid_report_types = ["csa", "csir", "csit", "csgt", "csdr", "csia", "csmr", "csta", "cswr"]
         self.request_size_limit = api_request_max
+        self.request_concurrency = max(1, int(api_request_concurrency or 1))
+        # All Intel API requests are paced by a single governor shared across threads
+        self.governor = RateLimitGovernor(burst=max(10, self.request_concurrency), logger=logger)
+        if service is not None:
+            intel = service
+        elif auth_cache:
+            auth = auth_cache.oauth(client_id, client_secret, crowdstrike_url, ssl_verify=use_ssl, user_agent=ua)
+            intel = Intel(auth_object=auth, user_agent=ua)
+        else:
+            intel = Intel(client_id=client_id, client_secret=client_secret, base_url=crowdstrike_url, ssl_verify=use_ssl, user_agent=ua)
+        self.falcon = GovernedIntel(intel, self.governor)
+        self.valid_report_types = ["csa", "csir", "csit", "csgt", "csdr", "csia", "csmr", "csta", "cswr"]
         self.log = logger
+        self.actor_cache = ActorDetailCache(self, logger)
 
-    def get_reports(self, start_time):
+    def get_reports(self, start_time, fields=None):
         """Get all the reports that were updated after a certain moment in time (UNIX).
 
         :param start_time: unix time of the oldest report you want to pull
+        :param fields: report fields to return ("__full__" or a list of field names), defaults to the basic set
         """
         reports = []
-        offset = 0
-        total = 0
-        first_run = True
+        for reports_page in self.iter_reports(start_time, fields):
+            reports.extend(reports_page)
 
-        while offset < total or first_run:
-            resp_json = self.falcon.query_report_entities(
-                sort="last_modified_date.asc",
-                filter=f'last_modified_date:>{start_time}',
-                limit=self.request_size_limit,
-                offset=offset
-                )
-            if "body" in resp_json:
-                resp_json = resp_json["body"]
-            #self.__check_metadata(resp_json)
+        return reports
 
-            total = resp_json.get('meta', {}).get('pagination', {}).get('total', 0)
-            offset += resp_json.get('meta', {}).get('pagination', {}).get('limit', 5000)
-            first_run = False
+    def iter_reports(self, start_time, fields=None):
+        """Yield pages of reports that were updated after a certain moment in time (UNIX).
 
-            reports.extend(resp_json.get('resources', []))
+        :param start_time: unix time of the oldest report you want to pull
+        :param fields: report fields to return ("__full__" or a list of field names), defaults to the basic set
+        """
+        params = {
+            "sort": "last_modified_date.asc",
+            "filter": f'last_modified_date:>{start_time}',
+            "limit": self.request_size_limit
+        }
+        if fields:
+            params["fields"] = fields
 
-        return reports
+        yield from self._iter_offset_pages(self.falcon.query_report_entities, params)
 
     def get_indicators(self, start_time, include_deleted):
         """Get all the indicators that were updated after a certain moment in time (UNIX).
@@ -107,28 +136,62 @@ class IntelAPIClient:
         :param start_time: unix time of the oldest actor you want to pull
         """
         actors = []
-        offset = 0
-        total = 0
-        first_run = True
+        for actors_page in self.iter_actors(start_time):
+            actors.extend(actors_page)
 
-        while offset < total or first_run:
-            resp_json = self.falcon.query_actor_entities(
-                sort="last_modified_date.asc",
-#                filter=f'last_modified_date:>{start_time}',  # Always retrieve all actors
-                limit=self.request_size_limit,
-                offset=offset
-                )
-            if "body" in resp_json:
-                resp_json = resp_json["body"]
+        return actors
 
-            total = resp_json.get('meta', {}).get('pagination', {}).get('total', 0)
-            offset += resp_json.get('meta', {}).get('pagination', {}).get('limit', 5000)
-            first_run = False
+    def iter_actors(self, start_time):
+        """Yield pages of actors that were updated after a certain moment in time (UNIX).
+
+        :param start_time: unix time of the oldest actor you want to pull
+        """
+        params = {
+            "sort": "last_modified_date.asc",
+#            "filter": f'last_modified_date:>{start_time}',  # Always retrieve all actors
+            "limit": self.request_size_limit
+        }
 
+        yield from self._iter_offset_pages(self.falcon.query_actor_entities, params)
 
-            actors.extend(resp_json.get('resources', []))
+    def _offset_page(self, query, params: dict, offset: int) -> dict:
+        resp_json = query(offset=offset, **params)
+        if "body" in resp_json:
+            resp_json = resp_json["body"]
 
-        return actors
+        return resp_json
+
+    def _iter_offset_pages(self, query, params: dict):
+        """Yield each page of results from an offset paginated endpoint, in order.
+
+        Once the first response provides the total number of results, the remaining
+        offsets are retrieved concurrently by a bounded worker pool.
+
+        :param query: FalconPy method to call
+        :param params: query parameters (excluding offset)
+        """
+        resp_json = self._offset_page(query, params, 0)
+        #self.__check_metadata(resp_json)
+        total = resp_json.get('meta', {}).get('pagination', {}).get('total', 0)
+        limit = resp_json.get('meta', {}).get('pagination', {}).get('limit', 5000)
+        if resp_json.get('resources', []):
+            yield resp_json.get('resources', [])
+
+        offsets = list(range(limit, total, limit)) if limit else []
+        if offsets:
+            with ThreadPoolExecutor(self.request_concurrency, thread_name_prefix="page") as executor:
+                pending = deque()
+                for offset in offsets:
+                    pending.append(executor.submit(self._offset_page, query, params, offset))
+                    # Keep a bounded number of pages in flight and hand them back in offset order
+                    if len(pending) >= self.request_concurrency:
+                        page = pending.popleft().result().get('resources', [])
+                        if page:
+                            yield page
+                while pending:
+                    page = pending.popleft().result().get('resources', [])
+                    if page:
+                        yield page
 
     def get_actor_name_list(self):
         """Get all the actors names and IDs in an easy to search list."""
@@ -145,4 +208,96 @@ class IntelAPIClient:
     def __check_metadata(resp_json):
         if (resp_json.get('meta', {}).get('pagination', {}).get('total') is None) \
                 or (resp_json.get('meta', {}).get('pagination', {}).get('limit') is None):
-            raise Exception(f'Unable to decode pagination metadata from response. Response is {resp_json}.')
\ No newline at end of file
+            raise Exception(f'Unable to decode pagination metadata from response. Response is {resp_json}.')
+
+
+class ActorDetailCache:
+    """Run-wide cache of adversary details retrieved from the CrowdStrike Intel API.
+
+    The cache is pre-populated with batched lookups, and concurrent misses for the same
+    adversary ID are coalesced into a single in-flight request. Only successful lookups are
+    cached, a failed lookup is retried the next time the adversary is requested.
+    """
+
+    BATCH_SIZE = 500
+
+    def __init__(self, intel_api_client: IntelAPIClient, logger: logging.Logger = None):
+        """Construct an instance of the ActorDetailCache class.
+
+        :param intel_api_client: client for the CrowdStrike Intel API
+        :param logger: logging object
+        """
+        self.intel_api_client = intel_api_client
+        self.log = logger
+        self.details = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def prefetch(self, actor_ids):
+        """Retrieve the details for every uncached adversary ID using batched requests.
+
+        :param actor_ids: adversary IDs to retrieve
+        """
+        with self.lock:
+            missing = list({str(a) for a in actor_ids if a is not None and str(a) not in self.details})
+        cached = 0
+        for pos in range(0, len(missing), self.BATCH_SIZE):
+            found = self._lookup(missing[pos:pos+self.BATCH_SIZE])
+            if found is None:
+                continue
+            with self.lock:
+                self.details.update(found)
+            cached += len(found)
+        if cached and self.log:
+            self.log.info("Cached details for %i adversaries.", cached)
+
+    def clear(self):
+        """Discard every cached adversary, so the details are retrieved again when next requested."""
+        with self.lock:
+            self.details = {}
+
+    def get(self, actor_id) -> dict:
+        """Return the details for an adversary, retrieving them if they are not already cached.
+
+        :param actor_id: adversary ID
+        """
+        actor_id = str(actor_id)
+        with self.lock:
+            if actor_id in self.details:
+                return self.details[actor_id]
+            pending = self.in_flight.get(actor_id)
+            if pending is None:
+                pending = self.in_flight[actor_id] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            with span("intel.actor_detail.wait", **{"crowdstrike.actor.id": actor_id}):
+                return pending.result()
+
+        try:
+            with span("intel.actor_detail", **{"crowdstrike.actor.id": actor_id}):
+                found = self._lookup([actor_id])
+        except Exception as err:
+            with self.lock:
+                self.in_flight.pop(actor_id, None)
+            pending.set_exception(err)
+            raise
+        detail = {} if found is None else found.get(actor_id, {})
+        with self.lock:
+            if found is not None:
+                self.details[actor_id] = detail
+            self.in_flight.pop(actor_id, None)
+        pending.set_result(detail)
+
+        return detail
+
+    def _lookup(self, actor_ids: list) -> dict:
+        """Return the details found for the adversary IDs, or None if the request failed."""
+        resp = self.intel_api_client.falcon.get_actor_entities(ids=actor_ids)
+        if resp.get("status_code") != 200:
+            if self.log:
+                self.log.warning("Unable to retrieve adversary details (%s).", resp.get("status_code"))
+            return None
+
+        return {str(detail.get("id")): detail for detail in resp["body"].get("resources", [])}
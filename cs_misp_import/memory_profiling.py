@@ -0,0 +1,247 @@
+"""Per-stage memory profiling.
+
+Each importer marks its stage boundaries (a page fetched from the Intel API, related detail
+retrieved, events pushed to MISP and the stream finished) with a memory snapshot. Snapshots
+do nothing until a MemoryProfiler is installed (misp_import.py --memory_profile), so they
+cost a single check on a normal run.
+
+At every boundary the profiler records the resident set size, the Python allocations traced by
+tracemalloc and the number of records the stream is holding (reports, details, related
+indicators, events). The largest tracemalloc snapshot taken for each stream is compared to the
+snapshot taken when profiling started to find the sites that allocated the memory.
+
+Streams run concurrently and share the process, so the resident and traced sizes recorded at a
+boundary include the memory held by any other stream running at the time.
+"""
+import collections
+import gc
+import json
+import logging
+import os
+import platform
+import threading
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Memory profiler installed for this run, None when memory profiling is disabled
+_MEMORY_PROFILER = None
+# Live objects counted at each boundary
+LIVE_TYPES = ("MISPEvent", "MISPAttribute", "MISPObject", "MISPObjectAttribute", "MISPTag", "MISPGalaxyCluster")
+# Allocations made by the profiler itself or while importing modules are not reported
+IGNORED_SITES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>")
+)
+
+
+def current_rss() -> int:
+    """Return the current resident set size in bytes, or the lifetime maximum if unavailable."""
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource is None:
+        return 0
+    # Linux reports kilobytes, macOS reports bytes
+    scale = 1 if platform.system() == "Darwin" else 1024
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _megabytes(size: int) -> float:
+    return round(size / 1048576, 2)
+
+
+class MemoryProfiler:
+    """Record memory use at the stage boundaries of each import stream.
+
+    :param frames: number of frames tracemalloc keeps for each allocation
+    :param top: number of allocation sites reported for each stream
+    :param output_dir: directory the memory profile is written to (optional)
+    :param logger: logging object
+    """
+
+    # Seconds between resident set size samples
+    INTERVAL = 0.05
+
+    def __init__(self, frames: int = 1, top: int = 15, output_dir: str = None, logger: logging.Logger = None):
+        """Construct an instance of the MemoryProfiler class."""
+        self.frames = max(1, int(frames))
+        self.top = max(1, int(top))
+        self.output_dir = output_dir
+        self.log = logger
+        self.boundaries = {}
+        self.snapshots = {}
+        self.baseline = None
+        self.owns_tracing = False
+        self.start_rss = current_rss()
+        self.peak_rss = self.start_rss
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, name="memory-profiler", daemon=True)
+
+    def start(self):
+        """Start tracing allocations and sampling the resident set size."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.owns_tracing = True
+        self.baseline = tracemalloc.take_snapshot().filter_traces(IGNORED_SITES)
+        self.started = time.perf_counter()
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        """Stop sampling, and stop tracing allocations if this profiler started it."""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.owns_tracing:
+            tracemalloc.stop()
+            self.owns_tracing = False
+
+    def _sample(self):
+        while not self.stopped.wait(self.INTERVAL):
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    @staticmethod
+    def live_objects() -> dict:
+        """Return the number of live MISP objects by type."""
+        counted = collections.Counter(
+            type(obj).__name__ for obj in gc.get_objects() if type(obj).__name__ in LIVE_TYPES
+            )
+
+        return dict(sorted(counted.items()))
+
+    def snapshot(self, stream: str, stage: str, objects: dict):
+        """Record memory use as a stream reaches a stage boundary.
+
+        :param stream: import stream (reports, indicators or actors)
+        :param stage: stage boundary reached
+        :param objects: number of records the stream is holding, by kind
+        """
+        if not tracemalloc.is_tracing():
+            return
+        rss = current_rss()
+        traced, peak_traced = tracemalloc.get_traced_memory()
+        objects = dict(objects)
+        objects.update(self.live_objects())
+        with self.lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            boundary = self.boundaries.setdefault((stream, stage), {
+                "samples": 0, "max_traced": 0, "max_rss": 0, "objects": {}, "last_objects": {}
+            })
+            boundary["samples"] += 1
+            boundary["max_traced"] = max(boundary["max_traced"], traced)
+            boundary["max_rss"] = max(boundary["max_rss"], rss)
+            boundary["peak_traced"] = peak_traced
+            boundary["last_objects"] = objects
+            for kind, count in objects.items():
+                boundary["objects"][kind] = max(boundary["objects"].get(kind, 0), count)
+            # Only the largest snapshot of each stream is kept, it is where the allocation sites matter
+            largest = self.snapshots.get(stream)
+            keep = largest is None or traced > largest[0]
+        if keep:
+            taken = tracemalloc.take_snapshot().filter_traces(IGNORED_SITES)
+            with self.lock:
+                if stream not in self.snapshots or traced > self.snapshots[stream][0]:
+                    self.snapshots[stream] = (traced, stage, taken)
+
+    def allocation_sites(self, stream: str) -> list:
+        """Return the sites that grew the most between the start of profiling and the largest snapshot of a stream."""
+        with self.lock:
+            largest = self.snapshots.get(stream)
+        if largest is None:
+            return []
+        statistics = largest[2].compare_to(self.baseline, "lineno") if self.baseline else largest[2].statistics("lineno")
+        returned = []
+        for stat in statistics[:self.top]:
+            frame = stat.traceback[0]
+            returned.append({
+                "site": f"{frame.filename}:{frame.lineno}",
+                "size_kb": round(getattr(stat, "size_diff", stat.size) / 1024, 1),
+                "count": getattr(stat, "count_diff", stat.count)
+            })
+
+        return returned
+
+    def summary(self) -> dict:
+        """Return the peak memory of the run and the memory use recorded at each stream's stage boundaries."""
+        traced, peak_traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        with self.lock:
+            self.peak_rss = max(self.peak_rss, current_rss())
+            boundaries = dict(self.boundaries)
+            largest = {stream: stage for stream, (_, stage, _) in self.snapshots.items()}
+        streams = {}
+        for (stream, stage), boundary in boundaries.items():
+            streams.setdefault(stream, {"stages": {}})["stages"][stage] = {
+                "samples": boundary["samples"],
+                "max_traced_mb": _megabytes(boundary["max_traced"]),
+                "max_rss_mb": _megabytes(boundary["max_rss"]),
+                "max_objects": dict(sorted(boundary["objects"].items())),
+                "last_objects": boundary["last_objects"]
+            }
+        for stream, measured in streams.items():
+            measured["largest_stage"] = largest.get(stream)
+            measured["top_allocations"] = self.allocation_sites(stream)
+
+        return {
+            "elapsed_s": round(time.perf_counter() - self.started, 4),
+            "start_rss_mb": _megabytes(self.start_rss),
+            "peak_rss_mb": _megabytes(self.peak_rss),
+            "traced_mb": _megabytes(traced),
+            "peak_traced_mb": _megabytes(peak_traced),
+            "streams": dict(sorted(streams.items()))
+        }
+
+    def report(self):
+        """Log the memory profile, writing it to the output directory."""
+        summary = self.summary()
+        if self.log:
+            self.log.info("Memory profile (peak RSS %.1f MB from %.1f MB, peak traced allocations %.1f MB):",
+                          summary["peak_rss_mb"], summary["start_rss_mb"], summary["peak_traced_mb"]
+                          )
+            for stream, measured in summary["streams"].items():
+                self.log.info("  %-30s %8s %12s %10s  %s", stream, "samples", "traced MB", "RSS MB", "max objects")
+                for stage, boundary in measured["stages"].items():
+                    self.log.info("    %-28s %8i %12.1f %10.1f  %s", stage, boundary["samples"],
+                                  boundary["max_traced_mb"], boundary["max_rss_mb"],
+                                  ", ".join(f"{kind} {count}" for kind, count in boundary["max_objects"].items())
+                                  )
+                if measured["top_allocations"]:
+                    self.log.info("    Top allocation sites at the %s boundary:", measured["largest_stage"])
+                    for site in measured["top_allocations"]:
+                        self.log.info("      %10.1f KB %8i blocks  %s", site["size_kb"], site["count"], site["site"])
+        if not self.output_dir:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, "memory_profile.json"), "w", encoding="utf-8") as summary_file:
+            json.dump(summary, summary_file, indent=2)
+        if self.log:
+            self.log.info("Memory profile written to %s.", self.output_dir)
+
+
+def install_memory_profiler(profiler: MemoryProfiler):
+    """Install the profiler used by every memory snapshot, or remove it when None."""
+    global _MEMORY_PROFILER  # pylint: disable=W0603
+    _MEMORY_PROFILER = profiler
+
+
+def memory_snapshot(stream: str, stage: str, **objects):
+    """Record memory use as a stream reaches a stage boundary, when memory profiling is enabled.
+
+    :param stream: import stream (reports, indicators or actors)
+    :param stage: stage boundary reached
+    :param objects: number of records the stream is holding, by kind
+    """
+    if _MEMORY_PROFILER is None:
+        return
+    _MEMORY_PROFILER.snapshot(stream, stage, objects)
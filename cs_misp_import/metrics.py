@@ -0,0 +1,430 @@
+"""Prometheus compatible run metrics.
+
+Counters, gauges and histograms are kept in a process wide registry and updated as the import
+runs. MetricsExporter publishes the registry in the Prometheus text exposition format, either
+as a file for the node_exporter textfile collector, from a local HTTP endpoint, or both.
+Every metric is safe to update from any thread.
+"""
+import http.server
+import logging
+import os
+import threading
+import time
+from ._version import __version__ as VERSION
+
+# Default histogram buckets (seconds), covering fast local requests through to slow MISP writes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class for a named metric with optional labels."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        """Construct a metric.
+
+        :param name: metric name
+        :param documentation: help text
+        :param labelnames: names of the labels identifying each series
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def labels(self, **labels):
+        """Return the series for the provided label values."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            child = self.series.get(key)
+            if child is None:
+                child = self.series[key] = self._child()
+
+        return child
+
+    def _default(self):
+        # Metrics without labels have a single series
+        return self.labels()
+
+    def _child(self):
+        raise NotImplementedError
+
+    def _label_text(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def collect(self) -> list:
+        """Return the exposition lines for this metric."""
+        with self.lock:
+            series = sorted(self.series.items())
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in series:
+            lines.extend(self._sample_lines(key, child))
+
+        return lines
+
+    def _sample_lines(self, key: tuple, child) -> list:
+        return [f"{self.name}{self._label_text(key)} {_format_value(child.get())}"]
+
+
+class _Value:
+    """Single thread safe numeric value."""
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        """Increase the value."""
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        """Decrease the value."""
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        """Replace the value."""
+        with self.lock:
+            self.value = float(value)
+
+    def set_function(self, function):
+        """Calculate the value when it is collected instead of storing it."""
+        self.function = function
+
+    def get(self) -> float:
+        """Return the current value."""
+        if self.function is not None:
+            return float(self.function())
+        with self.lock:
+            return self.value
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    def _child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        """Increase the count of the unlabelled series."""
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def _child(self):
+        return _Value()
+
+    def set(self, value: float):
+        """Set the value of the unlabelled series."""
+        self._default().set(value)
+
+    def inc(self, amount: float = 1):
+        """Increase the value of the unlabelled series."""
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1):
+        """Decrease the value of the unlabelled series."""
+        self._default().dec(amount)
+
+
+class _Buckets:
+    """Thread safe histogram observations."""
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        """Record a single observation."""
+        with self.lock:
+            self.sum += value
+            for pos, bound in enumerate(self.bounds):
+                if value <= bound:
+                    self.counts[pos] += 1
+                    break
+            else:
+                self.counts[-1] += 1
+
+    def snapshot(self):
+        """Return the cumulative bucket counts and the sum of the observations."""
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+
+        return cumulative, total
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, such as request latencies."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        """Construct a histogram.
+
+        :param name: metric name
+        :param documentation: help text
+        :param labelnames: names of the labels identifying each series
+        :param buckets: upper bounds of the buckets
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float):
+        """Record an observation in the unlabelled series."""
+        self._default().observe(value)
+
+    def _sample_lines(self, key: tuple, child) -> list:
+        cumulative, total = child.snapshot()
+        lines = []
+        for bound, count in zip(list(self.buckets) + [float("inf")], cumulative):
+            lines.append(f"{self.name}_bucket{self._label_text(key, {'le': _format_value(bound)})} {count}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {cumulative[-1]}")
+
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        """Construct an empty registry."""
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a metric to the registry and return it."""
+        with self.lock:
+            self.metrics.append(metric)
+
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        """Create and register a counter."""
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        """Create and register a gauge."""
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        """Create and register a histogram."""
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+INFO = REGISTRY.gauge("misp_import_info", "CrowdStrike MISP import version.", ("version",))
+RECORDS_FETCHED = REGISTRY.counter("misp_import_records_fetched_total",
+                                   "Records retrieved from the CrowdStrike Intel API.", ("stream",)
+                                   )
+RECORDS_SKIPPED = REGISTRY.counter("misp_import_records_skipped_total",
+                                   "Records already present in MISP and unchanged.", ("stream",)
+                                   )
+EVENTS_BUILT = REGISTRY.counter("misp_import_events_built_total",
+                                "MISP events (or grouped indicator attributes) built.", ("stream",)
+                                )
+EVENTS_PUSHED = REGISTRY.counter("misp_import_events_pushed_total",
+                                 "MISP events (or grouped indicators) written to MISP, by result.", ("stream", "result")
+                                 )
+MISP_REQUEST_SECONDS = REGISTRY.histogram("misp_import_misp_request_duration_seconds",
+                                          "MISP request latency.", ("method",)
+                                          )
+MISP_ERRORS = REGISTRY.counter("misp_import_misp_request_errors_total",
+                               "MISP requests returning an error, by HTTP status.", ("method", "status")
+                               )
+MISP_RETRIES = REGISTRY.counter("misp_import_misp_retries_total", "MISP requests retried after an error.", ("method",))
+MISP_IN_FLIGHT = REGISTRY.gauge("misp_import_misp_requests_in_flight", "MISP requests currently in flight.")
+MISP_CONCURRENCY = REGISTRY.gauge("misp_import_misp_concurrency_limit",
+                                  "MISP requests allowed in flight by the adaptive limiter."
+                                  )
+INTEL_REQUESTS = REGISTRY.counter("misp_import_intel_requests_total",
+                                  "CrowdStrike Intel API requests, by HTTP status.", ("method", "status")
+                                  )
+INTEL_REQUEST_SECONDS = REGISTRY.histogram("misp_import_intel_request_duration_seconds",
+                                           "CrowdStrike Intel API request latency.", ("method",)
+                                           )
+INTEL_THROTTLED = REGISTRY.counter("misp_import_intel_throttled_total",
+                                   "CrowdStrike Intel API requests rejected with a 429 (rate limited)."
+                                   )
+QUEUE_DEPTH = REGISTRY.gauge("misp_import_queue_depth", "Work waiting in each import queue.", ("stream", "queue"))
+CHECKPOINT_POSITION = REGISTRY.gauge("misp_import_checkpoint_position_timestamp_seconds",
+                                     "Import position (high-water mark) of each stream.", ("stream",)
+                                     )
+CHECKPOINT_LAG = REGISTRY.gauge("misp_import_checkpoint_lag_seconds",
+                                "Seconds between now and the import position of each stream.", ("stream",)
+                                )
+CHECKPOINT_PENDING = REGISTRY.gauge("misp_import_checkpoint_pending_pages",
+                                    "Pages of work started but not yet confirmed for each stream.", ("stream",)
+                                    )
+LAST_SUCCESS = REGISTRY.gauge("misp_import_last_success_timestamp_seconds",
+                              "Time each stream last completed an import without error.", ("stream",)
+                              )
+DELETED_EVENTS = REGISTRY.counter("misp_import_deleted_events_total", "Events deleted from MISP.")
+DELETED_TAGS = REGISTRY.counter("misp_import_deleted_tags_total", "Tags deleted from MISP.")
+
+INFO.labels(version=VERSION).set(1)
+
+
+def track_checkpoint(stream: str, position):
+    """Record the import position of a stream, its lag is calculated whenever the metrics are collected."""
+    if position is None:
+        return
+    CHECKPOINT_POSITION.labels(stream=stream).set(position)
+    CHECKPOINT_LAG.labels(stream=stream).set_function(lambda: max(0.0, time.time() - float(position)))
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the registry from /metrics."""
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Return the metrics."""
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        payload = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        """Silence the per-request access log."""
+
+
+class MetricsExporter:
+    """Publish the metrics registry to a textfile collector file and / or a local HTTP endpoint.
+
+    :param textfile: file rewritten with the current metrics every interval and when stopped (optional)
+    :param port: port to serve /metrics on (optional)
+    :param address: address the HTTP endpoint listens on
+    :param interval: seconds between textfile updates
+    :param registry: registry to publish, defaults to the process wide registry
+    :param logger: logging object
+    """
+
+    def __init__(self,
+                 textfile: str = None,
+                 port: int = None,
+                 address: str = "127.0.0.1",
+                 interval: float = 15,
+                 registry: MetricsRegistry = None,
+                 logger: logging.Logger = None
+                 ):
+        """Construct an instance of the MetricsExporter class."""
+        self.textfile = textfile
+        self.port = port
+        self.address = address
+        self.interval = max(1.0, float(interval))
+        self.registry = registry or REGISTRY
+        self.log = logger
+        self.server = None
+        self.threads = []
+        self.stopped = threading.Event()
+
+    def start(self):
+        """Start serving and / or writing the metrics."""
+        if self.port:
+            self.server = http.server.ThreadingHTTPServer((self.address, int(self.port)), _MetricsHandler)
+            self.server.daemon_threads = True
+            self.server.registry = self.registry
+            self.threads.append(threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True))
+            if self.log:
+                self.log.info("Serving metrics on http://%s:%i/metrics", self.address, self.server.server_address[1])
+        if self.textfile:
+            self.threads.append(threading.Thread(target=self._write_periodically, name="metrics-file", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+        return self
+
+    def write(self):
+        """Atomically replace the textfile with the current metrics."""
+        directory = os.path.dirname(os.path.abspath(self.textfile))
+        os.makedirs(directory, exist_ok=True)
+        # The textfile collector ignores files without the .prom extension, so partial writes are never read
+        temporary = f"{self.textfile}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(self.registry.render())
+        os.replace(temporary, self.textfile)
+
+    def _write_periodically(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as err:
+                if self.log:
+                    self.log.warning("Unable to write metrics to %s.\n%s", self.textfile, str(err))
+
+    def stop(self):
+        """Write the final metrics and stop serving them."""
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.textfile:
+            try:
+                self.write()
+            except OSError as err:
+                if self.log:
+                    self.log.warning("Unable to write metrics to %s.\n%s", self.textfile, str(err))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
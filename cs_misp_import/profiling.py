@@ -0,0 +1,168 @@
+"""Per-stage run profiling.
+
+Stages of the import (Intel API paging, detail lookups, event construction, MISP requests and
+checkpointing) are wrapped in named timers. Timers do nothing until a StageProfiler is
+installed (misp_import.py --profile), so they cost a single check on a normal run.
+
+Stage names are grouped by their prefix:
+    fetch.*       paginated Intel API queries
+    detail.*      Intel API detail lookups (adversaries, related indicators)
+    build.*       MISP event construction
+    push.*        MISP requests, including PyMISP serialization and waiting on the server
+    checkpoint.*  import position and index bookkeeping
+
+Timings are inclusive, a stage running inside another (an adversary lookup that misses the cache
+while a report event is built) is counted in both. Stages run concurrently on the worker threads,
+so stage totals can exceed the elapsed time of the run.
+"""
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+
+# Profiler installed for this run, None when profiling is disabled
+_PROFILER = None
+
+
+class StageTimer:
+    """Call count and latency totals for a single stage."""
+
+    __slots__ = ["calls", "total", "maximum"]
+
+    def __init__(self):
+        """Construct an empty timer."""
+        self.calls = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds: float):
+        """Add a single call latency."""
+        self.calls += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+
+class StageProfiler:
+    """Collect named stage timers, and optionally cProfile statistics, for an import run.
+
+    :param capture: capture cProfile statistics for each stage
+    :param output_dir: directory the summary and captured statistics are written to (optional)
+    :param logger: logging object
+    """
+
+    def __init__(self, capture: bool = False, output_dir: str = None, logger: logging.Logger = None):
+        """Construct an instance of the StageProfiler class."""
+        self.capture = capture
+        self.output_dir = output_dir
+        self.log = logger
+        self.timers = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as the named stage."""
+        profile = None
+        # Only the outermost stage on a thread is profiled, nested stages appear within it
+        if self.capture and not getattr(self.local, "profiling", False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self.local.profiling = True
+            except ValueError:
+                # Another profiler is active (Python 3.12+ allows one per process), time the stage only
+                profile = None
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if profile is not None:
+                profile.disable()
+                self.local.profiling = False
+            with self.lock:
+                self.timers.setdefault(name, StageTimer()).add(elapsed)
+                if profile is not None:
+                    if name in self.stats:
+                        self.stats[name].add(profile)
+                    else:
+                        self.stats[name] = pstats.Stats(profile)
+
+    def summary(self) -> dict:
+        """Return the elapsed time of the run and the call count, total, mean and maximum latency of each stage."""
+        with self.lock:
+            timers = dict(self.timers)
+
+        return {
+            "elapsed_s": round(time.perf_counter() - self.started, 4),
+            "stages": {
+                name: {
+                    "calls": timer.calls,
+                    "total_s": round(timer.total, 4),
+                    "mean_ms": round(timer.total / timer.calls * 1000, 3),
+                    "max_ms": round(timer.maximum * 1000, 3)
+                } for name, timer in sorted(timers.items())
+            }
+        }
+
+    def report(self):
+        """Log the stage summary, writing it and any captured statistics to the output directory."""
+        summary = self.summary()
+        if self.log:
+            self.log.info("Run profile (%.2f seconds elapsed, stage timings are inclusive and summed across threads):",
+                          summary["elapsed_s"]
+                          )
+            self.log.info("  %-40s %8s %10s %10s %10s", "stage", "calls", "total s", "mean ms", "max ms")
+            for name, timer in sorted(summary["stages"].items(), key=lambda item: item[1]["total_s"], reverse=True):
+                self.log.info("  %-40s %8i %10.3f %10.2f %10.2f", name, timer["calls"], timer["total_s"],
+                              timer["mean_ms"], timer["max_ms"]
+                              )
+        if not self.output_dir:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, "profile_summary.json"), "w", encoding="utf-8") as summary_file:
+            json.dump(summary, summary_file, indent=2)
+        with self.lock:
+            captured = dict(self.stats)
+        for name, stats in captured.items():
+            stats.dump_stats(os.path.join(self.output_dir, f"{name}.pstats"))
+        if self.log:
+            self.log.info("Profile summary%s written to %s.", " and per-stage statistics" if captured else "",
+                          self.output_dir
+                          )
+
+
+def install_profiler(profiler: StageProfiler):
+    """Install the profiler used by every stage timer, or remove it when None."""
+    global _PROFILER  # pylint: disable=W0603
+    _PROFILER = profiler
+
+
+def stage(name: str):
+    """Return a context manager timing the enclosed block as the named stage, when profiling is enabled."""
+    if _PROFILER is None:
+        return contextlib.nullcontext()
+
+    return _PROFILER.stage(name)
+
+
+def profiled(name: str):
+    """Decorate a function or method so each call is timed as the named stage, when profiling is enabled."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _PROFILER is None:
+                return func(*args, **kwargs)
+            with _PROFILER.stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
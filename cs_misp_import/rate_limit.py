@@ -0,0 +1,136 @@
+"""Rate limit handling for the CrowdStrike Falcon Intel API.
+
+Every Intel API request is routed through a single token bucket governor. The bucket
+refill rate tracks the tenant limit reported in the X-RateLimit-Limit header, the bucket
+is drained to match X-RateLimit-Remaining, and 429 responses pause all requests until
+the time provided by the Retry-After (or X-RateLimit-RetryAfter) header.
+"""
+import logging
+import threading
+import time
+from .profiling import stage
+from .metrics import INTEL_REQUESTS, INTEL_REQUEST_SECONDS, INTEL_THROTTLED
+from .tracing import CLIENT, span
+
+
+class RateLimitGovernor:
+    """Token bucket shared by every CrowdStrike Intel API request."""
+
+    # Fraction of the tenant limit to consume, keeps throughput just below the limit
+    HEADROOM = 0.9
+    # Requests held back from the remaining count reported by the API
+    RESERVE = 5
+
+    def __init__(self, rate: float = 10.0, burst: int = 10, max_retries: int = 5, logger: logging.Logger = None):
+        """Construct an instance of the RateLimitGovernor class.
+
+        :param rate: initial requests per second, replaced once the API reports the tenant limit
+        :param burst: maximum number of requests that may be sent back to back
+        :param max_retries: number of times a rate limited request is retried
+        :param logger: logging object
+        """
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.max_retries = max_retries
+        self.log = logger
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(min(wait, 5))
+
+    def update(self, headers: dict):
+        """Adjust the bucket to match the rate limit headers returned by the API."""
+        headers = {str(k).lower(): v for k, v in (headers or {}).items()}
+        with self.lock:
+            try:
+                limit = int(headers["x-ratelimit-limit"])
+                # The tenant limit is expressed in requests per minute
+                self.rate = max(1.0, limit / 60 * self.HEADROOM)
+            except (KeyError, ValueError):
+                pass
+            try:
+                remaining = int(headers["x-ratelimit-remaining"])
+                self.tokens = min(self.tokens, float(max(0, remaining - self.RESERVE)))
+            except (KeyError, ValueError):
+                pass
+
+    def backoff(self, headers: dict, attempt: int):
+        """Pause every request after a 429 response."""
+        headers = {str(k).lower(): v for k, v in (headers or {}).items()}
+        delay = 2 ** attempt
+        try:
+            if "retry-after" in headers:
+                delay = float(headers["retry-after"])
+            elif "x-ratelimit-retryafter" in headers:
+                # Provided as an epoch timestamp
+                delay = float(headers["x-ratelimit-retryafter"]) - time.time()
+        except ValueError:
+            pass
+        delay = max(delay, 1.0)
+        INTEL_THROTTLED.inc()
+        with self.lock:
+            self.throttled += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.tokens = 0.0
+        if self.log:
+            self.log.warning("CrowdStrike API rate limit reached, pausing requests for %.1f seconds.", delay)
+
+
+class GovernedIntel:
+    """Wrap a FalconPy service class so every API call is paced by a RateLimitGovernor."""
+
+    def __init__(self, service, governor: RateLimitGovernor):
+        """Construct an instance of the GovernedIntel class.
+
+        :param service: FalconPy service class (Intel)
+        :param governor: shared rate limit governor
+        """
+        self.service = service
+        self.governor = governor
+
+    def __getattr__(self, name):
+        attr = getattr(self.service, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        # Entity lookups by ID are detail requests, everything else pages through query results
+        stage_name = f"{'detail' if name.startswith('get_') else 'fetch'}.{name}"
+
+        def governed(*args, **kwargs):
+            with stage(stage_name), span(f"intel.{name}", CLIENT) as request_span:
+                if isinstance(kwargs.get("ids"), list):
+                    request_span.set_attribute("crowdstrike.request.ids", len(kwargs["ids"]))
+                for attempt in range(self.governor.max_retries + 1):
+                    self.governor.acquire()
+                    started = time.monotonic()
+                    result = attr(*args, **kwargs)
+                    INTEL_REQUEST_SECONDS.labels(method=name).observe(time.monotonic() - started)
+                    if not isinstance(result, dict):
+                        return result
+                    INTEL_REQUESTS.labels(method=name, status=result.get("status_code")).inc()
+                    request_span.set_attribute("http.response.status_code", result.get("status_code"))
+                    request_span.set_attribute("crowdstrike.request.attempts", attempt + 1)
+                    self.governor.update(result.get("headers"))
+                    if result.get("status_code") != 429 or attempt == self.governor.max_retries:
+                        if not 200 <= (result.get("status_code") or 0) < 300:
+                            request_span.set_error(f"HTTP {result.get('status_code')}")
+                        return result
+                    self.governor.backoff(result.get("headers"), attempt)
+
+            return result
+
+        return governed
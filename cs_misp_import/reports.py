@@ -14,8 +14,6 @@
 
 import datetime
 from logging import Logger
-import os
-import time
 import concurrent.futures
 
 try:
@@ -27,9 +25,21 @@ except ImportError as no_pymisp:
 
 from .adversary import Adversary
 from .report_type import ReportType
-from .helper import confirm_boolean_param, gen_indicator, REPORTS_BANNER, display_banner
+from .checkpoint import CheckpointJournal
+from .scheduler import FairScheduler, push_executor
+from .profiling import profiled
+from .tracing import record_result, span, traced
+from .memory_profiling import memory_snapshot
+from .metrics import EVENTS_BUILT, EVENTS_PUSHED, RECORDS_FETCHED, RECORDS_SKIPPED
+from .helper import confirm_boolean_param, gen_indicators, REPORTS_BANNER, display_banner, stamp_uuids, content_hash
 from .intel_client import IntelAPIClient
 
+# Report fields used to build report events, retrieved as part of the paginated report query
+REPORT_FIELDS = [
+    "id", "name", "url", "short_description", "description", "attachments", "created_date",
+    "last_modified_date", "actors", "target_countries", "target_industries"
+]
+
 class ReportsImporter:
     """Tool used to import reports from the Crowdstrike Intel API and push them as events in MISP through the MISP API."""
 
@@ -40,7 +50,8 @@ class ReportsImporter:
                  reports_timestamp_filename: str,
                  settings: dict,
                  import_settings: dict,
-                 logger: Logger
+                 logger: Logger,
+                 scheduler: FairScheduler = None
                  ):
         """Construct and return an instance of the ReportsImporter class.
 
@@ -60,6 +71,8 @@ class ReportsImporter:
             Dictionary of import settings
         logger : logging.Logger
             Logging object
+        scheduler : FairScheduler
+            Shared MISP worker pool used when streams are imported concurrently (optional)
 
         Returns
         ----
@@ -68,57 +81,70 @@ class ReportsImporter:
         self.misp = misp_client
         self.intel_api_client = intel_api_client
         self.reports_timestamp_filename = reports_timestamp_filename
+        self.checkpoint = CheckpointJournal(reports_timestamp_filename, logger, "reports")
         self.settings = settings
         self.import_settings = import_settings
         self.crowdstrike_org = self.misp.get_organisation(crowdstrike_org_uuid, True)
         self.log = logger
+        self.scheduler = scheduler
         self.events_already_imported: dict = {}
         self.skipped = 0
+        self.updated = 0
         self.known_actors = []
 
-    def batch_report_detail(self, id_list: list or str) -> dict:
-        """Retrieve extended report details for the ID list provided.
-        
-        Arguments
-        ----
-        id_list : list or str
-            List of report IDs to retrieve from the CrowdStrike Falcon Intel API.
+    def batch_import_reports(self, report, rpt_detail, ind_list):
+        """Push a report into MISP.
 
-        Returns
-        ----
-        (dict) Dictionary containing API response.
+        Returns True when the report was imported or updated, None when it was already present
+        and unchanged, and False when it could not be written to MISP.
         """
-        return self.intel_api_client.falcon.get_report_entities(ids=id_list, fields="__full__")["body"]["resources"]
-
-    def batch_import_reports(self, report, rpt_detail, ind_list):
         report_name = report.get('name')
-        rpt_id = report_name.split(" ")[0].split("-")[1]
+        returned = None
         if report_name is not None:
-            if self.events_already_imported.get(rpt_id) is None:
-                event: MISPEvent = self.create_event_from_report(report, rpt_detail, ind_list)
-                if event is not None:
-                    try:
-                        #for tag in self.settings["CrowdStrike"]["reports_tags"].split(","):
-                        #    event.add_tag(tag)
-                        #for rtype in self.intel_api_client.valid_report_types:
-                        #    if rtype.upper() in report.get('name', None):
-                        #        event.add_tag(f"CrowdStrike:report: {rtype.upper()}")
-                        self.events_already_imported[report_name] = True
-                        event = self.misp.add_event(event, True)
-                        self.log.debug("%s report created.", report_name)
-                    except Exception as err:
-                        self.log.warning("Could not add or tag event %s.\n%s", event.info, str(err))
+            rpt_id = report_name.split(" ")[0]
+            with span("report", record=("report", rpt_id), **{"crowdstrike.report.name": report_name}) as record_span:
+                digest = content_hash(report, sorted(str(ind.get("id")) for ind in ind_list))
+                existing = self.events_already_imported.get(rpt_id)
+                if not self.events_already_imported.is_current(rpt_id, digest, report.get("last_modified_date")):
+                    returned = False
+                    event: MISPEvent = self.create_event_from_report(report, rpt_detail, ind_list)
+                    if event is not None:
+                        EVENTS_BUILT.labels(stream="reports").inc()
+                        try:
+                            #for tag in self.settings["CrowdStrike"]["reports_tags"].split(","):
+                            #    event.add_tag(tag)
+                            #for rtype in self.intel_api_client.valid_report_types:
+                            #    if rtype.upper() in report.get('name', None):
+                            #        event.add_tag(f"CrowdStrike:report: {rtype.upper()}")
+                            if existing is None:
+                                created = self.misp.upsert_event(event, True)
+                            else:
+                                # Only the attributes that changed are sent for reports already in MISP
+                                created = self.misp.update_event_delta(event, existing.get("event_id"), True)
+                            if isinstance(created, MISPEvent):
+                                self.events_already_imported.put(rpt_id, created.id, digest)
+                                returned = True
+                                if existing is not None:
+                                    self.updated += 1
+                                self.log.debug("%s report %s.", report_name, "created" if existing is None else "updated")
+                            elif self.misp.blocklisted(created):
+                                # Deliberately blocked in MISP, this is not retried
+                                self.log.info("Report %s is on the MISP event blocklist (%s), skipping.", report_name, event.uuid)
+                                record_span.set_attribute("crowdstrike.blocklisted", True)
+                                self.skipped += 1
+                                returned = None
+                            else:
+                                self.log.warning("Could not add event %s.\n%s", event.info, created)
+                        except Exception as err:
+                            self.log.warning("Could not add or tag event %s.\n%s", event.info, str(err))
+                    else:
+                        self.log.warning("Failed to create a MISP event for report %s.", report)
                 else:
-                    self.log.warning("Failed to create a MISP event for report %s.", report)
+                    self.log.debug("Event %s already created and unchanged, skipping.", report_name)
+                    self.skipped += 1
+                record_result(record_span, returned)
 
-                if report.get('last_modified_date') is None:
-                    self.log.warning("Failed to confirm report %s in file.", report)
-                else:
-                    if report.get('last_modified_date') > self.last_pos:
-                        self.last_pos = report.get("last_modified_date")
-            else:
-                self.log.debug("Event %s already created, skipping.", report_name)
-                self.skipped += 1
+        return returned
 
     def get_indicator_detail(self, id_list):
         def query_api(filter_str: str):
@@ -136,20 +162,13 @@ class ReportsImporter:
             if start_time:
                 marker_check = f"_marker:>='{start_time}'+"
             filters = f"{marker_check}reports:{id_list}"
+            # Rate limiting is handled by the Intel API client governor
             indicator_lookup = query_api(filters)
-            fcnt = 0
-            if not isinstance(indicator_lookup, bytes):
-                if indicator_lookup["status_code"] == 429:
-                    fcnt += 1
-                    if fcnt > 3:
-                        raise SystemExit("Too many API communication issues.")
-                    time.sleep(1*fcnt)
-                    indicator_lookup = query_api(filters)
-            else:
-                indicator_lookup = query_api(filters)
+            if isinstance(indicator_lookup, dict) and indicator_lookup.get("status_code") != 200:
+                self.log.warning("Unable to retrieve related indicators (%s).", indicator_lookup.get("status_code"))
 
             try:       
-                returned = indicator_lookup["body"].get("resources", {})
+                returned = indicator_lookup["body"].get("resources") or []
             
                 if returned:
                     yield returned
@@ -161,12 +180,38 @@ class ReportsImporter:
             except TypeError:
                 pass
 
+    @profiled("detail.related_indicators")
+    @traced("intel.related_indicators")
     def batch_related_indicators(self, ids):
         found = []
         for indicators_page in self.get_indicator_detail(id_list=ids):
             found.extend(indicators_page)
         return found
 
+    @staticmethod
+    def index_related_indicators(indicator_list: list) -> dict:
+        """Index related indicators by the report IDs they are associated with.
+
+        Arguments
+        ----
+        indicator_list : list
+            List of indicators retrieved from the CrowdStrike Falcon Intel API.
+
+        Returns
+        ----
+        (dict) Dictionary of indicator lists keyed by report ID.
+        """
+        indexed = {}
+        seen = set()
+        for ind in indicator_list:
+            for report_id in ind.get("reports") or []:
+                # Indicators related to reports in separate batches are returned more than once
+                if (report_id, ind.get("id")) not in seen:
+                    seen.add((report_id, ind.get("id")))
+                    indexed.setdefault(report_id, []).append(ind)
+
+        return indexed
+
     def process_reports(self, reports_days_before, events_already_imported):
         """Pull and process reports.
 
@@ -174,6 +219,8 @@ class ReportsImporter:
         :param events_already_imported: the events already imported in misp, to avoid duplicates
         """
         self.events_already_imported = events_already_imported
+        self.skipped = 0
+        self.updated = 0
         display_banner(banner=REPORTS_BANNER,
                        logger=self.log,
                        fallback="BEGIN REPORTS IMPORT",
@@ -183,81 +230,116 @@ class ReportsImporter:
         start_get_events = int((
             datetime.datetime.today() + datetime.timedelta(days=-int(min(reports_days_before, 366)))
         ).timestamp())
-        if not self.import_settings["force"]:
-            if os.path.isfile(self.reports_timestamp_filename):
-                with open(self.reports_timestamp_filename, 'r', encoding="utf-8") as ts_file:
-                    line = ts_file.readline()
-                    if line:
-                        start_get_events = int(line)
+        self.checkpoint.reload()
+        if not self.import_settings["force"] and self.checkpoint.position is not None:
+            start_get_events = self.checkpoint.position
 
         log_msg = f"Start importing CrowdString Threat Intelligence reports as events into MISP (past {reports_days_before} days)."
         self.log.info(log_msg)
         time_send_request = datetime.datetime.now()
-        reports = self.intel_api_client.get_reports(start_get_events)
-        log_msg = f"Got {str(len(reports))} new reports from the Crowdstrike Intel API."
-        self.log.info(log_msg)
+        reports_count = 0
+        # Reports are processed one page at a time so memory use stays flat during large backfills
+        for reports in self.intel_api_client.iter_reports(start_get_events, fields=REPORT_FIELDS):
+            self.log.info("Got %i new reports from the Crowdstrike Intel API.", len(reports))
+            RECORDS_FETCHED.labels(stream="reports").inc(len(reports))
+            self.process_report_window(reports)
+            reports_count += len(reports)
+
+        if reports_count == 0:
+            self.checkpoint.advance(time_send_request.timestamp())
+        self.checkpoint.close()
+        memory_snapshot("reports", "finished")
+
+        self.log.info("Finished importing %i (%i updated, %i skipped) Crowdstrike Threat Intelligence reports.",
+                      reports_count, self.updated, self.skipped
+                      )
+
+    def process_report_window(self, reports: list):
+        """Retrieve related detail for a window of reports and push them into MISP.
 
-        if len(reports) == 0:
-            with open(self.reports_timestamp_filename, 'w', encoding="utf-8") as ts_file:
-                ts_file.write(str(int(time_send_request.timestamp())))
-        else:
-            #adversary_events = self.misp.get_adversaries()
+        Arguments
+        ----
+        reports : list
+            List of report records retrieved from the CrowdStrike Falcon Intel API.
+        """
+        #adversary_events = self.misp.get_adversaries()
+        memory_snapshot("reports", "fetched", reports=len(reports))
+        if not self.known_actors:
             self.known_actors = self.intel_api_client.get_actor_name_list()
-            report_ids = [rep.get("name").split(" ")[0] for rep in reports]
-            rep_batches = [report_ids[i:i+500] for i in range(0, len(report_ids), 500)]
-            # Batched retrieval of extended report details
-            details = []
-            with concurrent.futures.ThreadPoolExecutor(self.misp.thread_count, thread_name_prefix="thread") as executor:
-                futures = {
-                    executor.submit(self.batch_report_detail, rep) for rep in rep_batches
-                }
-                for fut in concurrent.futures.as_completed(futures):
-                    details.extend(fut.result())
-
-            self.log.info(f"Retrieved extended report details for {len(details)} reports")
-
-            # Batched retrieval of related indicator details
-            indicator_list = []
-            batches = [report_ids[i:i+200] for i in range(0, len(report_ids), 200)]
-            with concurrent.futures.ThreadPoolExecutor(self.misp.thread_count, thread_name_prefix="thread") as executor:
-                futures = {
-                    executor.submit(self.batch_related_indicators, bat) for bat in batches
-                }
-                for fut in concurrent.futures.as_completed(futures):
-                    indicator_list.extend(fut.result())
-
-            self.log.info(f"{len(indicator_list)} related indicators found")
-            self.last_pos = reports[-1].get('last_modified_date', '')
-
-            # Threaded insert of report events into MISP instance
-            reported = []
-            with concurrent.futures.ThreadPoolExecutor(self.misp.thread_count, thread_name_prefix="thread") as executor:
-                futures = {
-                    executor.submit(self.batch_import_reports, rp, details, indicator_list) for rp in reports
-                }
-                for fut in concurrent.futures.as_completed(futures):
-                    reported.append(fut.done())
-
-                with open(self.reports_timestamp_filename, 'w', encoding="utf-8") as ts_file:
-                    ts_file.write(str(int(self.last_pos)))
-
+        # Retrieve every referenced adversary up front so event creation never waits on the API
+        self.intel_api_client.actor_cache.prefetch(
+            [act.get("id") for rep in reports for act in self.report_actors(rep)]
+            )
+        report_ids = [rep.get("name").split(" ")[0] for rep in reports]
+
+        # Batched retrieval of related indicator details
+        indicator_list = []
+        batches = [report_ids[i:i+200] for i in range(0, len(report_ids), 200)]
+        with concurrent.futures.ThreadPoolExecutor(self.misp.thread_count, thread_name_prefix="thread") as executor:
+            futures = {
+                executor.submit(self.batch_related_indicators, bat) for bat in batches
+            }
+            for fut in concurrent.futures.as_completed(futures):
+                indicator_list.extend(fut.result())
+
+        self.log.info(f"{len(indicator_list)} related indicators found")
+        RECORDS_FETCHED.labels(stream="related_indicators").inc(len(indicator_list))
+        memory_snapshot("reports", "related_indicators", reports=len(reports), related_indicators=len(indicator_list))
+
+        # Index the related indicators once so each event lookup is constant time
+        indicators_by_report = self.index_related_indicators(indicator_list)
+        del indicator_list
+
+        modified = [rp.get("last_modified_date") for rp in reports if rp.get("last_modified_date") is not None]
+        if len(modified) < len(reports):
+            self.log.warning("%i reports are missing a last modified date.", len(reports) - len(modified))
+        page = self.checkpoint.begin(max(modified) if modified else self.checkpoint.position or 0)
+
+        # Threaded insert of report events into MISP instance
+        failed = []
+        with push_executor(self.scheduler, "reports", self.misp.thread_count) as executor:
+            futures = {
+                executor.submit(self.batch_import_reports,
+                                rp,
+                                rp,  # Extended details are retrieved with the report
+                                indicators_by_report.get(rp.get("name", "").split(" ")[0], [])
+                                ): rp for rp in reports
+            }
+            for fut in concurrent.futures.as_completed(futures):
+                try:
+                    result = fut.result()
+                except Exception as err:  # pylint: disable=broad-except
+                    self.log.warning("Could not import report %s.\n%s", futures[fut].get("name"), str(err))
+                    result = False
+                if result is False:
+                    failed.append(futures[fut].get("name", "").split(" ")[0])
+                if result is None:
+                    RECORDS_SKIPPED.labels(stream="reports").inc()
+                else:
+                    EVENTS_PUSHED.labels(stream="reports", result="success" if result else "failed").inc()
 
-        self.log.info("Finished importing %i (%i skipped) Crowdstrike Threat Intelligence reports.", len(reports), self.skipped)
+        # Only confirmed reports move the import position forward
+        self.checkpoint.commit(page, failed)
+        memory_snapshot("reports", "pushed", reports=len(reports),
+                        related_indicators=sum(len(found) for found in indicators_by_report.values())
+                        )
 
-    def add_actor_detail(self, report: dict, event: MISPEvent) -> MISPEvent:
-        associated_actors = report.get('actors', [])
+    def report_actors(self, report: dict) -> list:
+        """Return the adversaries associated with a report."""
+        associated_actors = list(report.get('actors') or [])
         if not associated_actors:
             # Try to tag any actors mentioned in the report name or short description
             for act in self.known_actors:
                 # This might have to move to details.get("long_description")
-                if act["name"] in report.get("short_description", "") or act["name"] in report.get("name", ""):
+                if act["name"] in (report.get("short_description") or "") or act["name"] in report.get("name", ""):
                     associated_actors.append(act)
 
-        for actor in associated_actors:
+        return associated_actors
+
+    def add_actor_detail(self, report: dict, event: MISPEvent) -> MISPEvent:
+        for actor in self.report_actors(report):
             if actor.get('name'):
-                actor_detail = self.intel_api_client.falcon.get_actor_entities(ids=actor.get("id"))
-                if actor_detail["status_code"] == 200:
-                    actor_detail = actor_detail["body"]["resources"][0]
+                actor_detail = self.intel_api_client.actor_cache.get(actor.get("id"))
                 actor_name = actor.get('name').split(" ")
                 first = actor_detail.get("first_activity_date", 0)
                 last = actor_detail.get("last_activity_date", 0)
@@ -288,13 +370,14 @@ class ReportsImporter:
 
         return event
 
-    def add_indicator_detail(self, event: MISPEvent, report_id: str, indicator_list: list) -> MISPEvent:
+    def add_indicator_detail(self, event: MISPEvent, report_id: str, ind_list: list) -> MISPEvent:
         if report_id:
-            ind_list = [i for i in indicator_list if report_id in i.get("reports")]
             indicator_count = len(ind_list)
             if indicator_count:
                 self.log.debug("Retrieved %i indicators detailed within report %s", indicator_count, report_id)
-            for ind in ind_list:
+            # Related indicators are converted together, the report may carry thousands of them
+            converted = gen_indicators(ind_list)
+            for ind, indicator_object in zip(ind_list, converted):
                 galaxies = []
                 galaxy_tags = []
                 for malware_family in ind.get('malware_families', []):
@@ -303,8 +386,11 @@ class ReportsImporter:
                         galaxies.append(galaxy)
                     else:
                         galaxy_tags.append(malware_family)
-                indicator_object = gen_indicator(ind, self.settings["CrowdStrike"]["indicators_tags"].split(","))
-                if isinstance(indicator_object, MISPObject):
+                if isinstance(indicator_object, Exception):
+                    self.log.warning("Could not convert indicator %s for report %s.\n%s",
+                                     ind.get("id"), report_id, str(indicator_object)
+                                     )
+                elif isinstance(indicator_object, MISPObject):
                     event.add_object(indicator_object)
 
                 elif isinstance(indicator_object, MISPAttribute):
@@ -405,17 +491,19 @@ class ReportsImporter:
 
         return event
 
-    def create_event_from_report(self, report, report_details, indicator_list) -> MISPEvent:
-        """Create a MISP event from a Intel report."""
+    @profiled("build.report")
+    @traced("build.report")
+    def create_event_from_report(self, report, details, indicator_list) -> MISPEvent:
+        """Create a MISP event from a Intel report.
+
+        :param report: report record
+        :param details: extended report details for this report
+        :param indicator_list: indicators related to this report
+        """
         if report.get('name'):
             event = MISPEvent()
             event.analysis = 2
             event.orgc = self.crowdstrike_org
-            # Extended report details lookup
-            details = {}
-            for det in report_details:
-                if det.get("id") == report.get("id"):
-                    details = det
             report_name = report.get('name')
             # Report / Event name
             event.info = report_name
@@ -469,6 +557,7 @@ class ReportsImporter:
                 event.add_tag('iep2-policy:unmodified_resale="must-not"')
             if confirm_boolean_param(self.settings["TAGGING"].get("taxonomic_TLP", False)):
                 event.add_tag("tlp:amber")
+            stamp_uuids(event, "report", report_id)
 
         else:
             self.log.warning("Report %s missing name field.", report.get('id'))
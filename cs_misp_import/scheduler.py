@@ -0,0 +1,152 @@
+"""Shared MISP worker pool for concurrently running import streams.
+
+Report, adversary and indicator imports submit their MISP writes to a single bounded pool of
+workers. Work is dispatched using weighted fair (stride) scheduling across the streams, so
+a large backlog of indicator writes cannot starve report and adversary writes.
+"""
+import collections
+import concurrent.futures
+import logging
+import threading
+from .metrics import QUEUE_DEPTH
+
+
+class FairScheduler:
+    """Bounded worker pool dispatching queued work fairly between named streams."""
+
+    # Relative share of the workers given to each stream when they are all busy
+    DEFAULT_WEIGHTS = {"actors": 2, "reports": 2, "indicators": 1}
+
+    def __init__(self, workers: int, weights: dict = None, logger: logging.Logger = None):
+        """Construct an instance of the FairScheduler class.
+
+        :param workers: number of worker threads shared by every stream
+        :param weights: relative weight of each stream, unlisted streams have a weight of 1
+        :param logger: logging object
+        """
+        self.workers = max(1, int(workers))
+        self.weights = {**self.DEFAULT_WEIGHTS, **(weights or {})}
+        self.log = logger
+        self.queues = {}
+        self.passes = {}
+        self.virtual_time = 0.0
+        self.threads = []
+        self.shutting_down = False
+        self.cond = threading.Condition()
+
+    def submit(self, stream: str, fn, *args, **kwargs) -> concurrent.futures.Future:
+        """Queue work for the specified stream, returning a Future for the result."""
+        future = concurrent.futures.Future()
+        with self.cond:
+            if self.shutting_down:
+                raise RuntimeError("Cannot schedule new work after shutdown.")
+            queued = self.queues.setdefault(stream, collections.deque())
+            if not queued:
+                # An idle stream resumes at the current virtual time instead of claiming a backlog of turns
+                self.passes[stream] = max(self.passes.get(stream, 0.0), self.virtual_time)
+            queued.append((future, fn, args, kwargs))
+            QUEUE_DEPTH.labels(stream=stream, queue="misp").set(len(queued))
+            if len(self.threads) < self.workers:
+                self._start_worker()
+            self.cond.notify()
+
+        return future
+
+    def executor(self, stream: str):
+        """Return an executor style interface that submits work to this scheduler for the stream."""
+        return StreamExecutor(self, stream)
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers once the queued work has been completed."""
+        with self.cond:
+            self.shutting_down = True
+            self.cond.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def _start_worker(self):
+        thread = threading.Thread(target=self._work, name=f"thread_{len(self.threads)}", daemon=True)
+        self.threads.append(thread)
+        thread.start()
+
+    def _next(self):
+        with self.cond:
+            while True:
+                waiting = [stream for stream, queued in self.queues.items() if queued]
+                if waiting:
+                    stream = min(waiting, key=lambda s: self.passes[s])
+                    self.virtual_time = self.passes[stream]
+                    self.passes[stream] += 1.0 / max(self.weights.get(stream, 1), 0.001)
+                    task = self.queues[stream].popleft()
+                    QUEUE_DEPTH.labels(stream=stream, queue="misp").set(len(self.queues[stream]))
+                    return task
+                if self.shutting_down:
+                    return None
+                self.cond.wait()
+
+    def _work(self):
+        while True:
+            task = self._next()
+            if task is None:
+                return
+            future, fn, args, kwargs = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as err:  # pylint: disable=broad-except
+                future.set_exception(err)
+
+
+class StreamExecutor:
+    """Executor used by a single import stream to submit work to the shared FairScheduler.
+
+    Leaving the context waits for the work submitted through this executor, matching the
+    behaviour of the ThreadPoolExecutor it stands in for.
+    """
+
+    def __init__(self, scheduler: FairScheduler, stream: str):
+        """Construct an executor for the named stream."""
+        self.scheduler = scheduler
+        self.stream = stream
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> concurrent.futures.Future:
+        """Schedule the callable, returning a Future for the result."""
+        future = self.scheduler.submit(self.stream, fn, *args, **kwargs)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._finished)
+
+        return future
+
+    def shutdown(self, wait: bool = True):
+        """Wait for the work submitted through this executor, the shared workers keep running."""
+        if wait:
+            with self.lock:
+                pending = list(self.pending)
+            concurrent.futures.wait(pending)
+
+    def _finished(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=True)
+        return False
+
+
+def push_executor(scheduler: FairScheduler, stream: str, workers: int):
+    """Return the executor used to push a stream's events into MISP.
+
+    Uses the shared scheduler when one is provided, otherwise a dedicated thread pool.
+    """
+    if scheduler is not None:
+        return scheduler.executor(stream)
+
+    return concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="thread")
@@ -1,12 +1,26 @@
 import logging
 import requests
+import threading
 import time
 import os
+from collections import deque
+from .profiling import stage
+from .tracing import CLIENT, span
+from .helper import stamped_uuids
+from .metrics import (
+    DELETED_EVENTS,
+    DELETED_TAGS,
+    MISP_CONCURRENCY,
+    MISP_ERRORS,
+    MISP_IN_FLIGHT,
+    MISP_REQUEST_SECONDS,
+    MISP_RETRIES
+)
 
 try:
     import pymisp
     pymisp.api.everything_broken = {"key": ""}
-    from pymisp import ExpandedPyMISP, PyMISPError
+    from pymisp import ExpandedPyMISP, MISPEvent, PyMISPError
 
 except ImportError as no_pymisp:
     raise SystemExit(
@@ -14,8 +28,90 @@ except ImportError as no_pymisp:
         ) from no_pymisp
 
 
+class AdaptiveLimiter:
+    """AIMD concurrency limiter for requests sent to the MISP server.
+
+    The number of requests allowed in flight grows by roughly one for every full window of
+    healthy responses, and is halved on throttling (429), server errors, timeouts or a rising
+    p95 latency.
+    """
+    # Number of recent request latencies used to calculate the p95
+    WINDOW = 50
+    # p95 latency growth (over the best observed p95) treated as server distress
+    LATENCY_TOLERANCE = 2.0
+    # Per-request growth allowed in the baseline p95
+    BASELINE_DRIFT = 1.002
+
+    def __init__(self, max_limit: int, min_limit: int = 1, logger: logging.Logger = None):
+        """Construct an instance of the AdaptiveLimiter class.
+
+        :param max_limit: maximum number of requests in flight (thread count)
+        :param min_limit: minimum number of requests in flight
+        :param logger: logging object
+        """
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = float(max(self.min_limit, min(4, self.max_limit)))
+        self.in_flight = 0
+        self.latencies = deque(maxlen=self.WINDOW)
+        self.best_p95 = None
+        self.since_decrease = self.max_limit
+        self.log = logger
+        self.cond = threading.Condition()
+        MISP_CONCURRENCY.set(int(self.limit))
+
+    def acquire(self):
+        """Block until another request may be sent."""
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+            MISP_IN_FLIGHT.set(self.in_flight)
+
+    def release(self, latency: float, failed: bool = False):
+        """Record the outcome of a request and adjust the concurrency limit."""
+        with self.cond:
+            self.in_flight -= 1
+            MISP_IN_FLIGHT.set(self.in_flight)
+            self.since_decrease += 1
+            previous = int(self.limit)
+            if not failed:
+                self.latencies.append(latency)
+            p95 = self.p95()
+            if p95 is not None and len(self.latencies) == self.WINDOW:
+                # The baseline drifts upwards slowly so a permanently slower server is eventually accepted
+                self.best_p95 = p95 if self.best_p95 is None else min(self.best_p95 * self.BASELINE_DRIFT, p95)
+            distressed = failed or (
+                self.best_p95 is not None and p95 is not None and p95 > self.best_p95 * self.LATENCY_TOLERANCE
+                )
+            if distressed:
+                # Only back off once per window so a burst of slow responses is a single decrease
+                if self.since_decrease >= int(self.limit):
+                    self.limit = max(float(self.min_limit), self.limit / 2)
+                    self.since_decrease = 0
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            if int(self.limit) != previous:
+                MISP_CONCURRENCY.set(int(self.limit))
+                if self.log:
+                    self.log.debug("MISP request concurrency adjusted to %i (p95 %.2fs).", int(self.limit), p95 or 0)
+            self.cond.notify_all()
+
+    def p95(self) -> float:
+        """Return the p95 latency of the recent requests."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
 class MISP(ExpandedPyMISP):
     MAX_RETRIES = 3
+    # Event tags owned by the importer, only these are removed when an event is updated
+    MANAGED_TAG_PREFIX = "CrowdStrike:"
+    # Validation errors MISP reports for content that is already present (duplicate UUID or value)
+    DUPLICATE_ERRORS = ("already exists", "not unique")
 
     def __init__(self, *args, **kwargs):
         self.thread_count = int(kwargs.get("max_threads") or min(32, (os.cpu_count() or 1) * 4))
@@ -27,13 +123,298 @@ class MISP(ExpandedPyMISP):
         
         self.deleted_event_count = 0
         self.deleted_tag_count = 0
+        self.count_lock = threading.Lock()
+        # Requests in flight are gated adaptively, with thread_count as the ceiling
+        self.limiter = AdaptiveLimiter(self.thread_count, logger=self.log)
+
+    def add_event(self, *args, **kwargs):
+        return self._limited(super().add_event, *args, **kwargs)
+
+    def update_event(self, *args, **kwargs):
+        return self._limited(super().update_event, *args, **kwargs)
+
+    def add_attribute(self, *args, **kwargs):
+        return self._limited(super().add_attribute, *args, **kwargs)
+
+    def add_object(self, *args, **kwargs):
+        return self._limited(super().add_object, *args, **kwargs)
+
+    def update_attribute(self, *args, **kwargs):
+        return self._limited(super().update_attribute, *args, **kwargs)
+
+    def update_object(self, *args, **kwargs):
+        return self._limited(super().update_object, *args, **kwargs)
+
+    def upsert_event(self, event, pythonify: bool = False):
+        """Add an event, updating the existing event instead if one with the same UUID is already present.
+
+        Events whose UUID has been blocklisted by MISP return the blocklisted response, see blocklisted().
+        """
+        response = self.add_event(event, pythonify)
+        if self.already_exists(response):
+            response = self.update_event(event, event.uuid, pythonify)
+
+        return response
+
+    def update_event_delta(self, event, event_id=None, pythonify: bool = False):
+        """Bring an existing event in line with the provided event, sending only what has changed.
+
+        Content is matched on UUID, so this relies upon the stable UUIDs assigned to
+        CrowdStrike events. Falls back to a full upsert if the event cannot be retrieved.
+
+        Only content the importer created is removed: attributes and objects carrying the
+        stable UUIDs issued by stamp_uuids, and non-local tags within MANAGED_TAG_PREFIX.
+        Anything else on the event (analyst additions, local and galaxy tags, content of
+        events created with random UUIDs) is left in place. Events created before stable UUIDs
+        were issued carry random UUIDs, so content without a UUID match is matched on its
+        value (attribute type and value, object name and attribute values) before it is added.
+        """
+        existing = self._limited(super().get_event, event_id or event.uuid, pythonify=True)
+        if not isinstance(existing, MISPEvent):
+            return self.upsert_event(event, pythonify)
+
+        responses = []
+        owned = stamped_uuids(existing)
+        old_attributes = {att.uuid: att for att in existing.attributes}
+        legacy_attributes = {self._attribute_key(att): att for att in existing.attributes if att.uuid not in owned}
+        for att in event.attributes:
+            if att.uuid not in old_attributes and self._attribute_key(att) in legacy_attributes:
+                att.uuid = legacy_attributes[self._attribute_key(att)].uuid
+        new_attributes = {att.uuid: att for att in event.attributes}
+        added = [att for uuid, att in new_attributes.items() if uuid not in old_attributes]
+        if added:
+            responses.append(self.add_attribute(existing.id, added, break_on_duplicate=False))
+        for uuid in (old_attributes.keys() - new_attributes.keys()) & owned:
+            responses.append(self._limited(super().delete_attribute, uuid))
+        for uuid in old_attributes.keys() & new_attributes.keys():
+            if self._attribute_changed(old_attributes[uuid], new_attributes[uuid]):
+                responses.append(self._limited(super().update_attribute, new_attributes[uuid], uuid))
+
+        # Object UUIDs are derived from their content, so changed objects are replaced
+        old_objects = {obj.uuid for obj in existing.objects}
+        legacy_objects = {self._object_key(obj) for obj in existing.objects if obj.uuid not in owned}
+        new_objects = {obj.uuid: obj for obj in event.objects}
+        for uuid, misp_object in new_objects.items():
+            if uuid not in old_objects and self._object_key(misp_object) not in legacy_objects:
+                responses.append(self.add_object(existing.id, misp_object))
+        for uuid in (old_objects - new_objects.keys()) & owned:
+            responses.append(self._limited(super().delete_object, uuid))
+
+        old_reports = {rpt.uuid: rpt for rpt in existing.event_reports}
+        for event_report in event.event_reports:
+            if event_report.uuid not in old_reports:
+                responses.append(self._limited(super().add_event_report, existing.id, event_report))
+            elif old_reports[event_report.uuid].content != event_report.content:
+                responses.append(self._limited(super().update_event_report, event_report, event_report.uuid))
+
+        old_tags = {tag.name for tag in existing.tags}
+        new_tags = {tag.name for tag in event.tags}
+        managed = {tag.name for tag in existing.tags
+                   if tag.name.startswith(self.MANAGED_TAG_PREFIX) and str(getattr(tag, "local", 0)).lower() not in ("1", "true")
+                   }
+        for tag in new_tags - old_tags:
+            responses.append(self._limited(super().tag, existing.uuid, tag))
+        for tag in managed - new_tags:
+            responses.append(self._limited(super().untag, existing.uuid, tag))
+
+        changed_fields = [fld for fld in ("info", "threat_level_id", "analysis")
+                          if str(getattr(event, fld, "")) != str(getattr(existing, fld, ""))
+                          ]
+        if changed_fields:
+            metadata = MISPEvent()
+            metadata.uuid = existing.uuid
+            for fld in ("info", "threat_level_id", "analysis", "date", "distribution"):
+                source = event if fld in changed_fields or not hasattr(existing, fld) else existing
+                if hasattr(source, fld):
+                    setattr(metadata, fld, getattr(source, fld))
+            responses.append(self.update_event(metadata, existing.id, metadata=True))
+
+        errors = [r["errors"] for r in responses if isinstance(r, dict) and "errors" in r and not self.already_exists(r)]
+        if errors:
+            return {"errors": errors}
+        if pythonify:
+            return existing
+
+        return {"Event": {"id": existing.id, "uuid": existing.uuid}}
+
+    @staticmethod
+    def _attribute_key(attribute) -> tuple:
+        return attribute.type, str(attribute.value)
+
+    @staticmethod
+    def _object_key(misp_object) -> tuple:
+        return misp_object.name, tuple(sorted((att.object_relation, str(att.value)) for att in misp_object.attributes))
+
+    @staticmethod
+    def _attribute_changed(existing, attribute) -> bool:
+        # Fields left unset locally take server defaults, so they are not compared
+        for fld in ("category", "to_ids", "comment"):
+            if fld in attribute and str(attribute.get(fld) or "") != str(existing.get(fld) or ""):
+                return True
+
+        return sorted(tag.name for tag in existing.tags) != sorted(tag.name for tag in attribute.tags)
+
+    @classmethod
+    def already_exists(cls, response) -> bool:
+        """Confirm if every error in a MISP response reports content that is already present.
+
+        A bulk attribute add reports the errors of each attribute separately, so a response
+        mixing duplicates with other failures is not treated as already existing.
+        """
+        item_errors = cls.item_errors(response)
+
+        return bool(item_errors) and all(cls.duplicate(messages) for messages in item_errors.values())
+
+    @classmethod
+    def duplicate(cls, messages: list) -> bool:
+        """Confirm if the error messages reported for an item show it is already present."""
+        return any(dup in message.lower() for message in messages for dup in cls.DUPLICATE_ERRORS)
+
+    @classmethod
+    def item_errors(cls, response) -> dict:
+        """Return the error messages of a MISP response, keyed by the item they were reported for.
+
+        Bulk adds key the validation errors of each rejected item by its position in the request,
+        errors reported for the request as a whole are keyed by an empty string.
+        """
+        errors = response.get("errors") if isinstance(response, dict) else None
+        if not errors:
+            return {}
+        # PyMISP reports HTTP failures as a (status code, response body) pair
+        if isinstance(errors, (list, tuple)) and len(errors) == 2 and isinstance(errors[0], int):
+            errors = errors[1]
+        if isinstance(errors, dict) and ("name" in errors or "message" in errors):
+            errors = errors.get("errors") or [errors.get("message") or errors.get("name")]
+        if isinstance(errors, dict):
+            return {str(key): cls._messages(value) for key, value in errors.items()}
+
+        return {"": cls._messages(errors)}
+
+    @classmethod
+    def _messages(cls, errors) -> list:
+        if isinstance(errors, str):
+            return [errors]
+        if isinstance(errors, dict):
+            return [message for key, value in errors.items() if key != "url" for message in cls._messages(value)]
+        if isinstance(errors, (list, tuple)):
+            return [message for value in errors for message in cls._messages(value)]
+
+        return []
+
+    @staticmethod
+    def error_status(response):
+        """Return the HTTP status code reported by a MISP error response, if there is one.
+
+        PyMISP reports HTTP failures as a (status code, message) pair, while other errors
+        (such as the per-attribute errors of a bulk attribute add) arrive as a dictionary
+        or a plain message.
+        """
+        errors = response.get("errors") if isinstance(response, dict) else None
+        if not errors:
+            return None
+        if isinstance(errors, (list, tuple)):
+            status = errors[0]
+        elif isinstance(errors, dict):
+            status = errors.get("status", errors.get("code"))
+        else:
+            status = None
+
+        return status if isinstance(status, int) and not isinstance(status, bool) else None
+
+    @staticmethod
+    def blocklisted(response) -> bool:
+        """Confirm if a MISP response reports that the submitted event UUID is on the event blocklist.
+
+        MISP blocklists the UUID of every deleted event by default (MISP.enableEventBlocklisting),
+        and CrowdStrike events keep the same UUID for each record.
+        """
+        errors = response.get("errors") if isinstance(response, dict) else None
+
+        return bool(errors) and any(word in str(errors).lower() for word in ("blocklist", "blacklist"))
+
+    def delete_event_blocklists(self, event_uuids) -> int:
+        """Remove the blocklist entries MISP made for deleted events, returning the number removed.
+
+        :param event_uuids: UUIDs of the deleted events
+        """
+        event_uuids = set(event_uuids)
+        if not event_uuids:
+            return 0
+        try:
+            entries = self._limited(super().event_blocklists)
+        except Exception as err:  # pylint: disable=W0703
+            entries = {"errors": str(err)}
+        if not isinstance(entries, list):
+            # Blocklisting is disabled, or this user is not permitted to manage it
+            self.log.debug("Unable to retrieve the event blocklist: %s", entries)
+            return 0
+        removed = 0
+        for entry in entries:
+            entry = entry.get("EventBlocklist", entry) if isinstance(entry, dict) else {}
+            if entry.get("event_uuid") not in event_uuids:
+                continue
+            try:
+                result = self._retry(super().delete_event_blocklist, entry.get("id"))
+            except Exception as err:  # pylint: disable=W0703
+                result = {"errors": str(err)}
+            if isinstance(result, dict) and "errors" not in result:
+                removed += 1
+            else:
+                self.log.warning("Unable to remove event %s from the event blocklist: %s",
+                                 entry.get("event_uuid"), result.get("errors") if isinstance(result, dict) else result
+                                 )
+        if removed:
+            self.log.info("%i deleted events removed from the event blocklist.", removed)
+
+        return removed
 
     def delete_event(self, *args, **kwargs):
         if self.deleted_event_count % 50 == 0 and self.deleted_event_count:
             self.log.info("%i events deleted", self.deleted_event_count)
         result = self._retry(super().delete_event, *args, **kwargs)
         if "errors" not in result:
-            self.deleted_event_count += 1
+            with self.count_lock:
+                self.deleted_event_count += 1
+            DELETED_EVENTS.inc()
+
+        return result
+
+    def delete_events(self, event_ids: list) -> list:
+        """Delete a batch of events with a single request and return the IDs confirmed deleted.
+
+        MISP reports a bulk delete that removed only some of the events (missing events, or
+        events the user cannot delete) as a success, so the events still present afterwards are
+        looked up and left out of the returned IDs.
+        """
+        event_ids = [str(event_id) for event_id in event_ids]
+        try:
+            result = self._retry(self._delete_events, event_ids)
+        except (PyMISPError, requests.exceptions.RequestException):
+            return []
+        if "errors" in result:
+            return []
+        remaining = self._remaining_events(event_ids)
+        deleted = [event_id for event_id in event_ids if event_id not in remaining]
+        with self.count_lock:
+            self.deleted_event_count += len(deleted)
+        DELETED_EVENTS.inc(len(deleted))
+
+        return deleted
+
+    def _remaining_events(self, event_ids: list) -> set:
+        """Return the IDs of the events that are still present, assuming all are if MISP cannot be searched."""
+        try:
+            found = self._limited(super().search_index, eventid=event_ids, minimal=True)
+        except (PyMISPError, requests.exceptions.RequestException):
+            return set(event_ids)
+        if not isinstance(found, list):
+            return set(event_ids)
+
+        return {str(evt.get("id")) for evt in found if isinstance(evt, dict)} & set(event_ids)
+
+    def _delete_events(self, event_ids: list):
+        response = self._prepare_request("POST", "events/delete", data={"id": event_ids})
+        return self._check_json_response(response)
 
     def get_cs_tags(self):
         return self.search_tags("CrowdStrike:%")
@@ -47,7 +428,9 @@ class MISP(ExpandedPyMISP):
                 self.log.info("%i tags deleted", self.deleted_tag_count)
             result = self._retry(self.delete_tag, tag, **kwargs)
             if "errors" not in result:
-                self.deleted_tag_count += 1
+                with self.count_lock:
+                    self.deleted_tag_count += 1
+                DELETED_TAGS.inc()
 
         return self.deleted_tag_count
         #self.log.info("%i tags deleted", self.deleted_tag_count)
@@ -59,18 +442,48 @@ class MISP(ExpandedPyMISP):
     def get_organisation(self, *args, **kwargs):
         return self._retry(super().get_organisation, *args, **kwargs)
 
+    def _limited(self, f, *args, **kwargs):
+        """Send a request through the adaptive concurrency limiter."""
+        with stage("push.wait"):
+            self.limiter.acquire()
+        method = getattr(f, '__name__', 'request')
+        started = time.monotonic()
+        failed = True
+        try:
+            with stage(f"push.{method}"), span(f"misp.{method}", CLIENT) as request_span:
+                response = f(*args, **kwargs)
+                errors = response.get("errors") if isinstance(response, dict) else None
+                status = self.error_status(response)
+                if errors:
+                    request_span.set_attribute("http.response.status_code", status)
+                    if not self.already_exists(response):
+                        request_span.set_error(errors)
+            # Throttling and server errors are both signs the server needs fewer requests in flight
+            failed = status is not None and (status >= 500 or status == 429)
+            if errors and not self.already_exists(response):
+                MISP_ERRORS.labels(method=method, status=status if status is not None else "error").inc()
+            return response
+        except Exception:
+            MISP_ERRORS.labels(method=method, status="exception").inc()
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            MISP_REQUEST_SECONDS.labels(method=method).observe(elapsed)
+            self.limiter.release(elapsed, failed)
+
     def _retry(self, f, *args, **kwargs):
         for i in range(self.MAX_RETRIES):
             try:
-                response = f(*args, **kwargs)
+                response = self._limited(f, *args, **kwargs)
 
                 if "errors" not in response:
                     return response
-                if response["errors"][0] == 404:
+                if self.error_status(response) == 404:
                     return response
 
                 if i + 1 < self.MAX_RETRIES:
                     timeout = 0.3 * 2 ** i
+                    MISP_RETRIES.labels(method=getattr(f, '__name__', 'request')).inc()
                     self.log.warning('Caught an error from the MISP server: %s. Re-trying the request in %.2f seconds', response['errors'], timeout)
                     time.sleep(timeout)
                 else:
@@ -78,6 +491,7 @@ class MISP(ExpandedPyMISP):
             except Exception as e:
                 if i + 1 < self.MAX_RETRIES:
                     timeout = 0.3 * 2 ** i
+                    MISP_RETRIES.labels(method=getattr(f, '__name__', 'request')).inc()
                     self.log.warning('Caught an error from the MISP server. Re-trying the request in %.2f seconds', timeout)
                     time.sleep(timeout)
                 else:
@@ -0,0 +1,277 @@
+"""Per-record trace spans.
+
+Spans cover the CrowdStrike Intel API requests, MISP event construction and MISP requests made
+for each report, indicator and adversary. They are written to a local file in the OpenTelemetry
+OTLP JSON format (one ExportTraceServiceRequest per line, as written by the OpenTelemetry
+Collector file exporter), so no collector is needed to record them and the file can be replayed
+into any OTLP compatible backend later.
+
+Every span made while importing a record belongs to that record's trace. The trace ID is derived
+from the record type and ID, so the spans for a single indicator built on the convert thread and
+pushed on a MISP worker thread are found in the same trace. Tracing does nothing until a Tracer
+is installed (misp_import.py --trace).
+"""
+import contextlib
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from ._version import __version__ as VERSION
+
+# OTLP span kinds
+INTERNAL = 1
+CLIENT = 3
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# Tracer installed for this run, None when tracing is disabled
+_TRACER = None
+_CURRENT = contextvars.ContextVar("cs_misp_import_span", default=None)
+
+
+class Span:
+    """A single timed operation within a trace."""
+
+    __slots__ = ["trace_id", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "status", "message"]
+
+    def __init__(self, trace_id: str, span_id: str, parent_id: str, name: str, kind: int, attributes: dict):
+        """Construct a started span."""
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.start = time.time_ns()
+        self.end = None
+        self.status = STATUS_OK
+        self.message = None
+
+    def set_attribute(self, key: str, value):
+        """Add (or replace) an attribute."""
+        self.attributes[key] = value
+
+    def set_error(self, message: str):
+        """Mark the span as failed."""
+        self.status = STATUS_ERROR
+        self.message = str(message)[:1024]
+
+    def to_otlp(self) -> dict:
+        """Return the span in the OTLP JSON encoding."""
+        returned = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end or self.start),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": self.status}
+        }
+        if self.parent_id:
+            returned["parentSpanId"] = self.parent_id
+        if self.message:
+            returned["status"]["message"] = self.message
+
+        return returned
+
+
+class _NoopSpan:
+    """Stand-in returned when tracing is disabled."""
+
+    def set_attribute(self, key: str, value):
+        """Ignore the attribute."""
+
+    def set_error(self, message: str):
+        """Ignore the failure."""
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(item) for item in value]}}
+
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class SpanFileExporter:
+    """Append finished spans to a file in the OTLP JSON format, in batches.
+
+    :param filename: file the spans are appended to
+    :param batch_size: number of spans written per line
+    :param logger: logging object
+    """
+
+    def __init__(self, filename: str, batch_size: int = 512, logger: logging.Logger = None):
+        """Construct an instance of the SpanFileExporter class."""
+        self.filename = filename
+        self.batch_size = max(1, int(batch_size))
+        self.log = logger
+        self.pending = []
+        self.exported = 0
+        self.lock = threading.Lock()
+        self.resource = _otlp_attributes({
+            "service.name": "cs-misp-import",
+            "service.version": VERSION,
+            "service.instance.id": str(uuid.uuid4()),
+            "process.pid": os.getpid()
+        })
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, span: Span):
+        """Queue a finished span, writing the batch once it is full."""
+        with self.lock:
+            self.pending.append(span)
+            if len(self.pending) >= self.batch_size:
+                self._write()
+
+    def flush(self):
+        """Write any queued spans."""
+        with self.lock:
+            self._write()
+
+    def _write(self):
+        if not self.pending:
+            return
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": self.resource},
+                "scopeSpans": [{
+                    "scope": {"name": "cs_misp_import", "version": VERSION},
+                    "spans": [span.to_otlp() for span in self.pending]
+                }]
+            }]
+        }
+        try:
+            with open(self.filename, "a", encoding="utf-8") as trace_file:
+                trace_file.write(json.dumps(request, separators=(",", ":")) + "\n")
+            self.exported += len(self.pending)
+        except OSError as err:
+            if self.log:
+                self.log.warning("Unable to write trace spans to %s.\n%s", self.filename, str(err))
+        self.pending = []
+
+
+class Tracer:
+    """Create spans for each record and hand them to the exporter when they finish.
+
+    :param exporter: span exporter
+    :param logger: logging object
+    """
+
+    def __init__(self, exporter: SpanFileExporter, logger: logging.Logger = None):
+        """Construct an instance of the Tracer class."""
+        self.exporter = exporter
+        self.log = logger
+        # Keeps the trace IDs of separate runs apart
+        self.run_id = uuid.uuid4().hex
+        self.ids = random.Random()
+        self.lock = threading.Lock()
+
+    def _random_id(self, bits: int) -> str:
+        with self.lock:
+            return f"{self.ids.getrandbits(bits):0{bits // 4}x}"
+
+    def record_trace_id(self, kind: str, record_id) -> str:
+        """Return the trace ID shared by every span made for a record in this run."""
+        return hashlib.sha256(f"{self.run_id}:{kind}:{record_id}".encode("utf-8")).hexdigest()[:32]
+
+    @contextlib.contextmanager
+    def span(self, name: str, kind: int = INTERNAL, record: tuple = None, attributes: dict = None):
+        """Time the enclosed block as a span.
+
+        :param name: span name
+        :param kind: OTLP span kind (INTERNAL or CLIENT)
+        :param record: (record type, record ID) to start or join the trace of that record
+        :param attributes: span attributes
+        """
+        parent = _CURRENT.get()
+        attributes = dict(attributes or {})
+        if record is not None:
+            trace_id = self.record_trace_id(*record)
+            attributes.setdefault(f"crowdstrike.{record[0]}.id", str(record[1]))
+            parent_id = parent.span_id if parent is not None and parent.trace_id == trace_id else None
+        elif parent is not None:
+            trace_id = parent.trace_id
+            parent_id = parent.span_id
+        else:
+            trace_id = self._random_id(128)
+            parent_id = None
+        current = Span(trace_id, self._random_id(64), parent_id, name, kind, attributes)
+        token = _CURRENT.set(current)
+        try:
+            yield current
+        except BaseException as err:
+            current.set_error(err)
+            raise
+        finally:
+            _CURRENT.reset(token)
+            current.end = time.time_ns()
+            self.exporter.export(current)
+
+    def close(self):
+        """Write any spans still queued."""
+        self.exporter.flush()
+        if self.log:
+            self.log.info("%i trace spans written to %s.", self.exporter.exported, self.exporter.filename)
+
+
+def install_tracer(tracer: Tracer):
+    """Install the tracer used by every span, or remove it when None."""
+    global _TRACER  # pylint: disable=W0603
+    _TRACER = tracer
+
+
+def span(name: str, kind: int = INTERNAL, record: tuple = None, **attributes):
+    """Return a context manager recording the enclosed block as a span, when tracing is enabled.
+
+    :param name: span name
+    :param kind: OTLP span kind (INTERNAL or CLIENT)
+    :param record: (record type, record ID) to start or join the trace of that record
+    """
+    if _TRACER is None:
+        return contextlib.nullcontext(_NOOP_SPAN)
+
+    return _TRACER.span(name, kind, record, attributes)
+
+
+def record_result(record_span, returned):
+    """Record the outcome of importing a record (True imported, False failed, None unchanged) on its span."""
+    record_span.set_attribute("crowdstrike.result", {True: "imported", False: "failed"}.get(returned, "unchanged"))
+    if returned is False:
+        record_span.set_error("Record was not written to MISP")
+
+
+def traced(name: str):
+    """Decorate a function or method so each call is recorded as a span, when tracing is enabled."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _TRACER is None:
+                return func(*args, **kwargs)
+            with _TRACER.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -33,11 +33,20 @@ SOFTWARE.
 import argparse
 from configparser import ConfigParser, ExtendedInterpolation
 import logging
-import os
 import urllib3
 from cs_misp_import import (
     IntelAPIClient,
     CrowdstrikeToMISPImporter,
+    CheckpointJournal,
+    AuthCache,
+    StageProfiler,
+    install_profiler,
+    MemoryProfiler,
+    install_memory_profiler,
+    MetricsExporter,
+    Tracer,
+    SpanFileExporter,
+    install_tracer,
     MISP_BANNER,
     FINISHED_BANNER,
     CONFIG_BANNER,
@@ -79,6 +88,12 @@ def parse_command_line():
                         required=False,
                         action="store_true"
                         )
+    parser.add_argument("--rebuild_index",
+                        dest="rebuild_index",
+                        help="Rebuild the local import index from the events within the MISP instance.",
+                        required=False,
+                        action="store_true"
+                        )
     parser.add_argument("--no_banner",
                         dest="no_banner",
                         help="Enable or disable ASCII banners in logfile output, "
@@ -86,6 +101,48 @@ def parse_command_line():
                         required=False,
                         action="store_true"
                         )
+    parser.add_argument("--daemon",
+                        dest="daemon",
+                        help="Run continuously, polling each selected import on the interval set in the configuration file.",
+                        required=False,
+                        action="store_true"
+                        )
+    parser.add_argument("--profile",
+                        dest="profile",
+                        help="Time each stage of the run (Intel API paging, detail lookups, event construction, "
+                        "MISP requests and checkpointing) and log a summary when the run completes.",
+                        required=False,
+                        action="store_true"
+                        )
+    parser.add_argument("--profile_stats",
+                        dest="profile_stats",
+                        help="Capture cProfile statistics for each stage and write them, with the stage summary, "
+                        "to this directory (implies --profile).",
+                        required=False,
+                        default=None
+                        )
+    parser.add_argument("--memory_profile", "--memory-profile",
+                        dest="memory_profile",
+                        help="Trace memory use at the stage boundaries of each import and log the peak RSS, "
+                        "the top allocation sites and the records held by each import when the run completes.",
+                        required=False,
+                        action="store_true"
+                        )
+    parser.add_argument("--memory_profile_dir",
+                        dest="memory_profile_dir",
+                        help="Write the memory profile (memory_profile.json) to this directory "
+                        "(implies --memory_profile).",
+                        required=False,
+                        default=None
+                        )
+    parser.add_argument("--trace",
+                        dest="trace",
+                        help="Record a trace for each report, indicator and adversary (Intel API requests, event "
+                        "construction and MISP requests) and append the spans to this file in the OpenTelemetry "
+                        "OTLP JSON format.",
+                        required=False,
+                        default=None
+                        )
     parser.add_argument("--clean_tags",
                         dest="clean_tags",
                         help="Remove all CrowdStrike tags from the MISP instance",
@@ -103,6 +160,23 @@ def do_finished(logg: logging.Logger, arg_parser: argparse.ArgumentParser):
                    )
 
 
+def stop_instrumentation(profiler: StageProfiler,
+                         memory_profiler: MemoryProfiler,
+                         metrics: MetricsExporter,
+                         tracer: Tracer
+                         ):
+    """Report the profiles and stop the metrics and tracing enabled for this run."""
+    if profiler:
+        profiler.report()
+    if memory_profiler:
+        memory_profiler.report()
+        memory_profiler.stop()
+    if metrics:
+        metrics.stop()
+    if tracer:
+        tracer.close()
+
+
 def perform_local_cleanup(args: argparse.Namespace,
                           importer: CrowdstrikeToMISPImporter,
                           settings: ConfigParser,
@@ -111,20 +185,27 @@ def perform_local_cleanup(args: argparse.Namespace,
     """Remove local offset cache files to reset the marker for data pulls from the CrowdStrike API."""
     try:
         importer.clean_crowdstrike_events(args.clean_reports, args.clean_indicators, args.clean_actors)
-        if args.clean_reports and os.path.isfile(settings["CrowdStrike"]["reports_timestamp_filename"]):
-            os.remove(settings["CrowdStrike"]["reports_timestamp_filename"])
+        # The checkpoint journal is removed along with the timestamp file so the offset is not recovered
+        if args.clean_reports and CheckpointJournal.reset(settings["CrowdStrike"]["reports_timestamp_filename"]):
             log_device.info("Finished resetting CrowdStrike Report offset.")
-        if args.clean_indicators and os.path.isfile(settings["CrowdStrike"]["indicators_timestamp_filename"]):
-            os.remove(settings["CrowdStrike"]["indicators_timestamp_filename"])
+        if args.clean_indicators and CheckpointJournal.reset(settings["CrowdStrike"]["indicators_timestamp_filename"]):
             log_device.info("Finished resetting CrowdStrike Indicator offset.")
-        if args.clean_actors and os.path.isfile(settings["CrowdStrike"]["actors_timestamp_filename"]):
-            os.remove(settings["CrowdStrike"]["actors_timestamp_filename"])
+        if args.clean_actors and CheckpointJournal.reset(settings["CrowdStrike"]["actors_timestamp_filename"]):
             log_device.info("Finished resetting CrowdStrike Adversary offset.")
     except Exception as err:
         log_device.exception(err)
         raise SystemExit(err) from err
 
 
+def poll_intervals(settings):
+    """Retrieve the number of seconds between polls for each stream when running as a daemon."""
+    defaults = {"actors": 86400, "reports": 3600, "indicators": 60, "purge": 86400}
+    return {
+        stream: int(settings["CrowdStrike"].get(f"{stream}_poll_interval", None) or default)
+        for stream, default in defaults.items()
+    }
+
+
 def retrieve_tags(tag_type: str, settings):
     """Retrieve all tags used for CrowdStrike elements within MISP (broken out by type)."""
     tags = []
@@ -227,13 +308,19 @@ def main():
         pass
 
 
+    # Bearer tokens issued to previous runs are reused until they expire
+    auth_cache = None
+    if settings["CrowdStrike"].get("auth_cache_filename", None):
+        auth_cache = AuthCache(settings["CrowdStrike"]["auth_cache_filename"], main_log)
     # Interface to the CrowdStrike Falcon Intel API
     intel_api_client = IntelAPIClient(settings["CrowdStrike"]["client_id"],
                                       settings["CrowdStrike"]["client_secret"],
                                       settings["CrowdStrike"]["crowdstrike_url"],
                                       int(settings["CrowdStrike"]["api_request_max"]),
                                       False if "F" in settings["CrowdStrike"]["api_enable_ssl"].upper() else True,
-                                      main_log
+                                      main_log,
+                                      int(settings["CrowdStrike"].get("api_request_concurrency", None) or 4),
+                                      auth_cache
                                       )
     # Dictionary of settings provided by settings.py
     import_settings = {
@@ -243,10 +330,13 @@ def main():
         "reports_timestamp_filename": settings["CrowdStrike"]["reports_timestamp_filename"],
         "indicators_timestamp_filename": settings["CrowdStrike"]["indicators_timestamp_filename"],
         "actors_timestamp_filename": settings["CrowdStrike"]["actors_timestamp_filename"],
+        "import_index_filename": None if args.no_dupe_check else settings["CrowdStrike"].get("import_index_filename", None),
+        "purge_checkpoint_filename": settings["CrowdStrike"].get("purge_checkpoint_filename", None),
 #        "reports_unique_tag": settings["CrowdStrike"]["reports_unique_tag"],
 #        "indicators_unique_tag": settings["CrowdStrike"]["indicators_unique_tag"],
 #        "actors_unique_tag": settings["CrowdStrike"]["actors_unique_tag"],
         "unknown_mapping": settings["CrowdStrike"]["unknown_mapping"],
+        "indicator_grouping": settings["CrowdStrike"].get("indicator_grouping", None),
         "max_threads": settings["MISP"].get("max_threads", None),
         "miss_track_file": settings["MISP"].get("miss_track_file", "no_galaxy_mapping.log"),
         "misp_enable_ssl": False if "F" in settings["MISP"]["misp_enable_ssl"].upper() else True,
@@ -265,41 +355,78 @@ def main():
         "delete_outdated_indicators": args.delete_outdated_indicators,
         "actors": args.actors
     }
+    # Stage timers stay disabled unless profiling was requested
+    profiler = None
+    if args.profile or args.profile_stats:
+        profiler = StageProfiler(bool(args.profile_stats), args.profile_stats, main_log)
+        install_profiler(profiler)
+    # Allocations are only traced when memory profiling was requested, tracing slows the import
+    memory_profiler = None
+    if args.memory_profile or args.memory_profile_dir:
+        memory_profiler = MemoryProfiler(output_dir=args.memory_profile_dir, logger=main_log).start()
+        install_memory_profiler(memory_profiler)
+    # Record spans are only created when a trace file was requested
+    tracer = None
+    if args.trace:
+        tracer = Tracer(SpanFileExporter(args.trace, logger=main_log), main_log)
+        install_tracer(tracer)
     importer = CrowdstrikeToMISPImporter(intel_api_client, import_settings, provided_arguments, settings, logger=main_log)
-
-    if args.clean_reports or args.clean_indicators or args.clean_actors:
-        perform_local_cleanup(args, importer, settings, main_log)
-
-    if args.clean_tags:
-        importer.remove_crowdstrike_tags()
-
-    if args.reports or args.actors or args.indicators:
-        #try:
-        if not args.no_dupe_check:
-            tags = []
-            # Retrieve all tags for selected options
-            if args.actors:
-                tags.extend(retrieve_tags("actors", settings))
-                importer.import_from_misp(tags, do_reports=False)
-            if args.reports:
-                # Reports dupe identification is a little customized
-                tags.extend(retrieve_tags("reports", settings))
-                importer.import_from_misp(tags, do_reports=True)
-        # Import new events from CrowdStrike into MISP
-        importer.import_from_crowdstrike(int(settings["CrowdStrike"]["init_reports_days_before"]),
-                                            int(settings["CrowdStrike"]["init_indicators_minutes_before"]),
-                                            int(settings["CrowdStrike"]["init_actors_days_before"])
-                                            )
-        #except Exception as err:
-        #    main_log.exception(err)
-        #    raise SystemExit(err) from err
-
-    if args.max_age is not None:
-        try:
-            importer.clean_old_crowdstrike_events(args.max_age)
-        except Exception as err:
-            main_log.exception(err)
-            raise SystemExit(err) from err
+    # Run metrics are published for Prometheus when a textfile or port is configured
+    metrics = None
+    if settings["CrowdStrike"].get("metrics_textfile", None) or settings["CrowdStrike"].get("metrics_port", None):
+        metrics = MetricsExporter(settings["CrowdStrike"].get("metrics_textfile", None) or None,
+                                  int(settings["CrowdStrike"].get("metrics_port", None) or 0) or None,
+                                  settings["CrowdStrike"].get("metrics_address", None) or "127.0.0.1",
+                                  int(settings["CrowdStrike"].get("metrics_interval", None) or 15),
+                                  logger=main_log
+                                  ).start()
+
+    # The daemon purges aged events as it polls, rather than once the import completes
+    polling = args.daemon and (args.reports or args.actors or args.indicators)
+    try:
+        if args.clean_reports or args.clean_indicators or args.clean_actors:
+            perform_local_cleanup(args, importer, settings, main_log)
+
+        if args.clean_tags:
+            importer.remove_crowdstrike_tags()
+
+        if args.reports or args.actors or args.indicators:
+            #try:
+            if not args.no_dupe_check:
+                # Retrieve existing events for selected options when the local index is missing or stale
+                if args.actors and importer.index_requires_rebuild("actor", args.rebuild_index):
+                    importer.import_from_misp(retrieve_tags("actors", settings), do_reports=False)
+                if args.reports and importer.index_requires_rebuild("report", args.rebuild_index):
+                    # Reports dupe identification is a little customized
+                    importer.import_from_misp(retrieve_tags("reports", settings), do_reports=True)
+            if polling:
+                # Poll CrowdStrike for new events until stopped, purging aged events along the way
+                importer.run_daemon(poll_intervals(settings),
+                                    int(settings["CrowdStrike"]["init_reports_days_before"]),
+                                    int(settings["CrowdStrike"]["init_indicators_minutes_before"]),
+                                    int(settings["CrowdStrike"]["init_actors_days_before"]),
+                                    args.max_age
+                                    )
+            else:
+                # Import new events from CrowdStrike into MISP
+                importer.import_from_crowdstrike(int(settings["CrowdStrike"]["init_reports_days_before"]),
+                                                 int(settings["CrowdStrike"]["init_indicators_minutes_before"]),
+                                                 int(settings["CrowdStrike"]["init_actors_days_before"])
+                                                 )
+            #except Exception as err:
+            #    main_log.exception(err)
+            #    raise SystemExit(err) from err
+
+        if args.max_age is not None and not polling:
+            try:
+                importer.clean_old_crowdstrike_events(args.max_age)
+            except Exception as err:
+                main_log.exception(err)
+                raise SystemExit(err) from err
+    finally:
+        # Waits for queued MISP writes and commits the import index, including on SIGTERM in the daemon
+        importer.close()
+        stop_instrumentation(profiler, memory_profiler, metrics, tracer)
     do_finished(splash, args)
 
 
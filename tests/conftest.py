@@ -0,0 +1,38 @@
+"""Shared fixtures for the cs_misp_import tests."""
+import logging
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark.misp_stub import StubMISPServer  # noqa: E402  pylint: disable=C0413
+from cs_misp_import.threaded_misp import AdaptiveLimiter, MISP  # noqa: E402  pylint: disable=C0413
+
+
+@pytest.fixture
+def misp():
+    """Return a MISP client that never contacts a server, requests are made by the test."""
+    client = MISP.__new__(MISP)
+    client.thread_count = 4
+    client.log = logging.getLogger("tests")
+    client.deleted_event_count = 0
+    client.deleted_tag_count = 0
+    client.count_lock = threading.Lock()
+    client.limiter = AdaptiveLimiter(client.thread_count, logger=client.log)
+
+    return client
+
+
+@pytest.fixture(scope="module")
+def misp_server():
+    """Run the stub MISP REST server used by the offline benchmark."""
+    with StubMISPServer() as server:
+        yield server
+
+
+@pytest.fixture
+def misp_live(misp_server):
+    """Return a MISP client connected to the stub MISP server."""
+    return MISP(misp_server.url, "tests", False, False, max_threads=4, logger=logging.getLogger("tests"))
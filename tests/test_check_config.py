@@ -0,0 +1,27 @@
+"""Tests for the configuration checks."""
+import logging
+from cs_misp_import import check_config
+from cs_misp_import.auth_cache import AuthCache
+
+
+class Authenticated:
+    """Authentication result that records the SSL setting it was created with."""
+
+    token_status = 201
+
+    def __init__(self, *_, ssl_verify: bool = True, **__):
+        self.ssl_verify = ssl_verify
+
+
+def test_login_honours_the_ssl_setting(monkeypatch, tmp_path):
+    auth = {"creds": {"client_id": "a" * 32, "client_secret": "b" * 40}, "base_url": "auto"}
+    check_config.validate_crowdstrike_creds("api_enable_ssl", "False", {}, None, auth)
+    result = check_config.ConfigurationCheckResult(logging.getLogger("tests"))
+    created = []
+    monkeypatch.setattr(check_config, "Intel", lambda *args, **kwargs: created.append(Authenticated(*args, **kwargs)) or created[-1])
+    monkeypatch.setattr(AuthCache, "oauth", lambda self, *args, **kwargs: created.append(Authenticated(*args, **kwargs)) or created[-1])
+
+    check_config.validate_login(auth, result)
+    check_config.validate_login(auth, result, AuthCache(str(tmp_path / "auth_cache.json")))
+
+    assert [login.ssl_verify for login in created] == [False, False]
@@ -0,0 +1,69 @@
+"""Tests for the crash safe import position tracking."""
+import json
+import logging
+import os
+from cs_misp_import import checkpoint
+from cs_misp_import.checkpoint import CheckpointJournal
+
+
+def journal(tmp_path) -> CheckpointJournal:
+    return CheckpointJournal(str(tmp_path / "indicators_timestamp.lock"), logging.getLogger("tests"), "tests")
+
+
+def test_position_only_advances_past_confirmed_pages(tmp_path):
+    pages = journal(tmp_path)
+    first = pages.begin(100)
+    second = pages.begin(200)
+
+    pages.commit(second)
+    assert pages.position is None
+    pages.commit(first)
+    assert pages.position == 200
+
+
+def test_journaled_position_is_replayed_after_a_crash(tmp_path):
+    pages = journal(tmp_path)
+    pages.commit(pages.begin(100))
+    # Interrupted after journaling the mark, before the timestamp file was replaced
+    with open(pages.journal_filename, "a", encoding="utf-8") as journal_file:
+        journal_file.write(json.dumps({"op": "mark", "position": 200}) + "\n")
+        journal_file.write('{"op": "beg')
+
+    recovered = journal(tmp_path)
+    assert recovered.position == 200
+    with open(recovered.filename, "r", encoding="utf-8") as ts_file:
+        assert ts_file.read() == "200"
+
+
+def test_failed_items_are_abandoned_once_stalled_long_enough(tmp_path, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(checkpoint.time, "time", lambda: now[0])
+
+    def failed_run(position: int) -> CheckpointJournal:
+        pages = journal(tmp_path)
+        pages.commit(pages.begin(position), ["indicator-1"])
+        pages.close()
+        return pages
+
+    pages = journal(tmp_path)
+    pages.commit(pages.begin(100))
+    # Frequent polls during an outage hold the position without giving up on the item
+    for _ in range(CheckpointJournal.MAX_ATTEMPTS + 2):
+        now[0] += 60
+        assert failed_run(200).position == 100
+
+    now[0] += CheckpointJournal.STALL_TIMEOUT
+    assert failed_run(200).position == 200
+    with open(pages.journal_filename, "r", encoding="utf-8") as journal_file:
+        assert any(json.loads(line)["op"] == "abandon" for line in journal_file)
+
+
+def test_reset_removes_the_position_and_journal(tmp_path):
+    pages = journal(tmp_path)
+    pages.commit(pages.begin(100))
+
+    assert CheckpointJournal.reset(pages.filename)
+    assert not os.path.exists(pages.filename)
+    assert not os.path.exists(pages.journal_filename)
+    assert not CheckpointJournal.reset(pages.filename)
+    assert journal(tmp_path).position is None
@@ -0,0 +1,85 @@
+"""Tests for the bulk removal of CrowdStrike events."""
+import logging
+import os
+from pymisp import MISPEvent
+from cs_misp_import import CrowdstrikeToMISPImporter
+from cs_misp_import.cleanup import EventCleaner
+from cs_misp_import.helper import deterministic_uuid
+
+TAG = "CrowdStrike:report:type: CSIT"
+
+
+def report_event(report_id: str) -> MISPEvent:
+    event = MISPEvent()
+    event.info = f"{report_id} Test report"
+    event.uuid = deterministic_uuid("report", report_id)
+    event.add_tag(TAG)
+    event.add_attribute("domain", f"{report_id.lower()}.example.com")
+
+    return event
+
+
+def test_deleted_events_can_be_imported_again(misp_live):
+    event = report_event("CSIT-1001")
+    assert isinstance(misp_live.upsert_event(event, True), MISPEvent)
+
+    assert EventCleaner(misp_live, logging.getLogger("tests")).clean([TAG]) == 1
+
+    assert isinstance(misp_live.upsert_event(report_event("CSIT-1001"), True), MISPEvent)
+
+
+def test_blocklisted_events_are_reported(misp_live):
+    event = report_event("CSIT-1002")
+    created = misp_live.upsert_event(event, True)
+    # Deleted outside of the importer, so MISP keeps the UUID on its blocklist
+    assert misp_live.delete_events([created.id]) == [str(created.id)]
+
+    response = misp_live.upsert_event(report_event("CSIT-1002"), True)
+    assert misp_live.blocklisted(response)
+    assert not misp_live.already_exists(response)
+
+
+def test_events_with_several_tags_are_deleted_once(misp_live, monkeypatch):
+    tags = ["CrowdStrike:report:type: CSA", "CrowdStrike:report:type: CSWR"]
+    event = report_event("CSA-1003")
+    event.tags = []
+    for tag in tags:
+        event.add_tag(tag)
+    assert isinstance(misp_live.upsert_event(event, True), MISPEvent)
+    requested = []
+    delete_events = misp_live.delete_events
+    monkeypatch.setattr(misp_live, "delete_events", lambda event_ids: requested.extend(event_ids) or delete_events(event_ids))
+
+    assert EventCleaner(misp_live, logging.getLogger("tests")).clean(tags) == 1
+    assert len(requested) == 1
+
+
+def test_purge_checkpoint_stops_at_failed_deletes(misp_live, monkeypatch, tmp_path):
+    importer = CrowdstrikeToMISPImporter.__new__(CrowdstrikeToMISPImporter)
+    importer.misp_client = misp_live
+    importer.log = logging.getLogger("tests")
+    checkpoint_file = str(tmp_path / "purge_checkpoint")
+    importer.import_settings = {"no_banners": True, "force": False, "purge_checkpoint_filename": checkpoint_file}
+    assert isinstance(misp_live.upsert_event(report_event("CSIT-1004"), True), MISPEvent)
+    delete_events = misp_live.delete_events
+    monkeypatch.setattr(misp_live, "delete_events", lambda event_ids: [])
+    monkeypatch.setattr(misp_live, "delete_event", lambda event_id: {"errors": (500, "Unable to delete")})
+
+    # A negative age purges everything updated before tomorrow
+    importer.clean_old_crowdstrike_events(-1)
+    assert not os.path.exists(checkpoint_file)
+
+    monkeypatch.setattr(misp_live, "delete_events", delete_events)
+    importer.clean_old_crowdstrike_events(-1)
+    assert os.path.exists(checkpoint_file)
+
+
+def test_partly_failed_bulk_deletes_count_confirmed_events(misp_live, monkeypatch):
+    created = [misp_live.upsert_event(report_event(f"CSIT-100{pos}"), True) for pos in (5, 6)]
+    started = misp_live.deleted_event_count
+    # MISP reports the bulk delete as a success when it skips events the user cannot delete
+    delete_events = misp_live._delete_events
+    monkeypatch.setattr(misp_live, "_delete_events", lambda event_ids: delete_events(event_ids[:1]))
+
+    assert misp_live.delete_events([evt.id for evt in created]) == [str(created[0].id)]
+    assert misp_live.deleted_event_count - started == 1
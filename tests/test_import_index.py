@@ -0,0 +1,61 @@
+"""Tests for the local index of imported records."""
+from cs_misp_import.import_index import ImportIndex
+
+
+def test_records_persist_between_runs(tmp_path):
+    filename = str(tmp_path / "import_index.db")
+    index = ImportIndex(filename)
+    reports = index.view("report")
+    reports["CSIT-1001"] = "12"
+    index.mark_built("report")
+    index.close()
+
+    index = ImportIndex(filename)
+    reports = index.view("report")
+    assert "CSIT-1001" in reports
+    assert reports["CSIT-1001"]["event_id"] == "12"
+    assert len(reports) == 1
+    assert index.is_built("report")
+    assert not index.is_built("indicator")
+    index.close()
+
+
+def test_record_types_are_kept_apart(tmp_path):
+    index = ImportIndex(str(tmp_path / "import_index.db"))
+    index.view("report")["1001"] = "12"
+    index.view("actor")["1001"] = "13"
+    index.mark_built("report")
+
+    index.clear("report")
+
+    assert "1001" not in index.view("report")
+    assert index.view("actor")["1001"]["event_id"] == "13"
+    assert not index.is_built("report")
+    assert index.view("actor").pop("1001")["event_id"] == "13"
+    assert len(index.view("actor")) == 0
+    index.close()
+
+
+def test_records_with_a_content_hash_are_current_while_it_matches(tmp_path):
+    index = ImportIndex(str(tmp_path / "import_index.db"))
+    reports = index.view("report")
+    reports.put("1001", "12", "hash-1")
+
+    assert reports.is_current("1001", "hash-1")
+    assert not reports.is_current("1001", "hash-2")
+    assert not reports.is_current("1002", "hash-1")
+    index.close()
+
+
+def test_records_without_a_content_hash_are_current_until_modified(tmp_path):
+    index = ImportIndex(str(tmp_path / "import_index.db"))
+    reports = index.view("report")
+    reports["1001"] = "12"
+    updated = reports["1001"]["updated"]
+
+    assert reports.is_current("1001", "hash-1", updated)
+    assert reports.is_current("1001", "hash-1", str(updated - 60))
+    assert not reports.is_current("1001", "hash-1", updated + 60)
+    assert not reports.is_current("1001", "hash-1")
+    assert not reports.is_current("1001", "hash-1", "unknown")
+    index.close()
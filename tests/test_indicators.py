@@ -0,0 +1,59 @@
+"""Tests for the indicator import pipeline."""
+import logging
+import os
+import threading
+import pytest
+from benchmark.runner import ROOT, benchmark_import_settings, load_settings
+from benchmark.synthetic import SyntheticIntel
+from cs_misp_import import CrowdstrikeToMISPImporter, IntelAPIClient
+
+
+@pytest.fixture
+def importer(misp_server, tmp_path):
+    """Return an importer reading synthetic indicators (ten per page) and writing to the stub MISP server."""
+    log = logging.getLogger("tests")
+    settings, galaxy_maps = load_settings(os.path.join(ROOT, "misp_import.ini"))
+    import_settings = benchmark_import_settings(misp_server, settings, galaxy_maps, str(tmp_path), 2, None)
+    intel_api_client = IntelAPIClient(None, None, None, 10, logger=log, service=SyntheticIntel(0, 200, 5, 0, 0))
+    returned = CrowdstrikeToMISPImporter(intel_api_client, import_settings,
+                                         {"reports": False, "indicators": True,
+                                          "delete_outdated_indicators": False, "actors": False
+                                          },
+                                         settings, logger=log
+                                         )
+    yield returned
+    returned.close()
+
+
+def test_failed_push_stops_the_pipeline(importer, monkeypatch):
+    indicators_importer = importer.indicators_importer
+
+    def fail(*_):
+        raise RuntimeError("checkpoint unavailable")
+
+    monkeypatch.setattr(indicators_importer, "_complete_page", fail)
+    monkeypatch.setattr(indicators_importer, "PIPELINE_POLL", 0.05)
+
+    with pytest.raises(RuntimeError):
+        indicators_importer.process_indicators(1440, importer.imported_records("indicator"))
+
+    assert not [stage for stage in threading.enumerate() if stage.name in ("fetch", "convert")]
+
+
+def grouped_indicator(**fields) -> dict:
+    return {"id": "domain_grouped.example.com", "indicator": "grouped.example.com", "type": "domain",
+            "published_date": 1700000000, "last_updated": 1700000000, "malicious_confidence": "high",
+            "malware_families": [], "actors": [], "threat_types": [], "labels": [], **fields
+            }
+
+
+def test_changed_grouped_indicators_are_updated(importer):
+    indicators_importer = importer.indicators_importer
+    indicators_importer.grouping = "type"
+    indicators_importer.push_indicators([grouped_indicator()], {})
+    indicators_importer.push_indicators([grouped_indicator(last_updated=1700003600, threat_types=["Commodity"])], {})
+
+    event = importer.misp_client.get_event(indicators_importer._bucket_uuid("DOMAIN"), pythonify=True)
+    assert len(event.attributes) == 1
+    assert "CrowdStrike:indicator:threat: COMMODITY" in [tag.name for tag in event.attributes[0].tags]
+    assert not any(page["failed"] for page in indicators_importer.checkpoint.pages.values())
@@ -0,0 +1,68 @@
+"""Tests for the adversary detail cache."""
+import logging
+import threading
+import time
+from types import SimpleNamespace
+from cs_misp_import.intel_client import ActorDetailCache
+
+
+class ActorEntities:
+    """Intel API returning adversary details, failing the first `failures` requests."""
+
+    def __init__(self, failures: int = 0, delay: float = 0):
+        self.failures = failures
+        self.delay = delay
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def get_actor_entities(self, ids: list) -> dict:
+        with self.lock:
+            self.requested.append(list(ids))
+            failed = len(self.requested) <= self.failures
+        time.sleep(self.delay)
+        if failed:
+            return {"status_code": 429, "body": {"errors": [{"message": "API rate limit exceeded."}]}}
+
+        return {"status_code": 200, "body": {"resources": [{"id": int(actor), "name": f"ACTOR {actor}"} for actor in ids]}}
+
+
+def actor_cache(falcon: ActorEntities) -> ActorDetailCache:
+    return ActorDetailCache(SimpleNamespace(falcon=falcon), logging.getLogger("tests"))
+
+
+def test_concurrent_misses_share_one_request():
+    falcon = ActorEntities(delay=0.2)
+    cache = actor_cache(falcon)
+    details = []
+    threads = [threading.Thread(target=lambda: details.append(cache.get(7))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert falcon.requested == [["7"]]
+    assert [detail["name"] for detail in details] == ["ACTOR 7"] * 5
+
+
+def test_failed_lookups_are_not_cached():
+    falcon = ActorEntities(failures=2)
+    cache = actor_cache(falcon)
+
+    cache.prefetch([7])
+    assert cache.get(7) == {}
+    assert cache.get(7)["name"] == "ACTOR 7"
+    assert cache.get(7)["name"] == "ACTOR 7"
+    assert len(falcon.requested) == 3
+
+
+def test_clear_retrieves_the_details_again():
+    falcon = ActorEntities()
+    cache = actor_cache(falcon)
+    cache.prefetch([7, 8])
+    cache.get(7)
+
+    cache.clear()
+    cache.get(7)
+
+    assert len(falcon.requested) == 2
+    assert falcon.requested[-1] == ["7"]
@@ -0,0 +1,60 @@
+"""Tests for the CrowdStrike Intel API rate limit handling."""
+import time
+from cs_misp_import.rate_limit import GovernedIntel, RateLimitGovernor
+
+
+def test_retry_after_pauses_every_request():
+    governor = RateLimitGovernor()
+    started = time.monotonic()
+
+    governor.backoff({"Retry-After": "30"}, 0)
+
+    assert 29 <= governor.paused_until - started <= 31
+    assert governor.tokens == 0
+    assert governor.throttled == 1
+
+
+def test_ratelimit_retryafter_is_read_as_an_epoch_timestamp():
+    governor = RateLimitGovernor()
+    started = time.monotonic()
+
+    governor.backoff({"X-RateLimit-RetryAfter": str(int(time.time()) + 20)}, 0)
+
+    assert 18 <= governor.paused_until - started <= 21
+
+
+def test_backoff_without_headers_is_exponential_and_at_least_a_second():
+    governor = RateLimitGovernor()
+    started = time.monotonic()
+    governor.backoff({}, 3)
+    assert 7 <= governor.paused_until - started <= 9
+
+    governor = RateLimitGovernor()
+    started = time.monotonic()
+    governor.backoff({"Retry-After": "0"}, 0)
+    assert 0.9 <= governor.paused_until - started <= 1.1
+
+
+def test_update_follows_the_tenant_limit():
+    governor = RateLimitGovernor(burst=10)
+
+    governor.update({"X-RateLimit-Limit": "6000", "X-RateLimit-Remaining": "7"})
+
+    assert governor.rate == 6000 / 60 * RateLimitGovernor.HEADROOM
+    assert governor.tokens == 7 - RateLimitGovernor.RESERVE
+
+
+def test_throttled_requests_are_retried():
+    governor = RateLimitGovernor(rate=1000, burst=10, max_retries=2)
+    paused = []
+    governor.backoff = lambda headers, attempt: paused.append((headers, attempt))
+    responses = [{"status_code": 429, "headers": {"Retry-After": "1"}}, {"status_code": 200, "headers": {}, "body": {}}]
+
+    class Service:
+        def query_indicator_entities(self, **_):
+            return responses.pop(0)
+
+    result = GovernedIntel(Service(), governor).query_indicator_entities(limit=1)
+
+    assert result["status_code"] == 200
+    assert paused == [({"Retry-After": "1"}, 0)]
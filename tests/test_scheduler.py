@@ -0,0 +1,37 @@
+"""Tests for the shared MISP worker pool."""
+import threading
+import pytest
+from cs_misp_import.scheduler import FairScheduler
+
+
+def test_busy_streams_share_workers_by_weight():
+    scheduler = FairScheduler(1)
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+    # Hold the only worker so the backlog of both streams is queued before dispatch starts
+    blocker = scheduler.submit("actors", lambda: started.set() or release.wait(5))
+    assert started.wait(5)
+    futures = [scheduler.submit("indicators", ran.append, "indicators") for _ in range(30)]
+    futures += [scheduler.submit("reports", ran.append, "reports") for _ in range(30)]
+
+    release.set()
+    for future in [blocker, *futures]:
+        future.result(5)
+    scheduler.shutdown()
+
+    assert ran[:30].count("reports") == 20
+    assert ran[:30].count("indicators") == 10
+    assert len(ran) == 60
+
+
+
+def test_queued_work_completes_before_shutdown():
+    scheduler = FairScheduler(2)
+    futures = [scheduler.executor("reports").submit(lambda value=value: value * 2) for value in range(10)]
+
+    scheduler.shutdown()
+
+    assert [future.result(0) for future in futures] == [value * 2 for value in range(10)]
+    with pytest.raises(RuntimeError):
+        scheduler.submit("reports", print)
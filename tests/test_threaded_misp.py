@@ -0,0 +1,156 @@
+"""Tests for the MISP client wrapper."""
+from pymisp import MISPEvent, MISPObject, PyMISP
+from cs_misp_import.helper import stamp_uuids
+from cs_misp_import.threaded_misp import AdaptiveLimiter, MISP
+
+
+def test_error_status_reads_every_error_shape():
+    assert MISP.error_status({"errors": (404, {"message": "Not found"})}) == 404
+    assert MISP.error_status({"errors": [500, "Internal error"]}) == 500
+    assert MISP.error_status({"errors": {"0": {"value": ["A similar attribute already exists for this event."]}}}) is None
+    assert MISP.error_status({"errors": {"status": 403, "message": "Forbidden"}}) == 403
+    assert MISP.error_status({"errors": "The response is empty."}) is None
+    assert MISP.error_status({"Event": {"id": "1"}}) is None
+    assert MISP.error_status("not a dictionary") is None
+
+
+def test_already_exists_checks_each_item():
+    duplicate = {"uuid": ["The UUID provided is not unique"]}
+    assert MISP.already_exists({"errors": (403, {"name": "Could not add Event", "message": "Could not add Event",
+                                                 "errors": {"Event": {"uuid": ["An event with this uuid already exists."]}}
+                                                 })})
+    assert MISP.already_exists({"errors": (403, {"name": "Could not add Attributes", "errors": {"0": duplicate, "1": duplicate}})})
+    # A duplicate reported alongside a real failure is a failure
+    assert not MISP.already_exists({"errors": {"0": duplicate, "1": {"value": ["Value is required"]}}})
+    assert not MISP.already_exists({"errors": "The response is empty."})
+    assert not MISP.already_exists({"Event": {"id": "1"}})
+
+
+def requests_completed(limiter: AdaptiveLimiter, count: int, latency: float = 0.01, failed: bool = False):
+    for _ in range(count):
+        limiter.acquire()
+        limiter.release(latency, failed)
+
+
+def test_limiter_grows_by_one_per_window_of_healthy_requests():
+    limiter = AdaptiveLimiter(16)
+    assert int(limiter.limit) == 4
+
+    requests_completed(limiter, 5)
+    assert int(limiter.limit) == 5
+    requests_completed(limiter, 6)
+    assert int(limiter.limit) == 6
+    requests_completed(limiter, 500)
+    assert int(limiter.limit) == 16
+
+
+def test_limiter_halves_on_failures_once_per_window():
+    limiter = AdaptiveLimiter(16)
+    requests_completed(limiter, 500)
+
+    requests_completed(limiter, 1, failed=True)
+    assert int(limiter.limit) == 8
+    # Failures already in flight when the limit dropped do not halve it again
+    requests_completed(limiter, 3, failed=True)
+    assert int(limiter.limit) == 8
+    requests_completed(limiter, 100, failed=True)
+    assert int(limiter.limit) == 1
+
+
+def test_limiter_backs_off_on_throttling_and_server_errors(misp):
+    for status in (429, 503):
+        misp.limiter = AdaptiveLimiter(16)
+        requests_completed(misp.limiter, 500)
+
+        misp._limited(lambda: {"errors": (status, {"message": "Slow down"})})
+
+        assert int(misp.limiter.limit) == 8
+    misp._limited(lambda: {"errors": (403, {"message": "Forbidden"})})
+    assert int(misp.limiter.limit) == 8
+
+
+def test_limited_returns_dict_shaped_errors(misp):
+    partial = {
+        "attributes": [{"uuid": "a"}],
+        "errors": {"1": {"value": ["A similar attribute already exists for this event."]}}
+    }
+
+    def add_attribute(*_, **__):
+        return partial
+
+    assert misp._limited(add_attribute) is partial  # pylint: disable=W0212
+    assert misp.limiter.in_flight == 0
+
+
+def test_retry_stops_on_not_found(misp):
+    calls = []
+
+    def get_event(*_, **__):
+        calls.append(1)
+        return {"errors": (404, {"message": "Invalid event"})}
+
+    assert misp._retry(get_event)["errors"][0] == 404  # pylint: disable=W0212
+    assert len(calls) == 1
+
+
+def _report_event(*domains, tags=()):
+    event = MISPEvent()
+    event.info = "CSIT-2001 Test report"
+    for domain in domains:
+        event.add_attribute("domain", domain)
+    for tag in tags:
+        event.add_tag(tag)
+
+    return stamp_uuids(event, "report", "CSIT-2001")
+
+
+def test_update_event_delta_keeps_content_it_did_not_create(misp, monkeypatch):
+    built = _report_event("current.example.com", tags=["CrowdStrike:report:type: CSIT"])
+    # The server copy holds a domain dropped from the report, plus analyst additions
+    existing = _report_event("current.example.com", "dropped.example.com",
+                             tags=["CrowdStrike:report:type: CSIT", "CrowdStrike:report:type: CSA",
+                                   'workflow:state="complete"', 'misp-galaxy:threat-actor="Test"'
+                                   ]
+                             )
+    existing.id = "1"
+    analyst_attribute = existing.add_attribute("ip-dst", "192.0.2.1")
+    analyst_object = existing.add_object(MISPObject("domain-ip"))
+    analyst_object.add_attribute("domain", "analyst.example.com")
+    local_tag = existing.add_tag("CrowdStrike:analyst: REVIEWED")
+    local_tag.local = True
+    dropped = next(att.uuid for att in existing.attributes if att.value == "dropped.example.com")
+    calls = []
+    monkeypatch.setattr(PyMISP, "get_event", lambda self, *args, **kwargs: existing)
+    for method in ("delete_attribute", "delete_object", "tag", "untag", "add_attribute", "update_attribute"):
+        monkeypatch.setattr(PyMISP, method,
+                            lambda self, *args, __method=method, **kwargs: calls.append((__method, *args)) or {"saved": True}
+                            )
+
+    misp.update_event_delta(built, "1")
+
+    assert [call for call in calls if call[0] == "delete_attribute"] == [("delete_attribute", dropped)]
+    assert not [call for call in calls if call[0] == "delete_object"]
+    assert [call for call in calls if call[0] == "untag"] == [("untag", existing.uuid, "CrowdStrike:report:type: CSA")]
+    assert analyst_attribute.uuid not in [call[1] for call in calls]
+
+
+def test_update_event_delta_matches_content_created_with_random_uuids(misp, monkeypatch):
+    built = _report_event("current.example.com")
+    built.add_object(MISPObject("domain-ip")).add_attribute("domain", "object.example.com")
+    built = stamp_uuids(built, "report", "CSIT-2001")
+    # Created before stable UUIDs were issued, the server copy holds the same content under random UUIDs
+    existing = MISPEvent()
+    existing.info = built.info
+    existing.id = "1"
+    existing.add_attribute("domain", "current.example.com")
+    existing.add_object(MISPObject("domain-ip")).add_attribute("domain", "object.example.com")
+    calls = []
+    monkeypatch.setattr(PyMISP, "get_event", lambda self, *args, **kwargs: existing)
+    for method in ("delete_attribute", "delete_object", "add_attribute", "add_object", "update_attribute"):
+        monkeypatch.setattr(PyMISP, method,
+                            lambda self, *args, __method=method, **kwargs: calls.append((__method, *args)) or {"saved": True}
+                            )
+
+    misp.update_event_delta(built, "1")
+
+    assert not calls